@@ -8,6 +8,7 @@ import tiktoken
 from tqdm import tqdm
 
 from tricycle.configs import DebugConfig, ShakespeareConfig, SmolGPTConfig
+from tricycle.context import NoGrad
 from tricycle.functions import Softmax
 from tricycle.layers import Dropout, Layer
 from tricycle.models import GPT
@@ -46,12 +47,70 @@ def deactivate_dropout(model: Layer) -> Layer:
     return model
 
 
+def sample_token(probabilities: np.ndarray, sample=True) -> int:
+    """
+    Pick the next token from a probability distribution over the vocabulary
+    """
+    if sample:
+        return np.random.choice(
+            list(range(config.vocab_size)), p=probabilities
+        )
+    return np.argmax(probabilities)
+
+
+def generate_cached(
+    model: GPT,
+    tokens: list[int],
+    sample=True,
+    temperature=0.8,
+):
+    """
+    Given a prompt, yield next token predictions for a model, using the kv
+    cache so that only the newest token is passed through the model each step
+    """
+    model.reset_kv_cache()
+    tokens = tokens[-config.context_window :]
+    new_tokens = tokens
+
+    while True:
+        # once the cache is full, the oldest token falls out of the context
+        # window and every position changes so we need to rebuild the cache
+        if len(tokens) > config.context_window:
+            model.reset_kv_cache()
+            tokens = tokens[-config.context_window :]
+            new_tokens = tokens
+
+        encoded = Tensor(
+            new_tokens, dtype=np.uint32, requires_grad=False, is_batched=False
+        )
+
+        with NoGrad():
+            pred = model(encoded, use_cache=True)
+
+            # we only need a prediction for the final token
+            pred = Tensor(pred.array[:, -1], is_batched=True)
+            pred = Softmax()(pred / temperature)
+
+        if pred.on_gpu:
+            probabilities = pred.xp.asnumpy(pred.array[0])
+        else:
+            probabilities = pred.array[0]
+
+        next_token = sample_token(probabilities, sample=sample)
+
+        tokens.append(next_token)
+        new_tokens = [next_token]
+
+        # convert from numpy int to python int
+        yield int(next_token)
+
+
 def generate(
     model: GPT,
     tokens: np.ndarray | None = None,
     sample=True,
     temperature=0.8,
-    pad_token=-1,
+    use_cache=True,
 ):
     """
     Given a prompt, yield next token predictions for a model
@@ -59,19 +118,26 @@ def generate(
     if isinstance(tokens, np.ndarray):
         tokens = tokens.tolist()
 
+    if use_cache:
+        yield from generate_cached(
+            model=model,
+            tokens=list(tokens),
+            sample=sample,
+            temperature=temperature,
+        )
+        return
+
     while True:
         tokens = tokens[-config.context_window :]
         n_tokens = len(tokens)
-        if n_tokens < config.context_window:
-            pad_tokens = [pad_token] * (config.context_window - n_tokens)
-            tokens += pad_tokens
 
         encoded = Tensor(
             tokens, dtype=np.uint32, requires_grad=False, is_batched=False
         )
 
-        pred = model(encoded)
-        pred = Softmax()(pred / temperature)
+        with NoGrad():
+            pred = model(encoded)
+            pred = Softmax()(pred / temperature)
 
         next_token_idx = n_tokens - 1
 
@@ -81,15 +147,8 @@ def generate(
             probabilities = pred.array[0][next_token_idx]
 
         # sample according to probabilities
-        if sample:
-            next_token = np.random.choice(
-                list(range(config.vocab_size)), p=probabilities
-            )
-        else:
-            next_token = np.argmax(probabilities)
+        next_token = sample_token(probabilities, sample=sample)
 
-        # remove padding + add new token
-        tokens = tokens[:n_tokens]
         tokens.append(next_token)
 
         # convert from numpy int to python int
@@ -193,9 +252,7 @@ if __name__ == "__main__":
         sample_tokens = sample_tokens.tolist()
     generated = copy(sample_tokens)
     prev = args.prompt
-    for token in generate(
-        tokens=sample_tokens, model=model, sample=True, pad_token=0
-    ):
+    for token in generate(tokens=sample_tokens, model=model, sample=True):
         if args.dataset == "fineweb" and token == dataset.tokeniser.eot_token:
             break
         generated += [token]
@@ -28,7 +28,9 @@ except Exception as e:
 
 from . import (
     activation,
+    arena,
     attention,
+    benchmark,
     binary,
     blocks,
     configs,
@@ -37,14 +39,23 @@ from . import (
     einsum,
     exceptions,
     functions,
+    generation,
+    graph,
     initialisers,
     layers,
     loss,
+    memory,
     models,
     ops,
     optimisers,
+    parallel,
+    parameters,
+    precision,
+    profiler,
+    quantisation,
     reduce,
     scheduler,
+    sparse,
     tensor,
     tokeniser,
     unary,
@@ -54,7 +65,9 @@ from . import (
 
 __all__ = [
     "activation",
+    "arena",
     "attention",
+    "benchmark",
     "binary",
     "blocks",
     "configs",
@@ -63,14 +76,23 @@ __all__ = [
     "einsum",
     "exceptions",
     "functions",
+    "generation",
+    "graph",
     "initialisers",
     "layers",
     "loss",
+    "memory",
     "models",
     "ops",
     "optimisers",
+    "parallel",
+    "parameters",
+    "precision",
+    "profiler",
+    "quantisation",
     "reduce",
     "scheduler",
+    "sparse",
     "tensor",
     "tokeniser",
     "unary",
@@ -3,6 +3,7 @@ from tricycle.functions import Sigmoid
 from tricycle.initialisers import init_xavier
 from tricycle.layers import Dense, Layer
 from tricycle.optimisers import Optimiser
+from tricycle.precision import activation_dtype, compute_dtype
 from tricycle.tensor import Tensor
 from tricycle.unary import UnaryMax
 
@@ -94,6 +95,10 @@ class Swish(Layer):
             out, args=(tensor,), back_fns=(self.backward,), name="swish"
         )
 
+    def clear_activations(self):
+        """Forget the input stored for the backward pass."""
+        self._input = None
+
 
 class GeLU(Layer):
     """
@@ -136,10 +141,11 @@ class GeLU(Layer):
         xp = grad.xp
 
         # Hyperbolic trig functions (cosh and tanh) use exponents under the
-        # hood which can overflow/underflow when using 16 bit precision so
-        # we need to switch to 32 bit precision
-        if TRICYCLE_CONTEXT.use_mixed_precision:
-            self._input = self._input.astype(xp.float32)
+        # hood which can overflow/underflow when using 16 bit precision so,
+        # by default, the precision policy switches to 32 bit precision
+        dtype = compute_dtype("gelu")
+        if dtype is not None:
+            self._input = self._input.astype(dtype, copy=False)
 
         inner = (
             self.CONST_1 * self._input * (1 + self.CONST_2 * self._input**2)
@@ -154,9 +160,10 @@ class GeLU(Layer):
         cosh = xp.cosh(inner)
         right = coef / (cosh * cosh)
 
-        if TRICYCLE_CONTEXT.use_mixed_precision:
-            left = left.astype(xp.float16)
-            right = right.astype(xp.float16)
+        dtype = activation_dtype()
+        if dtype is not None:
+            left = left.astype(dtype, copy=False)
+            right = right.astype(dtype, copy=False)
 
         self._grad = 0.5 * (1 + left + right) * grad.array
 
@@ -182,26 +189,32 @@ class GeLU(Layer):
         self._input = tensor.array
 
         # Tanh tends to overflow/underflow when using 16 bit precision
-        # so we need to switch to 32 bit
-        if TRICYCLE_CONTEXT.use_mixed_precision:
-            self._input = self._input.astype(xp.float32)
+        # so, by default, the precision policy switches to 32 bit
+        dtype = compute_dtype("gelu")
+        if dtype is not None:
+            self._input = self._input.astype(dtype, copy=False)
 
         inner = self.CONST_1 * (self._input + self.CONST_2 * self._input**3)
         result = self._input * 0.5 * (1 + xp.tanh(inner))
 
-        if TRICYCLE_CONTEXT.use_mixed_precision:
-            self._input = self._input.astype(xp.float16)
-            result = result.astype(xp.float16)
+        dtype = activation_dtype()
+        if dtype is not None:
+            self._input = self._input.astype(dtype, copy=False)
+            result = result.astype(dtype, copy=False)
 
-        result = Tensor(
+        return Tensor(
             result,
             is_batched=tensor.is_batched,
             requires_grad=tensor.requires_grad,
+            args=(tensor,),
+            back_fns=(self.backward,),
+            name="gelu",
         )
-        result.name = "gelu"
-        result.args = (tensor,)
-        result.back_fns = (self.backward,)
-        return result
+
+    def clear_activations(self):
+        """Forget the input and gradient stored for the backward pass."""
+        self._input = None
+        self._grad = None
 
 
 class GLU(Layer):
@@ -264,6 +277,12 @@ class GLU(Layer):
         """
         self.linear.zero_grad()
 
+    def clear_activations(self):
+        """Forget any intermediate values stored for the backward pass."""
+        self.linear.clear_activations()
+        self.sigmoid._out = None
+        self.sigmoid._grad = None
+
     def to_gpu(self):
         """
         Move the layer parameters to GPU memory.
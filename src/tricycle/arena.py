@@ -0,0 +1,221 @@
+"""
+A pool of reusable arrays to avoid allocating new memory every step.
+
+Training a model runs the same operations with the same shapes every step,
+so the arrays that were allocated for one step can be reused for the next.
+A `BufferArena` hands out arrays keyed by their backend, shape and dtype
+and takes them all back at the end of each step.
+
+Ops get their arrays from `empty` and `zeros` in this module. If there is no
+arena active, these just allocate a new array.
+
+Example usage:
+    >>> arena = BufferArena()
+    >>> with UseArena(arena):
+    ...     for inputs, outputs in dataloader:
+    ...         loss = loss_fn(outputs, model(inputs))
+    ...         loss.backward()
+    ...         model.update(optimiser)
+    ...         model.zero_grad()
+    ...         arena.reset()
+    >>> arena.stats()
+    {...}
+
+Arrays handed out by the arena are only valid until the next call to
+`reset`, so `reset` should only be called once the gradients for a step
+have been used.
+"""
+
+import threading
+from collections import defaultdict
+
+import numpy as np
+
+from tricycle.context import TRICYCLE_CONTEXT
+
+
+class BufferArena:
+    """
+    A pool of arrays that can be reused between steps.
+
+    Attributes:
+        n_requests (int): The number of arrays that have been requested.
+        n_reused (int): The number of requests that were served with an
+            existing array.
+        in_use_bytes (int): The size of all arrays currently handed out.
+        peak_bytes (int): The largest value that `in_use_bytes` has reached.
+        reserved_bytes (int): The size of every array owned by the arena.
+    """
+
+    def __init__(self):
+        self._free = defaultdict(list)
+        self._in_use = {}
+        self.n_requests = 0
+        self.n_reused = 0
+        self.in_use_bytes = 0
+        self.peak_bytes = 0
+        self.reserved_bytes = 0
+        # backward functions can run on several threads at once (see
+        # tricycle/graph.py:ThreadedBackward)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(shape, dtype, xp) -> tuple:
+        return (xp.__name__, tuple(shape), np.dtype(dtype).str)
+
+    def acquire(self, shape, dtype, xp=np):
+        """
+        Get an array with the given shape and dtype.
+
+        The contents of the array are undefined.
+
+        Args:
+            shape: The shape of the array.
+            dtype: The dtype of the array.
+            xp: The array module (numpy or cupy) to allocate with.
+                Defaults to numpy.
+
+        Returns:
+            An uninitialised array.
+        """
+        key = self._key(shape, dtype, xp)
+        with self._lock:
+            self.n_requests += 1
+
+            free = self._free[key]
+            if free:
+                array = free.pop()
+                self.n_reused += 1
+            else:
+                array = xp.empty(shape, dtype=dtype)
+                self.reserved_bytes += array.nbytes
+
+            self._in_use[id(array)] = (key, array)
+            self.in_use_bytes += array.nbytes
+            self.peak_bytes = max(self.peak_bytes, self.in_use_bytes)
+        return array
+
+    def release(self, array):
+        """
+        Return a single array to the pool before the end of the step.
+
+        Args:
+            array: An array that was returned by `acquire`.
+        """
+        with self._lock:
+            key, array = self._in_use.pop(id(array))
+            self._free[key].append(array)
+            self.in_use_bytes -= array.nbytes
+
+    def reset(self):
+        """
+        Return every array that has been handed out to the pool.
+
+        This should be called at the end of each step.
+        """
+        for key, array in self._in_use.values():
+            self._free[key].append(array)
+        self._in_use = {}
+        self.in_use_bytes = 0
+
+    def clear(self):
+        """
+        Forget every array owned by the arena so its memory can be freed.
+        """
+        self._free = defaultdict(list)
+        self._in_use = {}
+        self.in_use_bytes = 0
+        self.reserved_bytes = 0
+
+    @property
+    def reuse_rate(self) -> float:
+        """
+        The fraction of requests that were served without allocating.
+        """
+        if not self.n_requests:
+            return 0.0
+        return self.n_reused / self.n_requests
+
+    def stats(self) -> dict:
+        """
+        Summarise how the arena has been used.
+
+        Returns:
+            dict: Statistics about the arena.
+        """
+        return {
+            "n_requests": self.n_requests,
+            "n_reused": self.n_reused,
+            "reuse_rate": self.reuse_rate,
+            "in_use_bytes": self.in_use_bytes,
+            "peak_bytes": self.peak_bytes,
+            "reserved_bytes": self.reserved_bytes,
+        }
+
+
+class UseArena:
+    """Context manager that makes ops allocate arrays from an arena.
+
+    Tensors don't copy the arrays they are given so some outputs (e.g. from
+    a `Dense` layer, including the logits of a GPT) are arena arrays
+    themselves. They are overwritten by the next step once `reset` has been
+    called. Anything that needs to outlive the step should be copied first,
+    e.g. with `Tensor(logits.array, copy=True)`.
+
+    Args:
+        arena (BufferArena): The arena to allocate from.
+    """
+
+    def __init__(self, arena: BufferArena):
+        self.arena = arena
+        self._previous = None
+
+    def __enter__(self):
+        """Start allocating from the arena."""
+        self._previous = TRICYCLE_CONTEXT.arena
+        TRICYCLE_CONTEXT.arena = self.arena
+        return self.arena
+
+    def __exit__(self, *args, **kwargs):
+        """Go back to allocating new arrays."""
+        TRICYCLE_CONTEXT.arena = self._previous
+
+
+def empty(shape, dtype, xp=np):
+    """
+    Get an uninitialised array, from the active arena if there is one.
+
+    Args:
+        shape: The shape of the array.
+        dtype: The dtype of the array.
+        xp: The array module (numpy or cupy) to allocate with.
+            Defaults to numpy.
+
+    Returns:
+        An uninitialised array.
+    """
+    arena = TRICYCLE_CONTEXT.arena
+    if arena is None:
+        return xp.empty(shape, dtype=dtype)
+    return arena.acquire(shape, dtype, xp)
+
+
+def zeros(shape, dtype, xp=np):
+    """
+    Get an array of zeros, from the active arena if there is one.
+
+    Args:
+        shape: The shape of the array.
+        dtype: The dtype of the array.
+        xp: The array module (numpy or cupy) to allocate with.
+            Defaults to numpy.
+
+    Returns:
+        An array of zeros.
+    """
+    arena = TRICYCLE_CONTEXT.arena
+    if arena is None:
+        return xp.zeros(shape, dtype=dtype)
+    array = arena.acquire(shape, dtype, xp)
+    array.fill(0)
+    return array
@@ -12,6 +12,7 @@ import numpy as np
 
 from tricycle import GPU_ENABLED
 from tricycle.context import TRICYCLE_CONTEXT
+from tricycle.einsum import einsum
 from tricycle.ops import Op
 from tricycle.tensor import Tensor
 
@@ -48,6 +49,12 @@ class Attention(Op):
         context_window: An integer representing the size of the context window.
         mask: A tensor representing the attention mask.
         _grad: A tensor to store gradients during backpropagation.
+        _key_cache: Keys for every token seen so far when decoding with a
+            kv cache.
+        _value_cache: Values for every token seen so far when decoding with
+            a kv cache.
+        n_cached_tokens: The number of tokens currently stored in the kv
+            cache.
     """
 
     def __init__(
@@ -71,6 +78,21 @@ class Attention(Op):
             context_window=self.context_window, n_heads=self.n_heads
         )
         self._grad = None
+        self.reset_kv_cache()
+
+    def reset_kv_cache(self):
+        """Forget any keys and values stored in the kv cache."""
+        self._key_cache = None
+        self._value_cache = None
+        self.n_cached_tokens = 0
+
+    def clear_activations(self):
+        """Forget the intermediate values stored for the backward pass."""
+        self._input = None
+        self._query = None
+        self._key = None
+        self._value = None
+        self._before_smush = None
 
     def backward(self, grad: Tensor):
         """Compute the gradient of the attention operation.
@@ -82,7 +104,6 @@ class Attention(Op):
             A Tensor representing the gradient with respect to the input.
         """
         xp = grad.xp
-        in_shape = (self.batch_size, self.context_window, self.embedding_dim)
 
         attention = grad.array
 
@@ -91,70 +112,179 @@ class Attention(Op):
         attention = attention.reshape(
             (
                 self.batch_size,
-                self.context_window,
+                self.n_tokens,
                 self.n_heads,
                 self.head_size,
             )
         )
-        value = xp.einsum("BNIj, BINH -> BNjH", self._before_smush, attention)
-        attention = xp.einsum("BINH, BNjH -> BNIj", attention, self._value)
+        value = einsum("BNIj, BINH -> BNjH", self._before_smush, attention)
+        attention = einsum("BINH, BNjH -> BNIj", attention, self._value)
 
-        # softmax
+        # softmax. `attention` is a fresh array so we can work in place
+        # instead of allocating a new (B, N, T, T) array for each step
         inner = xp.sum(attention * self._before_smush, axis=-1, keepdims=True)
-        attention = self._before_smush * (attention - inner)
+        attention -= inner
+        attention *= self._before_smush
 
-        # mask
-        attention = xp.where(
-            self.mask[:, : self.n_tokens, : self.n_tokens], 0, attention
-        )
+        # mask. There is no need to mask explicitly: the softmax output is
+        # exactly 0 wherever the mask was applied so the gradient is too
         attention /= self.divisor
 
         # attend
-        query = xp.einsum("BNIJ, BNJh -> BNIh", attention, self._key)
-        key = xp.einsum("BNIh, BNIJ -> BNJh", self._query, attention)
+        query = einsum("BNIJ, BNJh -> BNIh", attention, self._key)
+        key = einsum("BNIh, BNIJ -> BNJh", self._query, attention)
+
+        return self._merge_grads(xp, query, key, value)
+
+    def _merge_grads(self, xp, query, key, value) -> Tensor:
+        """Combine per-head gradients into a gradient for the input.
+
+        Args:
+            xp: The array module (numpy or cupy) to use.
+            query: Gradient of the query, with shape (B, N, T, H).
+            key: Gradient of the key, with shape (B, N, T, H).
+            value: Gradient of the value, with shape (B, N, T, H).
+
+        Returns:
+            A Tensor of shape (batch_size, n_tokens, embedding_dim * 3).
+        """
+        in_shape = (self.batch_size, self.n_tokens, self.embedding_dim)
 
         # reshape + reorder
-        key = xp.einsum("BNTH->BTNH", key)
-        query = xp.einsum("BNTH->BTNH", query)
-        value = xp.einsum("BNTH->BTNH", value)
+        key = einsum("BNTH->BTNH", key)
+        query = einsum("BNTH->BTNH", query)
+        value = einsum("BNTH->BTNH", value)
 
         key = key.reshape(in_shape)
         query = query.reshape(in_shape)
         value = value.reshape(in_shape)
 
-        # merge into single tensor
-        if self._grad is None:
-            self._grad = xp.zeros(
-                (self.batch_size, self.context_window, self.embedding_dim * 3)
-            )
+        # merge into single tensor. Every element gets overwritten so there
+        # is no need to fill it with zeros first. The result is wrapped
+        # without copying so we need a new buffer each time
+        grad_shape = (self.batch_size, self.n_tokens, self.embedding_dim * 3)
+        self._grad = xp.empty(grad_shape, dtype=query.dtype)
         self._grad[:, :, : self.embedding_dim] = query
         self._grad[:, :, self.embedding_dim : self.embedding_dim * 2] = key
         self._grad[:, :, self.embedding_dim * 2 :] = value
 
         return Tensor(self._grad)
 
-    def forward(self, tensor: Tensor):
+    def cached_forward(self, tensor: Tensor):
+        """Attend from new tokens to every token seen so far.
+
+        The keys and values for the new tokens are appended to the kv cache
+        so that, during generation, we only need to pass the newest token
+        through the model instead of the entire context window.
+
+        This is only intended for inference so no gradients are tracked.
+
+        Args:
+            tensor: A Tensor of shape (batch_size, n_new_tokens,
+                embedding_dim * 3) containing the query, key and value
+                projections for the new tokens only.
+
+        Returns:
+            A Tensor of shape (batch_size, n_new_tokens, embedding_dim)
+        """
+        xp = tensor.xp
+
+        assert tensor.is_batched
+
+        batch_size, n_tokens, _ = tensor.shape
+        head_size = self.embedding_dim // self.n_heads
+        start = self.n_cached_tokens
+        end = start + n_tokens
+        if end > self.context_window:
+            raise ValueError(
+                f"Cannot cache {end} tokens with a context window of "
+                f"{self.context_window}. Call reset_kv_cache first."
+            )
+
+        head_shape = (batch_size, n_tokens, self.n_heads, head_size)
+        query = tensor.array[:, :, : self.embedding_dim]
+        key = tensor.array[:, :, self.embedding_dim : self.embedding_dim * 2]
+        value = tensor.array[:, :, self.embedding_dim * 2 :]
+
+        query = einsum("BTNH->BNTH", query.reshape(head_shape))
+        key = einsum("BTNH->BNTH", key.reshape(head_shape))
+        value = einsum("BTNH->BNTH", value.reshape(head_shape))
+
+        # we preallocate space for an entire context window so that adding
+        # a token doesn't copy the whole cache
+        if self._key_cache is None or self._key_cache.shape[0] != batch_size:
+            cache_shape = (
+                batch_size,
+                self.n_heads,
+                self.context_window,
+                head_size,
+            )
+            self._key_cache = xp.empty(cache_shape, dtype=key.dtype)
+            self._value_cache = xp.empty(cache_shape, dtype=value.dtype)
+
+        self._key_cache[:, :, start:end] = key
+        self._value_cache[:, :, start:end] = value
+        self.n_cached_tokens = end
+
+        key = self._key_cache[:, :, :end]
+        value = self._value_cache[:, :, :end]
+
+        # attend
+        attention = einsum("BNIh, BNJh -> BNIJ", query, key)
+        attention = attention / sqrt(head_size)
+
+        # mask. The new tokens sit at positions start:end in the sequence
+        attention = xp.where(self.mask[:, start:end, :end], -xp.inf, attention)
+
+        # Exponents tend to overflow/underflow when using 16 bit precision
+        # so we need to switch to 32 bit
+        if TRICYCLE_CONTEXT.use_mixed_precision:
+            attention = attention.astype(xp.float32)
+
+        # softmax
+        exp = xp.exp(attention - xp.max(attention, axis=-1, keepdims=True))
+        attention = exp / xp.sum(exp, axis=-1, keepdims=True)
+
+        if TRICYCLE_CONTEXT.use_mixed_precision:
+            attention = attention.astype(xp.float16)
+
+        # smush the heads back together
+        attention = einsum("BNTi, BNiH -> BTNH", attention, value)
+        attention = attention.reshape(
+            (batch_size, n_tokens, self.embedding_dim)
+        )
+
+        return Tensor(attention, is_batched=True, requires_grad=False)
+
+    def forward(self, tensor: Tensor, use_cache: bool = False):
         """Apply the multi-head attention operation to the input tensor.
 
         Args:
             tensor: A Tensor of shape (batch_size, seq_len, embedding_dim * 3).
                 The input should contain concatenated query, key, and value projections.
+            use_cache: If True, only the new tokens are passed in and keys
+                and values for previous tokens are read from the kv cache.
+                See `cached_forward`.
 
         Returns:
             A Tensor representing the output after applying multi-head attention.
         """
+        if use_cache:
+            return self.cached_forward(tensor)
+
         xp = tensor.xp
 
         assert tensor.is_batched
 
-        # split the input into 3 peices
+        # split the input into 3 peices. These are views so nothing is
+        # copied
         self._input = tensor
-        query = tensor[:, :, : self.embedding_dim]
-        key = tensor[:, :, self.embedding_dim : self.embedding_dim * 2]
-        value = tensor[:, :, self.embedding_dim * 2 :]
+        query = tensor.array[:, :, : self.embedding_dim]
+        key = tensor.array[:, :, self.embedding_dim : self.embedding_dim * 2]
+        value = tensor.array[:, :, self.embedding_dim * 2 :]
 
         # Figure out how big everything is
-        self.batch_size = key.array.shape[0]
+        self.batch_size = key.shape[0]
         self.head_size = self.embedding_dim // self.n_heads
         self.n_tokens = key.shape[-2]
         head_shape = (
@@ -166,17 +296,13 @@ class Attention(Op):
         out_shape = (self.batch_size, self.n_tokens, self.embedding_dim)
 
         # reshape and reorder the heads
-        key = key.array
-        query = query.array
-        value = value.array
-
         key = key.reshape(head_shape)
         query = query.reshape(head_shape)
         value = value.reshape(head_shape)
 
-        key = xp.einsum("BTNH->BNTH", key)
-        query = xp.einsum("BTNH->BNTH", query)
-        value = xp.einsum("BTNH->BNTH", value)
+        key = einsum("BTNH->BNTH", key)
+        query = einsum("BTNH->BNTH", query)
+        value = einsum("BTNH->BNTH", value)
 
         self._key = key
         self._query = query
@@ -184,7 +310,7 @@ class Attention(Op):
 
         # attend
         self.divisor = sqrt(self.head_size)
-        attention = xp.einsum("BNIh, BNJh -> BNIJ", query, key)
+        attention = einsum("BNIh, BNJh -> BNIJ", query, key)
         attention = attention / self.divisor
 
         # mask
@@ -207,13 +333,15 @@ class Attention(Op):
 
         # smush the heads back together
         self._before_smush = attention
-        attention = xp.einsum("BNTi, BNiH -> BTNH", attention, value)
+        attention = einsum("BNTi, BNiH -> BTNH", attention, value)
         attention = attention.reshape(out_shape)
 
-        result = Tensor(attention, is_batched=True)
-        result.back_fns = (self.backward,)
-        result.args = (self._input,)
-        return result
+        return Tensor(
+            attention,
+            is_batched=True,
+            args=(self._input,),
+            back_fns=(self.backward,),
+        )
 
     def to_gpu(self, device: int):
         """Move this operation to a GPU.
@@ -226,6 +354,7 @@ class Attention(Op):
 
             cp.cuda.Device(device).use()
             self.mask = cp.array(self.mask)
+            self.reset_kv_cache()
 
     def from_gpu(self):
         """Move the operation back to CPU."""
@@ -233,3 +362,253 @@ class Attention(Op):
             import cupy as cp
 
             self.mask = cp.asnumpy(self.mask)
+            self.reset_kv_cache()
+
+
+class FlashAttention(Attention):
+    """Multi-head attention computed one tile at a time.
+
+    The standard `Attention` op builds the full (batch, head, token, token)
+    score matrix and keeps it around for the backward pass. Here, the queries
+    and keys are split into blocks of `block_size` tokens and the softmax is
+    computed with a running maximum and sum (an "online" softmax, as in
+    FlashAttention, Dao et al., 2022). Only a single
+    (block_size, block_size) tile of scores exists per head at any time.
+
+    Instead of storing the attention matrix for the backward pass, we store
+    the log-sum-exp of each row and recompute each tile as it is needed.
+
+    Blocks that lie entirely above the diagonal are fully masked so they are
+    skipped.
+
+    Attributes:
+        block_size: The number of tokens in each tile.
+    """
+
+    def __init__(
+        self,
+        embedding_dim: int,
+        n_heads: int,
+        context_window: int,
+        block_size: int = 64,
+    ):
+        """Initialize the FlashAttention operation.
+
+        Args:
+            embedding_dim: An integer representing the dimension of the input embeddings.
+            n_heads: An integer representing the number of attention heads.
+            context_window: An integer representing the size of the context window.
+            block_size: The number of tokens in each tile. Defaults to 64.
+        """
+        super().__init__(
+            embedding_dim=embedding_dim,
+            n_heads=n_heads,
+            context_window=context_window,
+        )
+        self.block_size = block_size
+
+    def clear_activations(self):
+        """Forget the intermediate values stored for the backward pass."""
+        super().clear_activations()
+        self._output = None
+        self._logsumexp = None
+
+    def _blocks(self):
+        """Yield the start and end of every block of tokens."""
+        for start in range(0, self.n_tokens, self.block_size):
+            yield start, min(start + self.block_size, self.n_tokens)
+
+    def _scores(self, xp, query, key, q_start, q_end, k_start, k_end):
+        """Compute a single, masked tile of attention scores.
+
+        Returns:
+            An array of shape (B, N, q_end - q_start, k_end - k_start).
+        """
+        scores = einsum("BNIh, BNJh -> BNIJ", query, key) / self.divisor
+
+        # only tiles that touch the diagonal contain masked entries
+        if k_end > q_start + 1:
+            mask = self.mask[:1, q_start:q_end, k_start:k_end]
+            scores = xp.where(mask, -xp.inf, scores)
+        return scores
+
+    def forward(self, tensor: Tensor, use_cache: bool = False):
+        """Apply blockwise multi-head attention to the input tensor.
+
+        Args:
+            tensor: A Tensor of shape (batch_size, seq_len, embedding_dim * 3).
+                The input should contain concatenated query, key, and value projections.
+            use_cache: If True, only the new tokens are passed in and keys
+                and values for previous tokens are read from the kv cache.
+                See `cached_forward`.
+
+        Returns:
+            A Tensor representing the output after applying multi-head attention.
+        """
+        if use_cache:
+            return self.cached_forward(tensor)
+
+        xp = tensor.xp
+
+        assert tensor.is_batched
+
+        self._input = tensor
+        self.batch_size, self.n_tokens, _ = tensor.shape
+        self.head_size = self.embedding_dim // self.n_heads
+        self.divisor = sqrt(self.head_size)
+        head_shape = (
+            self.batch_size,
+            self.n_tokens,
+            self.n_heads,
+            self.head_size,
+        )
+        out_shape = (self.batch_size, self.n_tokens, self.embedding_dim)
+
+        query = tensor.array[:, :, : self.embedding_dim]
+        key = tensor.array[:, :, self.embedding_dim : self.embedding_dim * 2]
+        value = tensor.array[:, :, self.embedding_dim * 2 :]
+
+        # Exponents tend to overflow/underflow when using 16 bit precision
+        # so we do all of the arithmetic in 32 bit
+        dtype = xp.float32 if TRICYCLE_CONTEXT.use_mixed_precision else None
+        query = einsum("BTNH->BNTH", query.reshape(head_shape))
+        key = einsum("BTNH->BNTH", key.reshape(head_shape))
+        value = einsum("BTNH->BNTH", value.reshape(head_shape))
+        if dtype is not None:
+            query = query.astype(dtype)
+            key = key.astype(dtype)
+            value = value.astype(dtype)
+
+        self._query = query
+        self._key = key
+        self._value = value
+
+        output = xp.empty_like(query)
+        logsumexp = xp.empty(query.shape[:-1], dtype=query.dtype)
+
+        for q_start, q_end in self._blocks():
+            q_block = query[:, :, q_start:q_end]
+
+            running_max = None
+            running_sum = None
+            accumulated = None
+            for k_start, k_end in self._blocks():
+                if k_start >= q_end:
+                    break
+                scores = self._scores(
+                    xp,
+                    q_block,
+                    key[:, :, k_start:k_end],
+                    q_start,
+                    q_end,
+                    k_start,
+                    k_end,
+                )
+                block_max = xp.max(scores, axis=-1, keepdims=True)
+                if running_max is None:
+                    new_max = block_max
+                else:
+                    new_max = xp.maximum(running_max, block_max)
+
+                exp = xp.exp(scores - new_max)
+                weighted = einsum(
+                    "BNIJ, BNJH -> BNIH", exp, value[:, :, k_start:k_end]
+                )
+                block_sum = xp.sum(exp, axis=-1, keepdims=True)
+
+                if running_max is None:
+                    running_sum = block_sum
+                    accumulated = weighted
+                else:
+                    # rescale everything we've seen so far to the new max
+                    correction = xp.exp(running_max - new_max)
+                    running_sum = running_sum * correction + block_sum
+                    accumulated = accumulated * correction + weighted
+                running_max = new_max
+
+            output[:, :, q_start:q_end] = accumulated / running_sum
+            logsumexp[:, :, q_start:q_end] = (
+                running_max + xp.log(running_sum)
+            )[..., 0]
+
+        self._output = output
+        self._logsumexp = logsumexp
+
+        attention = einsum("BNTH->BTNH", output).reshape(out_shape)
+        attention = attention.astype(tensor.dtype, copy=False)
+
+        return Tensor(
+            attention,
+            is_batched=True,
+            args=(self._input,),
+            back_fns=(self.backward,),
+        )
+
+    def backward(self, grad: Tensor):
+        """Compute the gradient of blockwise attention.
+
+        Each tile of attention probabilities is recomputed from the stored
+        log-sum-exp rather than being read from memory.
+
+        Args:
+            grad: A Tensor representing the upstream gradient.
+
+        Returns:
+            A Tensor representing the gradient with respect to the input.
+        """
+        xp = grad.xp
+
+        out_grad = grad.array.reshape(
+            (
+                self.batch_size,
+                self.n_tokens,
+                self.n_heads,
+                self.head_size,
+            )
+        )
+        out_grad = einsum("BTNH->BNTH", out_grad).astype(
+            self._query.dtype, copy=False
+        )
+
+        # the softmax gradient needs sum_j(p_ij * dp_ij), which is equal to
+        # the dot product of the output and its gradient
+        inner = xp.sum(out_grad * self._output, axis=-1)
+
+        query_grad = xp.zeros_like(self._query)
+        key_grad = xp.zeros_like(self._key)
+        value_grad = xp.zeros_like(self._value)
+
+        for q_start, q_end in self._blocks():
+            q_block = self._query[:, :, q_start:q_end]
+            out_grad_block = out_grad[:, :, q_start:q_end]
+            lse_block = self._logsumexp[:, :, q_start:q_end, None]
+            inner_block = inner[:, :, q_start:q_end, None]
+
+            for k_start, k_end in self._blocks():
+                if k_start >= q_end:
+                    break
+                k_block = self._key[:, :, k_start:k_end]
+                v_block = self._value[:, :, k_start:k_end]
+
+                scores = self._scores(
+                    xp, q_block, k_block, q_start, q_end, k_start, k_end
+                )
+                probs = xp.exp(scores - lse_block)
+
+                value_grad[:, :, k_start:k_end] += einsum(
+                    "BNIJ, BNIH -> BNJH", probs, out_grad_block
+                )
+                probs_grad = einsum(
+                    "BNIH, BNJH -> BNIJ", out_grad_block, v_block
+                )
+                scores_grad = probs * (probs_grad - inner_block)
+                scores_grad /= self.divisor
+
+                query_grad[:, :, q_start:q_end] += einsum(
+                    "BNIJ, BNJH -> BNIH", scores_grad, k_block
+                )
+                key_grad[:, :, k_start:k_end] += einsum(
+                    "BNIJ, BNIH -> BNJH", scores_grad, q_block
+                )
+
+        return self._merge_grads(xp, query_grad, key_grad, value_grad)
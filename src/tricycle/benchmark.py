@@ -0,0 +1,527 @@
+"""
+Benchmarks for the speed and memory usage of the core layers and models.
+
+Every benchmark builds a layer (or model) with shapes taken from a config,
+then times a forward and backward pass (or an optimiser update) several
+times. The random seed is fixed so each run does exactly the same work.
+
+Results can be saved as JSON and compared against a saved baseline to catch
+performance regressions:
+
+    python -m tricycle.benchmark --configs debug --output results.json
+    python -m tricycle.benchmark --baseline results.json --threshold 0.1
+
+The second command exits with a non-zero status if any benchmark got slower
+(or used more memory) than the baseline by more than the threshold.
+
+Peak memory is measured with tracemalloc, which tracks every array numpy
+allocates. It is measured in a separate run so that tracing doesn't slow
+down the timed runs. It does not track memory allocated by cupy.
+"""
+
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Callable
+
+import numpy as np
+
+from tricycle.activation import GeLU, ReLU
+from tricycle.attention import Attention
+from tricycle.configs import DebugConfig, GPTConfig, ShakespeareConfig
+from tricycle.layers import Dense, Embedding, LayerNorm, Sequential
+from tricycle.loss import CrossEntropy
+from tricycle.models import GPT
+from tricycle.optimisers import AdamW
+from tricycle.tensor import Tensor
+
+CONFIGS = {"debug": DebugConfig, "shakespeare": ShakespeareConfig}
+
+
+@dataclass
+class BenchmarkResult:
+    """
+    The speed and memory usage of a single benchmark.
+
+    Attributes:
+        name (str): The name of the benchmark.
+        config (str): The name of the config the shapes were taken from.
+        batch_size (int): The batch size that was used.
+        repeats (int): The number of timed runs.
+        mean_seconds (float): The average time for a single run.
+        min_seconds (float): The fastest run.
+        throughput (float): Items processed per second, using the mean time.
+        unit (str): What the throughput counts, e.g. "tokens/s".
+        peak_memory_bytes (int): The most memory allocated at once during a
+            single run.
+    """
+
+    name: str
+    config: str
+    batch_size: int
+    repeats: int
+    mean_seconds: float
+    min_seconds: float
+    throughput: float
+    unit: str
+    peak_memory_bytes: int
+
+    @property
+    def key(self) -> tuple[str, str, int]:
+        """What this result should be compared against."""
+        return (self.name, self.config, self.batch_size)
+
+
+@dataclass
+class Regression:
+    """
+    A benchmark that is worse than its baseline.
+
+    Attributes:
+        name (str): The name of the benchmark.
+        config (str): The name of the config.
+        metric (str): Either "mean_seconds" or "peak_memory_bytes".
+        baseline (float): The value in the baseline.
+        current (float): The value in the current results.
+    """
+
+    name: str
+    config: str
+    metric: str
+    baseline: float
+    current: float
+
+    @property
+    def change(self) -> float:
+        """The relative increase over the baseline."""
+        return self.current / self.baseline - 1
+
+    def __str__(self):
+        return (
+            f"{self.name} ({self.config}): {self.metric} went from "
+            f"{self.baseline:.6g} to {self.current:.6g} "
+            f"(+{self.change:.1%})"
+        )
+
+
+def _tokens(config: GPTConfig, batch_size: int) -> Tensor:
+    return Tensor(
+        np.random.randint(
+            0, config.vocab_size, (batch_size, config.context_window)
+        ),
+        requires_grad=False,
+        is_batched=True,
+        dtype=int,
+    )
+
+
+def _activations(config: GPTConfig, batch_size: int, width: int) -> Tensor:
+    return Tensor(
+        np.random.random((batch_size, config.context_window, width)),
+        is_batched=True,
+    )
+
+
+def _layer_step(layer, inputs: Tensor) -> Callable[[], None]:
+    """
+    Build a function that runs a forward and backward pass through a layer.
+    """
+
+    def step():
+        inputs.grad = None
+        layer(inputs).backward()
+        layer.zero_grad()
+
+    return step
+
+
+def bench_dense(config: GPTConfig, batch_size: int):
+    """Forward and backward pass through the first MLP projection."""
+    layer = Dense(
+        config.embedding_dim,
+        int(config.embedding_dim * config.expansion_ratio),
+    )
+    inputs = _activations(config, batch_size, config.embedding_dim)
+    return _layer_step(layer, inputs), "tokens/s"
+
+
+def bench_attention(config: GPTConfig, batch_size: int):
+    """Forward and backward pass through the attention op."""
+    attention = Attention(
+        embedding_dim=config.embedding_dim,
+        n_heads=config.n_heads,
+        context_window=config.context_window,
+    )
+    inputs = _activations(config, batch_size, config.embedding_dim * 3)
+
+    def step():
+        inputs.grad = None
+        attention(inputs).backward()
+
+    return step, "tokens/s"
+
+
+def bench_layer_norm(config: GPTConfig, batch_size: int):
+    """Forward and backward pass through a layer norm."""
+    layer = LayerNorm(config.embedding_dim)
+    inputs = _activations(config, batch_size, config.embedding_dim)
+    return _layer_step(layer, inputs), "tokens/s"
+
+
+def bench_gelu(config: GPTConfig, batch_size: int):
+    """Forward and backward pass through GeLU on the MLP activations."""
+    inputs = _activations(
+        config,
+        batch_size,
+        int(config.embedding_dim * config.expansion_ratio),
+    )
+    return _layer_step(GeLU(), inputs), "tokens/s"
+
+
+def bench_small_mlp(config: GPTConfig, batch_size: int):
+    """
+    Forward and backward pass through a tiny MLP.
+
+    The arrays are so small that this mostly measures the overhead of
+    building tensors and walking the graph.
+    """
+    model = Sequential(Dense(4, 16), ReLU(), Dense(16, 3))
+    inputs = _activations(config, batch_size, 4)
+    return _layer_step(model, inputs), "tokens/s"
+
+
+def bench_cross_entropy(config: GPTConfig, batch_size: int):
+    """Forward and backward pass through the loss on the logits."""
+    loss_fn = CrossEntropy()
+    logits = _activations(config, batch_size, config.vocab_size)
+    targets = _tokens(config, batch_size)
+
+    def step():
+        logits.grad = None
+        loss_fn(targets, logits).backward()
+
+    return step, "tokens/s"
+
+
+def bench_embedding(config: GPTConfig, batch_size: int):
+    """Forward and backward pass through the token embedding."""
+    layer = Embedding(config.vocab_size, config.embedding_dim)
+    return _layer_step(layer, _tokens(config, batch_size)), "tokens/s"
+
+
+def bench_adamw(config: GPTConfig, batch_size: int):
+    """A single AdamW update of every parameter in a GPT."""
+    model = GPT(config)
+    optimiser = AdamW()
+    grads = [
+        np.random.random(parameter.shape).astype(parameter.dtype)
+        for parameter in model.parameters()
+    ]
+
+    def step():
+        for parameter, grad in zip(model.parameters(), grads):
+            parameter.grad = Tensor(grad, requires_grad=False)
+        model.update(optimiser)
+        optimiser.step()
+
+    return step, "tokens/s"
+
+
+def bench_gpt_forward(config: GPTConfig, batch_size: int):
+    """A forward pass through a GPT."""
+    model = GPT(config)
+    inputs = _tokens(config, batch_size)
+
+    def step():
+        model(inputs)
+
+    return step, "tokens/s"
+
+
+def bench_gpt_train_step(config: GPTConfig, batch_size: int):
+    """A forward pass, backward pass and AdamW update of a GPT."""
+    model = GPT(config)
+    loss_fn = CrossEntropy()
+    optimiser = AdamW()
+    inputs = _tokens(config, batch_size)
+    outputs = _tokens(config, batch_size)
+
+    def step():
+        loss_fn(outputs, model(inputs)).backward()
+        model.update(optimiser)
+        model.zero_grad()
+        optimiser.step()
+
+    return step, "tokens/s"
+
+
+BENCHMARKS = {
+    "dense": bench_dense,
+    "attention": bench_attention,
+    "layer_norm": bench_layer_norm,
+    "gelu": bench_gelu,
+    "small_mlp": bench_small_mlp,
+    "cross_entropy": bench_cross_entropy,
+    "embedding": bench_embedding,
+    "adamw": bench_adamw,
+    "gpt_forward": bench_gpt_forward,
+    "gpt_train_step": bench_gpt_train_step,
+}
+
+
+def run_benchmark(
+    name: str,
+    config_name: str = "debug",
+    batch_size: int | None = None,
+    repeats: int = 10,
+    warmup: int = 2,
+    seed: int = 0,
+) -> BenchmarkResult:
+    """
+    Time a single benchmark.
+
+    Args:
+        name (str): The name of the benchmark. See `BENCHMARKS`.
+        config_name (str, optional): The config to take shapes from. See
+            `CONFIGS`. Defaults to "debug".
+        batch_size (int | None, optional): Override the batch size in the
+            config. Defaults to None.
+        repeats (int, optional): The number of timed runs. Defaults to 10.
+        warmup (int, optional): The number of untimed runs before timing
+            starts. Defaults to 2.
+        seed (int, optional): The random seed. Defaults to 0.
+
+    Returns:
+        BenchmarkResult: The timings and peak memory.
+    """
+    config = CONFIGS[config_name]()
+    batch_size = batch_size or config.batch_size
+
+    np.random.seed(seed)
+    step, unit = BENCHMARKS[name](config, batch_size)
+
+    for _ in range(warmup):
+        step()
+
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        step()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        step()
+        _, peak_memory_bytes = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    mean_seconds = float(np.mean(times))
+    return BenchmarkResult(
+        name=name,
+        config=config_name,
+        batch_size=batch_size,
+        repeats=repeats,
+        mean_seconds=mean_seconds,
+        min_seconds=float(np.min(times)),
+        throughput=batch_size * config.context_window / mean_seconds,
+        unit=unit,
+        peak_memory_bytes=peak_memory_bytes,
+    )
+
+
+def run_suite(
+    names: list[str] | None = None,
+    config_names: list[str] | None = None,
+    batch_size: int | None = None,
+    repeats: int = 10,
+    warmup: int = 2,
+) -> list[BenchmarkResult]:
+    """
+    Run every combination of benchmark and config.
+
+    Args:
+        names (list[str] | None, optional): The benchmarks to run. Defaults
+            to every benchmark.
+        config_names (list[str] | None, optional): The configs to run them
+            with. Defaults to ["debug"].
+        batch_size (int | None, optional): Override the batch size in each
+            config. Defaults to None.
+        repeats (int, optional): The number of timed runs. Defaults to 10.
+        warmup (int, optional): The number of untimed runs. Defaults to 2.
+
+    Returns:
+        list[BenchmarkResult]: One result per benchmark and config.
+    """
+    names = names or list(BENCHMARKS)
+    config_names = config_names or ["debug"]
+    return [
+        run_benchmark(
+            name,
+            config_name,
+            batch_size=batch_size,
+            repeats=repeats,
+            warmup=warmup,
+        )
+        for config_name in config_names
+        for name in names
+    ]
+
+
+def save_results(results: list[BenchmarkResult], path: str | Path):
+    """
+    Save benchmark results (and details of the machine) as JSON.
+
+    Args:
+        results (list[BenchmarkResult]): The results to save.
+        path (str | Path): Where to save them.
+    """
+    data = {
+        "metadata": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "timestamp": time.time(),
+        },
+        "results": [asdict(result) for result in results],
+    }
+    Path(path).write_text(json.dumps(data, indent=2))
+
+
+def load_results(path: str | Path) -> list[BenchmarkResult]:
+    """
+    Load benchmark results that were saved with `save_results`.
+
+    Args:
+        path (str | Path): Where the results were saved.
+
+    Returns:
+        list[BenchmarkResult]: The saved results.
+    """
+    data = json.loads(Path(path).read_text())
+    return [BenchmarkResult(**result) for result in data["results"]]
+
+
+def compare(
+    results: list[BenchmarkResult],
+    baseline: list[BenchmarkResult],
+    threshold: float = 0.1,
+) -> list[Regression]:
+    """
+    Find the benchmarks that are slower, or use more memory, than the
+    baseline.
+
+    Benchmarks that are missing from the baseline are ignored.
+
+    Args:
+        results (list[BenchmarkResult]): The current results.
+        baseline (list[BenchmarkResult]): The results to compare against.
+        threshold (float, optional): The largest relative increase that is
+            not a regression. Defaults to 0.1 (i.e. 10%).
+
+    Returns:
+        list[Regression]: Every regression that was found.
+    """
+    baseline_by_key = {result.key: result for result in baseline}
+    regressions = []
+    for result in results:
+        previous = baseline_by_key.get(result.key)
+        if previous is None:
+            continue
+        for metric in ["mean_seconds", "peak_memory_bytes"]:
+            before = getattr(previous, metric)
+            after = getattr(result, metric)
+            if before > 0 and after > before * (1 + threshold):
+                regressions.append(
+                    Regression(
+                        name=result.name,
+                        config=result.config,
+                        metric=metric,
+                        baseline=before,
+                        current=after,
+                    )
+                )
+    return regressions
+
+
+def format_results(results: list[BenchmarkResult]) -> str:
+    """
+    Build a table of benchmark results.
+
+    Args:
+        results (list[BenchmarkResult]): The results to show.
+
+    Returns:
+        str: The table.
+    """
+    header = (
+        f"{'benchmark':<16} {'config':<12} {'batch':>6} {'mean ms':>10} "
+        f"{'min ms':>10} {'throughput':>14} {'peak MB':>10}"
+    )
+    rows = [header, "-" * len(header)]
+    for result in results:
+        rows.append(
+            f"{result.name:<16} {result.config:<12} {result.batch_size:>6} "
+            f"{result.mean_seconds * 1e3:>10.3f} "
+            f"{result.min_seconds * 1e3:>10.3f} "
+            f"{result.throughput:>9.0f} {result.unit:<4} "
+            f"{result.peak_memory_bytes / 1e6:>10.3f}"
+        )
+    return "\n".join(rows)
+
+
+def main(argv: list[str] | None = None) -> int:
+    """
+    Run the benchmark suite from the command line.
+
+    Returns:
+        int: 1 if a regression was found, otherwise 0.
+    """
+    parser = argparse.ArgumentParser(
+        prog="python -m tricycle.benchmark", description=__doc__.split("\n")[1]
+    )
+    parser.add_argument(
+        "--benchmarks", nargs="+", choices=list(BENCHMARKS), default=None
+    )
+    parser.add_argument(
+        "--configs", nargs="+", choices=list(CONFIGS), default=["debug"]
+    )
+    parser.add_argument("--batch-size", type=int, default=None)
+    parser.add_argument("--repeats", type=int, default=10)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--output", type=Path, default=None)
+    parser.add_argument("--baseline", type=Path, default=None)
+    parser.add_argument("--threshold", type=float, default=0.1)
+    args = parser.parse_args(argv)
+
+    results = run_suite(
+        names=args.benchmarks,
+        config_names=args.configs,
+        batch_size=args.batch_size,
+        repeats=args.repeats,
+        warmup=args.warmup,
+    )
+    print(format_results(results))
+
+    if args.output is not None:
+        save_results(results, args.output)
+
+    if args.baseline is None:
+        return 0
+
+    regressions = compare(
+        results, load_results(args.baseline), threshold=args.threshold
+    )
+    for regression in regressions:
+        print(f"REGRESSION: {regression}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
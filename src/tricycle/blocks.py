@@ -10,7 +10,8 @@ from typing import Literal
 import numpy as np
 
 from tricycle.activation import GLU, GeLU, ReLU, Swish
-from tricycle.attention import Attention
+from tricycle.attention import Attention, FlashAttention
+from tricycle.context import TRICYCLE_CONTEXT, NoGrad
 from tricycle.initialisers import init_xavier
 from tricycle.layers import (  # noqa E501
     Dense,
@@ -89,6 +90,8 @@ class MultiHeadSelfAttention(Layer):
         context_window: int,
         residual_dropout_prob: float = 0.0,
         initialiser=init_xavier,
+        flash_attention: bool = False,
+        attention_block_size: int = 64,
     ):
         """
         Initialize the MultiHeadSelfAttention layer.
@@ -99,6 +102,8 @@ class MultiHeadSelfAttention(Layer):
             context_window (int): The size of the context window.
             residual_dropout_prob (float, optional): The dropout probability for residual connections. Defaults to 0.0.
             initialiser (function, optional): The initializer function for weights. Defaults to init_xavier.
+            flash_attention (bool, optional): Whether to compute attention one tile at a time to save memory. Defaults to False.
+            attention_block_size (int, optional): The tile size to use for flash attention. Defaults to 64.
         """
         # set the constants
         self.embedding_dim = embedding_dim
@@ -129,25 +134,35 @@ class MultiHeadSelfAttention(Layer):
             self.out_projection,
         ]
 
-        self.attention = Attention(
-            embedding_dim=embedding_dim,
-            n_heads=n_heads,
-            context_window=context_window,
-        )
-
-    def forward(self, tensor: Tensor):
+        if flash_attention:
+            self.attention = FlashAttention(
+                embedding_dim=embedding_dim,
+                n_heads=n_heads,
+                context_window=context_window,
+                block_size=attention_block_size,
+            )
+        else:
+            self.attention = Attention(
+                embedding_dim=embedding_dim,
+                n_heads=n_heads,
+                context_window=context_window,
+            )
+
+    def forward(self, tensor: Tensor, use_cache: bool = False):
         """
         Perform a forward pass through the multi-head self-attention layer.
 
         Args:
             tensor (Tensor): The input tensor.
+            use_cache (bool, optional): Whether to read and write keys and
+                values from the kv cache. Defaults to False.
 
         Returns:
             Tensor: The output tensor after applying multi-head self-attention.
         """
         # expand the input
         tensor = self.in_projection(tensor)
-        attention = self.attention(tensor)
+        attention = self.attention(tensor, use_cache=use_cache)
 
         # project back
         projected = self.out_projection(attention)
@@ -155,6 +170,19 @@ class MultiHeadSelfAttention(Layer):
 
         return projected
 
+    def reset_kv_cache(self):
+        """
+        Forget any keys and values stored in the kv cache.
+        """
+        self.attention.reset_kv_cache()
+
+    def clear_activations(self):
+        """
+        Forget any intermediate values stored for the backward pass.
+        """
+        super().clear_activations()
+        self.attention.clear_activations()
+
     def update(self, optimiser: Optimiser):
         """
         Update the layer's parameters using the given optimizer.
@@ -366,6 +394,7 @@ class GPT2TransformerBlock(Layer):
         norm_fn: Literal["layer_norm"] | Literal["rms_norm"] = "layer_norm",
         residual_dropout_prob: float = 0,
         linear_dropout_prob: float = 0,
+        flash_attention: bool = False,
     ):
         """
         Initialize the GPT2TransformerBlock.
@@ -379,6 +408,7 @@ class GPT2TransformerBlock(Layer):
             norm_fn (Literal["layer_norm"] | Literal["rms_norm"], optional): The normalization function to use. Defaults to "layer_norm".
             residual_dropout_prob (float, optional): The dropout probability for residual connections. Defaults to 0.
             linear_dropout_prob (float, optional): The dropout probability for the MLP block. Defaults to 0.
+            flash_attention (bool, optional): Whether to compute attention one tile at a time to save memory. Defaults to False.
         """
         self.attention_block = MultiHeadSelfAttention(
             embedding_dim,
@@ -386,6 +416,7 @@ class GPT2TransformerBlock(Layer):
             context_window=context_window,
             residual_dropout_prob=residual_dropout_prob,
             initialiser=init_xavier,
+            flash_attention=flash_attention,
         )
         self.mlp_block = MLPBlock(
             embedding_dim,
@@ -411,19 +442,21 @@ class GPT2TransformerBlock(Layer):
             self.mlp_block,
         ]
 
-    def forward(self, x: Tensor):
+    def forward(self, x: Tensor, use_cache: bool = False):
         """
         Perform a forward pass through the GPT-2 transformer block.
 
         Args:
             x (Tensor): The input tensor.
+            use_cache (bool, optional): Whether to read and write keys and
+                values from the kv cache. Defaults to False.
 
         Returns:
             Tensor: The output tensor after applying the transformer block.
         """
         normed = self.norm_1(x)
 
-        attn = self.attention_block(normed)
+        attn = self.attention_block(normed, use_cache=use_cache)
         attn += x
 
         x = self.norm_2(attn)
@@ -433,6 +466,12 @@ class GPT2TransformerBlock(Layer):
 
         return x
 
+    def reset_kv_cache(self):
+        """
+        Forget any keys and values stored in the kv cache.
+        """
+        self.attention_block.reset_kv_cache()
+
     def update(self, optimiser: Optimiser):
         """
         Update the layer's parameters using the given optimizer.
@@ -476,6 +515,185 @@ class GPT2TransformerBlock(Layer):
         self.norm_2.from_gpu()
 
 
+class CheckpointedBlock(Layer):
+    """
+    Wraps a block so that its activations are recomputed during the
+    backward pass instead of being stored.
+
+    Normally, every layer in a block keeps its inputs (and often several
+    intermediate values) alive until the backward pass. A checkpointed block
+    throws all of these away after the forward pass and only keeps the input
+    to the block. During the backward pass, the block is run forwards a
+    second time to rebuild the activations before calculating gradients.
+
+    This trades an extra forward pass through the block for a large
+    reduction in memory.
+
+    The random state is saved before the forward pass and restored before
+    the forward pass is repeated so dropout masks are identical both times.
+
+    Gradients inside the block are clipped with the same value as the
+    backward pass that reaches it (see `TricycleContext.clip`).
+
+    Attributes:
+        block (Layer): The wrapped block.
+    """
+
+    def __init__(self, block: Layer):
+        """
+        Initialize the CheckpointedBlock.
+
+        Args:
+            block (Layer): The block to checkpoint.
+        """
+        self.block = block
+        self.layers = [block]
+        self._input = None
+        self._random_state = None
+
+    def _save_random_state(self, xp):
+        """
+        Store the state of the random number generator.
+        """
+        if xp is np:
+            self._random_state = np.random.get_state()
+        else:
+            # cupy doesn't let us read its random state, so we set it to a
+            # known seed instead
+            self._random_state = np.random.randint(2**31)
+            xp.random.seed(self._random_state)
+
+    def _restore_random_state(self, xp):
+        """
+        Put the random number generator back into its saved state and
+        return the state it was in before.
+        """
+        if xp is np:
+            current = np.random.get_state()
+            np.random.set_state(self._random_state)
+        else:
+            current = np.random.randint(2**31)
+            xp.random.seed(self._random_state)
+        return current
+
+    def forward(self, x: Tensor, use_cache: bool = False):
+        """
+        Perform a forward pass through the block, keeping only its input.
+
+        Args:
+            x (Tensor): The input tensor.
+            use_cache (bool, optional): Whether to read and write keys and
+                values from the kv cache. Nothing is checkpointed when using
+                the kv cache. Defaults to False.
+
+        Returns:
+            Tensor: The output tensor after applying the block.
+        """
+        if use_cache:
+            return self.block(x, use_cache=True)
+
+        self._save_random_state(x.xp)
+        # nothing inside the block is needed until it is run again so there
+        # is no point building (or recording) a graph for it
+        with NoGrad():
+            output = self.block(x)
+
+        self._input = x
+        return Tensor(
+            output.array,
+            is_batched=output.is_batched,
+            args=(x,),
+            back_fns=(self.backward,),
+            name="checkpoint",
+        )
+
+    def backward(self, grad: Tensor) -> Tensor:
+        """
+        Recompute the block's activations and calculate gradients.
+
+        Gradients for the block's parameters are accumulated into the
+        parameters as usual and the gradient for the input is returned.
+
+        Args:
+            grad (Tensor): The gradient of the block output.
+
+        Returns:
+            Tensor: The gradient of the block input.
+        """
+        xp = grad.xp
+        # the recomputed graph is released by the backward pass below so it
+        # shouldn't end up on a tape that is still recording
+        tape, TRICYCLE_CONTEXT.tape = TRICYCLE_CONTEXT.tape, None
+        try:
+            inputs = Tensor(
+                self._input.array,
+                is_batched=self._input.is_batched,
+                dtype=self._input.dtype,
+            )
+
+            current_state = self._restore_random_state(xp)
+            output = self.block(inputs)
+            if xp is np:
+                np.random.set_state(current_state)
+            else:
+                xp.random.seed(current_state)
+
+            output.backward(grad=grad, clip=TRICYCLE_CONTEXT.clip)
+        finally:
+            TRICYCLE_CONTEXT.tape = tape
+        self.block.clear_activations()
+        self._input = None
+
+        if inputs.grad is None:
+            return Tensor(
+                xp.zeros_like(inputs.array), is_batched=inputs.is_batched
+            )
+        return inputs.grad
+
+    def reset_kv_cache(self):
+        """
+        Forget any keys and values stored in the kv cache.
+        """
+        self.block.reset_kv_cache()
+
+    def clear_activations(self):
+        """
+        Forget the stored block input.
+        """
+        self._input = None
+        self.block.clear_activations()
+
+    def update(self, optimiser: Optimiser):
+        """
+        Update the layer's parameters using the given optimizer.
+
+        Args:
+            optimiser (Optimiser): The optimizer to use for updating parameters.
+        """
+        self.block.update(optimiser)
+
+    def zero_grad(self):
+        """
+        Zero out the gradients of the layer's parameters.
+        """
+        self.block.zero_grad()
+
+    def to_gpu(self, device: int = 0):
+        """
+        Move the layer's parameters to the GPU.
+
+        Args:
+            device (int, optional): The GPU device number. Defaults to 0.
+        """
+        self.block.to_gpu(device)
+
+    def from_gpu(self):
+        """
+        Move the layer's parameters from the GPU to the CPU.
+        """
+        self.block.from_gpu()
+
+
 class FeedForward(Layer):
     """A simple llama style feed forward block with 2 linear layers around a swiglu
     function.
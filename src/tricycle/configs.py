@@ -32,6 +32,12 @@ class GPTConfig:
         input_dropout_prob (float): Dropout probability for input embeddings.
         residual_dropout_prob (float): Dropout probability for residual connections.
         linear_dropout_prob (float): Dropout probability for linear layers.
+        gradient_checkpointing (bool): Whether to recompute the activations of
+            each transformer block during the backward pass instead of storing
+            them. Saves memory at the cost of an extra forward pass.
+        sparse_embedding_grad (bool): Whether the token embedding should
+            produce row-sparse gradients so that only the rows for tokens in
+            the batch are updated.
         max_learning_rate (float): Maximum learning rate for training.
         min_learning_rate (float): Minimum learning rate for training.
         warmup_steps (int): Number of warmup steps for learning rate scheduling.
@@ -61,6 +67,9 @@ class GPTConfig:
     residual_dropout_prob: float
     linear_dropout_prob: float
 
+    gradient_checkpointing: bool = False
+    sparse_embedding_grad: bool = False
+
     max_learning_rate: float
     min_learning_rate: float
     warmup_steps: int
@@ -1,10 +1,17 @@
 """Defines the context for Tricycle operations.
 
 This module provides a dataclass for storing Tricycle context information,
-including mixed precision and loss scaling settings.
+including mixed precision and loss scaling settings, and a context manager
+for turning off gradient tracking.
 """
 
 from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from tricycle.arena import BufferArena
+    from tricycle.precision import PrecisionPolicy
+    from tricycle.profiler import Profiler
 
 
 @dataclass
@@ -18,11 +25,76 @@ class TricycleContext:
 
         loss_scale_factor (int): Factor to scale the loss when using mixed precision.
             This helps prevent under and overflowing. Default is 128.
+
+        tape (list | None): If set, every tensor that is created is appended
+            to this list. This is used by tricycle/graph.py:StaticGraph to
+            record the order that tensors are created during a forward pass.
+            Default is None.
+
+        arena (BufferArena | None): If set, ops allocate their arrays from
+            this arena instead of creating new ones. It's recommended to use
+            the tricycle/arena.py:UseArena context manager instead of
+            modifying this directly. Default is None.
+
+        grad_enabled (bool): If False, ops don't build a graph or store
+            anything for the backward pass. It's recommended to use the
+            NoGrad context manager instead of modifying this directly.
+            Default is True.
+
+        clip (float | None): The gradient clipping value of the backward
+            pass that is currently running. This lets backward functions that
+            run a backward pass of their own (e.g.
+            tricycle/blocks.py:CheckpointedBlock) clip gradients in the same
+            way. It is set by `backward` and should not be modified directly.
+            Default is None.
+
+        profiler (Profiler | None): If set, every op, layer and backward
+            function is timed by this profiler. It's recommended to use
+            tricycle/profiler.py:Profiler as a context manager instead of
+            modifying this directly. Default is None.
+
+        precision_policy (PrecisionPolicy | None): Which dtype each op
+            computes in when using mixed precision. If None, the default
+            policy in tricycle/precision.py is used. Default is None.
     """
 
     use_mixed_precision: bool = False
     loss_scale_factor: int = 128
+    tape: list | None = None
+    arena: "BufferArena | None" = None
+    grad_enabled: bool = True
+    clip: float | None = None
+    profiler: "Profiler | None" = None
+    precision_policy: "PrecisionPolicy | None" = None
 
 
 # Global instance of TricycleContext
 TRICYCLE_CONTEXT = TricycleContext()
+
+
+class NoGrad:
+    """Context manager that turns off gradient tracking.
+
+    Inside this context, new tensors are not connected to the tensors they
+    were made from and layers forget their activations as soon as their
+    forward pass is finished. This means memory can be freed as soon as each
+    layer is done with it, which makes evaluation and generation much cheaper.
+    Calling `backward` on a tensor created inside this context does nothing.
+
+    Example usage:
+        >>> with NoGrad():
+        ...     logits = model(inputs)
+    """
+
+    def __init__(self):
+        self._previous = None
+
+    def __enter__(self):
+        """Stop tracking gradients."""
+        self._previous = TRICYCLE_CONTEXT.grad_enabled
+        TRICYCLE_CONTEXT.grad_enabled = False
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        """Go back to tracking gradients (if we were before)."""
+        TRICYCLE_CONTEXT.grad_enabled = self._previous
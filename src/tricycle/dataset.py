@@ -1,5 +1,7 @@
+import queue
 import random
-from typing import Sequence
+import threading
+from typing import Iterable, Sequence
 
 import numpy as np
 
@@ -258,11 +260,13 @@ class CausalLMDataset:
             start = idx * self.batch_size
             end = (idx + 1) * self.batch_size
             indices = self.batch_indices[start:end]
-            batches = [
-                self.tokens[i : i + self.context_window + 1] for i in indices
-            ]
-            inputs = np.vstack([b[:-1] for b in batches])
-            outputs = np.vstack([b[1:] for b in batches])
+
+            # gather every window in a single indexing operation instead of
+            # slicing each one in python
+            offsets = np.arange(self.context_window + 1)
+            batches = self.tokens[indices[:, None] + offsets]
+            inputs = batches[:, :-1]
+            outputs = batches[:, 1:]
         else:
             start = idx * self.context_window
             end = (idx + 1) * self.context_window + 1
@@ -389,3 +393,119 @@ class CausalLMDataset:
         print("converting to tensor")
         self.as_tensor = True
         return self
+
+    def prefetch(self, depth: int = 2):
+        """
+        Build batches in a background thread while the model is running.
+
+        Args:
+            depth: The maximum number of batches to build ahead of time.
+
+        Returns:
+            A PrefetchDataset wrapping this dataset.
+        """
+        return PrefetchDataset(self, depth=depth)
+
+
+class PrefetchDataset:
+    """
+    Builds the next few items of a dataset in a background thread.
+
+    Loading a batch (e.g. reading from a memmap and building tensors) can
+    take a significant fraction of a training step. Wrapping a dataset in a
+    PrefetchDataset moves this work onto a background thread so it happens
+    while the model is busy with the previous batch.
+
+    Attributes:
+        dataset: The dataset to load items from.
+        depth: The maximum number of items to load ahead of time.
+
+    Args:
+        dataset: The dataset to load items from.
+        depth: The maximum number of items to load ahead of time.
+    """
+
+    _DONE = object()
+
+    def __init__(self, dataset: Iterable, depth: int = 2):
+        if depth < 1:
+            raise ValueError(f"depth must be at least 1, got {depth}")
+        self.dataset = dataset
+        self.depth = depth
+        self._queue = None
+        self._thread = None
+        self._stop = None
+
+    def _load(self, iterator, items: queue.Queue, stop: threading.Event):
+        """Put items from the iterator onto the queue until told to stop."""
+        try:
+            for item in iterator:
+                while not stop.is_set():
+                    try:
+                        items.put(item, timeout=0.1)
+                        break
+                    except queue.Full:
+                        continue
+                if stop.is_set():
+                    return
+            items.put(self._DONE)
+        except Exception as e:
+            items.put(e)
+
+    def _remaining(self):
+        """Yield items from the dataset without restarting it."""
+        while True:
+            try:
+                yield next(self.dataset)
+            except StopIteration:
+                return
+
+    def _start(self, iterator):
+        """Start loading items from a new iterator."""
+        self.close()
+        self._queue = queue.Queue(maxsize=self.depth)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._load,
+            args=(iterator, self._queue, self._stop),
+            daemon=True,
+        )
+        self._thread.start()
+
+    def __iter__(self):
+        """Restart the dataset and start loading items from the beginning."""
+        self._start(iter(self.dataset))
+        return self
+
+    def __next__(self):
+        """
+        Returns the next item from the dataset.
+
+        Raises:
+            StopIteration: If all items have been iterated over.
+        """
+        if self._thread is None:
+            # allow `next` to be called without calling `iter` first, like
+            # the datasets we wrap. This continues from wherever the
+            # dataset currently is.
+            self._start(self._remaining())
+
+        item = self._queue.get()
+        if item is self._DONE:
+            self._thread = None
+            raise StopIteration
+        if isinstance(item, Exception):
+            self._thread = None
+            raise item
+        return item
+
+    def __len__(self):
+        """Returns the length of the wrapped dataset."""
+        return len(self.dataset)
+
+    def close(self):
+        """Stop the background thread."""
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
@@ -15,10 +15,16 @@ For more details on einsum operations, refer to the class and function
 docstrings.
 """
 
+import functools
 import itertools
 import re
+from dataclasses import dataclass
 from typing import Sequence
 
+import numpy as np
+from numpy.typing import ArrayLike
+
+from tricycle.context import TRICYCLE_CONTEXT
 from tricycle.tensor import Tensor, select_backend
 
 
@@ -126,6 +132,259 @@ class Subscript:
         return self.subscript
 
 
+class EinsumPlan:
+    """
+    A compiled einsum operation for inputs with a specific set of shapes.
+
+    Parsing a subscript and figuring out how to compute it is much slower
+    than the computation itself for the small tensors we often use, so this
+    is done once for each combination of subscript and shapes and cached
+    (see `plan`).
+
+    Where possible, an einsum is dispatched to a cheaper operation:
+        - transpose: a single input whose indices are reordered
+        - sum: a single input with some indices summed over
+        - matmul: two inputs that can be reshaped into a (batched) matrix
+          multiplication, which is done by BLAS
+        - einsum: anything else, using a precomputed contraction order
+
+    Attributes:
+        subscript (Subscript): The subscript defining the einsum operation.
+        shapes (tuple[tuple[int, ...], ...]): The shape of each input.
+        kind (str): Which of the operations above is used.
+    """
+
+    def __init__(
+        self, subscript: Subscript, shapes: tuple[tuple[int, ...], ...]
+    ):
+        """
+        Initialize an EinsumPlan object.
+
+        Args:
+            subscript (Subscript): The subscript defining the einsum
+                operation.
+            shapes (tuple[tuple[int, ...], ...]): The shape of each input.
+        """
+        assert len(subscript.inputs) == len(shapes)
+        self.subscript = subscript
+        self.shapes = shapes
+        self._path = None
+
+        inputs, output = subscript.inputs, subscript.output
+        simple = all(
+            "..." not in idx and len(set(idx)) == len(idx)
+            for idx in [*inputs, output]
+        )
+        if simple and len(inputs) == 1 and set(output) <= set(inputs[0]):
+            self._compile_reduce()
+        elif simple and len(inputs) == 2 and self._can_matmul():
+            self._compile_matmul()
+        else:
+            self.kind = "einsum"
+            # einsum expects a subscript without any whitespace
+            self._subscript = Subscript.join(inputs, output)
+
+    def _compile_reduce(self):
+        """
+        Compile a transpose or a sum over some indices of a single input.
+        """
+        [idx] = self.subscript.inputs
+        output = self.subscript.output
+
+        self._sum_axes = tuple(
+            i for i, char in enumerate(idx) if char not in output
+        )
+        remaining = [char for char in idx if char in output]
+        self._axes = tuple(remaining.index(char) for char in output)
+        if self._axes == tuple(range(len(self._axes))):
+            self._axes = None
+
+        self.kind = "sum" if self._sum_axes else "transpose"
+        if len(idx) != len(self.shapes[0]):
+            # let einsum raise a helpful error
+            self.kind = "einsum"
+            self._subscript = Subscript.join([idx], output)
+
+    def _can_matmul(self) -> bool:
+        """
+        Check whether two inputs can be multiplied with matmul.
+
+        Every index needs to be contracted, shared by the inputs and the
+        output (a batch index) or passed from a single input to the output.
+        """
+        left, right = self.subscript.inputs
+        output = self.subscript.output
+        if set(output) - set(left) - set(right):
+            return False
+
+        shared = set(left) & set(right)
+        if not shared - set(output):
+            # nothing to contract
+            return False
+
+        left_shape, right_shape = self.shapes
+        if len(left) != len(left_shape) or len(right) != len(right_shape):
+            return False
+
+        sizes = dict(zip(left, left_shape))
+        for char, size in zip(right, right_shape):
+            if char in shared and sizes[char] != size:
+                return False
+
+        return all(
+            char in shared or char in output for char in [*left, *right]
+        )
+
+    def _compile_matmul(self):
+        """
+        Compile an einsum over two inputs into a matmul.
+
+        The left input is reshaped to (*batch, rows, contracted) and the right
+        input to (*batch, contracted, cols). The result of the matmul is then
+        reshaped and transposed to match the output.
+        """
+        left, right = self.subscript.inputs
+        output = self.subscript.output
+        sizes = dict(zip(left, self.shapes[0])) | dict(
+            zip(right, self.shapes[1])
+        )
+
+        batch = [char for char in output if char in left and char in right]
+        rows = [char for char in left if char in output and char not in right]
+        cols = [char for char in right if char in output and char not in left]
+        contracted = [char for char in left if char not in output]
+
+        def size(chars):
+            return int(np.prod([sizes[char] for char in chars], dtype=int))
+
+        def axes(idx, order):
+            axes = tuple(idx.index(char) for char in order)
+            return None if axes == tuple(range(len(axes))) else axes
+
+        batch_shape = tuple(sizes[char] for char in batch)
+
+        self._left_axes = axes(left, batch + rows + contracted)
+        self._left_shape = batch_shape + (size(rows), size(contracted))
+        self._right_axes = axes(right, batch + contracted + cols)
+        self._right_shape = batch_shape + (size(contracted), size(cols))
+        self._result_shape = batch_shape + tuple(
+            sizes[char] for char in rows + cols
+        )
+        self._axes = axes(batch + rows + cols, output)
+
+        self.kind = "matmul"
+
+    def _einsum_path(self):
+        """
+        Find the best order to contract the inputs in.
+
+        The path only depends on the shapes of the inputs so we can figure it
+        out without any real data.
+        """
+        if len(self.shapes) < 2:
+            return False
+        dummies = [
+            np.broadcast_to(np.empty(()), shape) for shape in self.shapes
+        ]
+        strategy = "optimal" if len(dummies) <= 4 else "greedy"
+        path, _ = np.einsum_path(self._subscript, *dummies, optimize=strategy)
+        return path
+
+    def __call__(self, *arrays: ArrayLike) -> ArrayLike:
+        """
+        Perform the einsum operation on some arrays.
+
+        Args:
+            *arrays (ArrayLike): The inputs for the einsum operation.
+
+        Returns:
+            ArrayLike: The result of the einsum operation.
+        """
+        match self.kind:
+            case "transpose":
+                [array] = arrays
+                if self._axes is None:
+                    return array
+                return array.transpose(self._axes)
+            case "sum":
+                [array] = arrays
+                result = array.sum(axis=self._sum_axes)
+                if self._axes is not None:
+                    result = result.transpose(self._axes)
+                return result
+            case "matmul":
+                xp = select_backend(*arrays)
+                left, right = arrays
+                if self._left_axes is not None:
+                    left = left.transpose(self._left_axes)
+                if self._right_axes is not None:
+                    right = right.transpose(self._right_axes)
+                result = xp.matmul(
+                    left.reshape(self._left_shape),
+                    right.reshape(self._right_shape),
+                )
+                result = result.reshape(self._result_shape)
+                if self._axes is not None:
+                    result = result.transpose(self._axes)
+                return result
+            case _:
+                xp = select_backend(*arrays)
+                if xp is not np:
+                    return xp.einsum(self._subscript, *arrays)
+                if self._path is None:
+                    self._path = self._einsum_path()
+                return xp.einsum(self._subscript, *arrays, optimize=self._path)
+
+    def __repr__(self):
+        """
+        Return a string representation of the EinsumPlan object.
+
+        Returns:
+            str: A string representation of the object.
+        """
+        return f"EinsumPlan({self.subscript}, kind={self.kind})"
+
+
+@functools.lru_cache(maxsize=4096)
+def _parse(subscript: str) -> Subscript:
+    """
+    Parse a subscript string, reusing the result for repeated subscripts.
+    """
+    return Subscript(subscript)
+
+
+@functools.lru_cache(maxsize=4096)
+def plan(subscript: str, shapes: tuple[tuple[int, ...], ...]) -> EinsumPlan:
+    """
+    Get the compiled plan for an einsum with inputs of a given shape.
+
+    Args:
+        subscript (str): The einsum subscript string.
+        shapes (tuple[tuple[int, ...], ...]): The shape of each input.
+
+    Returns:
+        EinsumPlan: The (cached) compiled einsum.
+    """
+    return EinsumPlan(_parse(subscript), shapes)
+
+
+def einsum(subscript: str, *arrays: ArrayLike) -> ArrayLike:
+    """
+    A drop-in replacement for `xp.einsum` that uses a cached EinsumPlan.
+
+    This works on raw numpy/cupy arrays and doesn't build a graph, so it is
+    meant for use inside ops that calculate their own gradients.
+
+    Args:
+        subscript (str): The einsum subscript string.
+        *arrays (ArrayLike): The inputs for the einsum operation.
+
+    Returns:
+        ArrayLike: The result of the einsum operation.
+    """
+    return plan(subscript, tuple(array.shape for array in arrays))(*arrays)
+
+
 class EinsumBackOp:
     """
     The backward operation for an einsum operation.
@@ -148,7 +407,11 @@ class EinsumBackOp:
     """
 
     def __init__(
-        self, idx: int, tensors: Sequence[Tensor], subscript: Subscript
+        self,
+        idx: int,
+        tensors: Sequence[Tensor],
+        subscript: Subscript,
+        combined_subscript: Subscript | None = None,
     ):
         """
         Initialize an EinsumBackOp object.
@@ -160,13 +423,18 @@ class EinsumBackOp:
                 einsum operation.
             subscript (Subscript): The subscript of the original einsum
                 operation.
+            combined_subscript (Subscript | None, optional): The subscript for
+                the backward operation, if it has already been built.
+                Defaults to None.
         """
         self.idx = idx
         self.tensors = tensors
         self.subscript = subscript
 
         self.left_tensors, self.right_tensors = self._build_inputs()
-        self.combined_subscript = self._build_subscript()
+        if combined_subscript is None:
+            combined_subscript = self._build_subscript()
+        self.combined_subscript = combined_subscript
 
     def _build_inputs(self):
         """
@@ -237,6 +505,35 @@ class EinsumBackOp:
         return f"EinsumBackOp({self.combined_subscript})"
 
 
+@dataclass(frozen=True)
+class CompiledEinsum:
+    """
+    Everything about an einsum call that only depends on its subscript and
+    the shape and batching of its inputs.
+
+    Attributes:
+        subscript (Subscript): The subscript with batched indices added.
+        batch_output (bool): Whether the output should be batched.
+        single (bool): Whether there is a single input. If so, it is paired
+            with a tensor of ones in the backward pass.
+        expand (bool): Whether the single input needs pairing with a tensor
+            of ones in the forward pass too, to expand it into new indices.
+        forward (EinsumPlan): The plan for the forward pass.
+        back_subscript (Subscript): The subscript that the backward
+            operations are built from.
+        back_subscripts (tuple[Subscript, ...]): The subscript for the
+            backward operation of each input.
+    """
+
+    subscript: Subscript
+    batch_output: bool
+    single: bool
+    expand: bool
+    forward: EinsumPlan
+    back_subscript: Subscript
+    back_subscripts: tuple[Subscript, ...]
+
+
 class Einsum:
     """
     A class representing an einsum operation.
@@ -244,6 +541,9 @@ class Einsum:
     This class encapsulates the logic for performing einsum operations on
     tensors, including handling of batched operations and backward passes.
 
+    The work that only depends on the subscript and the shapes of the inputs
+    is done once and cached (see `Einsum.compile`).
+
     Attributes:
         subscript (Subscript): The subscript defining the einsum operation.
     """
@@ -259,74 +559,13 @@ class Einsum:
                 operation. Can be a string or a Subscript object.
         """
         if isinstance(subscript, str):
-            subscript = Subscript(subscript)
+            subscript = _parse(subscript)
         self.subscript = subscript
 
-    def _build_back_ops(self, tensors: Sequence[Tensor], subscript: Subscript):
-        """
-        Figure out the backward operation for each input.
-
-        Args:
-            tensors (Sequence[Tensor]): The input tensors.
-            subscript (Subscript): The subscript for the operation.
-
-        Returns:
-            list: A list of EinsumBackOp objects, one for each input tensor.
-        """
-        assert len(tensors) == len(subscript.inputs)
-
-        # To avoid adding a bunch of special cases for batched
-        # operations, we replace any batched operations with
-        # their non-batched counterparts
-        subscript = Subscript(subscript.subscript.replace("z", ""))
-
-        back_functions = []
-        for idx in range(len(tensors)):
-            back_op = EinsumBackOp(idx, tensors, subscript)
-            back_functions.append(back_op)
-
-        return back_functions
-
-    def _handle_single_tensor(
-        self, subscript: Subscript, tensors: Sequence[Tensor]
-    ) -> tuple[Subscript, Sequence[Tensor]]:
-        """
-        Handle the case of a single input tensor.
-
-        If there is only one tensor, we need to insert a matrix of ones
-        to allow for expansion operations.
-
-        Args:
-            subscript (Subscript): The original subscript.
-            tensors (Sequence[Tensor]): The input tensors.
-
-        Returns:
-            tuple: A tuple containing two elements:
-                - Subscript: The modified subscript.
-                - Sequence[Tensor]: The modified list of tensors.
-        """
-        xp = select_backend(*tensors)
-        if len(tensors) != 1:
-            return subscript, tensors
-
-        [tensor] = tensors
-        ones = Tensor(
-            xp.ones(tensor.shape),
-            is_batched=tensor.is_batched,
-            requires_grad=False,
-        )
-        tensors = [tensor, ones]
-
-        [index] = subscript.inputs
-        output = subscript.output
-        inputs = [index, index]
-        subscript = Subscript.from_split(inputs, output)
-
-        return subscript, tensors
-
+    @staticmethod
     def _handle_batched(
-        self, subscript: Subscript, tensors: Sequence[Tensor]
-    ) -> tuple[Subscript, Sequence[Tensor], bool]:
+        subscript: Subscript, batched: Sequence[bool]
+    ) -> tuple[Subscript, bool]:
         """
         Handle batched tensors in the einsum operation.
 
@@ -335,12 +574,11 @@ class Einsum:
 
         Args:
             subscript (Subscript): The original subscript.
-            tensors (Sequence[Tensor]): The input tensors.
+            batched (Sequence[bool]): Whether each input is batched.
 
         Returns:
-            tuple: A tuple containing three elements:
+            tuple: A tuple containing two elements:
                 - Subscript: The modified subscript.
-                - Sequence[Tensor]: The input tensors (unchanged).
                 - bool: Whether the output should be batched.
 
         Raises:
@@ -348,8 +586,8 @@ class Einsum:
         """
         inputs = []
         batch_output = False
-        for idx, tensor in zip(subscript.inputs, tensors):
-            if tensor.is_batched:
+        for idx, is_batched in zip(subscript.inputs, batched):
+            if is_batched:
                 inputs.append(["z"] + idx)
                 batch_output = True
             else:
@@ -365,35 +603,88 @@ class Einsum:
             output = ["z"] + output
 
         subscript = Subscript.from_split(inputs, output)
-        return subscript, tensors, batch_output
+        return subscript, batch_output
 
-    def _replace_infinity(self, tensors: Sequence[Tensor]):
+    @staticmethod
+    @functools.lru_cache(maxsize=4096)
+    def compile(
+        subscript: str,
+        batched: tuple[bool, ...],
+        shapes: tuple[tuple[int, ...], ...],
+    ) -> CompiledEinsum:
         """
-        Replace infinity values in tensors with the max value for that datatype.
+        Figure out how to run an einsum in the forward and backward pass.
 
         Args:
-            tensors (Sequence[Tensor]): The input tensors.
+            subscript (str): The einsum subscript string.
+            batched (tuple[bool, ...]): Whether each input is batched.
+            shapes (tuple[tuple[int, ...], ...]): The shape of each input.
 
         Returns:
-            list: A list of processed tensors with infinity values replaced.
-        """
-        xp = select_backend(*tensors)
-        processed = []
-        for tensor in tensors:
-            if not xp.isinf(tensor.array).any():
-                processed.append(tensor)
-                continue
-
-            new_tensor = Tensor(
-                xp.nan_to_num(tensor.array),
-                is_batched=tensor.is_batched,
+            CompiledEinsum: The (cached) compiled einsum.
+        """
+        subscript, batch_output = Einsum._handle_batched(
+            _parse(subscript), batched
+        )
+
+        # If there is only one tensor, we pair it with a tensor of ones to
+        # allow for expansion operations. This is only needed in the forward
+        # pass if the output has an index that the input doesn't but the
+        # backward pass of a reduction is always an expansion.
+        single = len(subscript.inputs) == 1
+        paired = subscript
+        expand = False
+        if single:
+            [idx] = subscript.inputs
+            paired = Subscript.from_split([idx, idx], subscript.output)
+            expand = bool(set(subscript.output) - set(idx))
+
+        if expand:
+            forward = plan(paired.subscript, shapes * 2)
+        else:
+            forward = plan(subscript.subscript, shapes)
+
+        # To avoid adding a bunch of special cases for batched
+        # operations, we replace any batched operations with
+        # their non-batched counterparts
+        back_subscript = _parse(paired.subscript.replace("z", ""))
+        inputs, output = back_subscript.inputs, back_subscript.output
+        back_subscripts = tuple(
+            _parse(
+                Subscript.join(
+                    [*inputs[:idx], output, *inputs[idx + 1 :]], inputs[idx]
+                )
             )
-            new_tensor.args = tensor.args
-            new_tensor.back_fns = tensor.back_fns
-            new_tensor.name = tensor.name
-            processed.append(new_tensor)
+            for idx in range(len(inputs))
+        )
+
+        return CompiledEinsum(
+            subscript=subscript,
+            batch_output=batch_output,
+            single=single,
+            expand=expand,
+            forward=forward,
+            back_subscript=back_subscript,
+            back_subscripts=back_subscripts,
+        )
+
+    @staticmethod
+    def _ones_like(tensor: Tensor) -> Tensor:
+        """
+        Build a tensor of ones with the same shape as the input.
 
-        return processed
+        The array is a read-only broadcast of a single value so it doesn't
+        need any memory, no matter how big the tensor is.
+        """
+        xp = tensor.xp
+        ones = Tensor(
+            xp.ones((), dtype=tensor.dtype),
+            is_batched=tensor.is_batched,
+            requires_grad=False,
+            dtype=tensor.dtype,
+        )
+        ones.array = xp.broadcast_to(ones.array, tensor.shape)
+        return ones
 
     def __call__(self, *tensors: Tensor):
         """
@@ -405,17 +696,46 @@ class Einsum:
         Returns:
             Tensor: The result of the einsum operation.
         """
-        xp = select_backend(*tensors)
-        subscript, tensors, batch_output = self._handle_batched(
-            self.subscript, tensors
+        if TRICYCLE_CONTEXT.profiler is not None:
+            return TRICYCLE_CONTEXT.profiler.forward(
+                self, self._forward, tensors, {}
+            )
+        return self._forward(*tensors)
+
+    def _forward(self, *tensors: Tensor) -> Tensor:
+        """
+        Run the compiled einsum on the input tensors and attach the backward
+        operations.
+        """
+        compiled = self.compile(
+            self.subscript.subscript,
+            tuple(t.is_batched for t in tensors),
+            tuple(t.shape for t in tensors),
         )
-        subscript, tensors = self._handle_single_tensor(subscript, tensors)
-        tensor_data = [t.array for t in tensors]
-        result = Tensor(xp.einsum(str(subscript), *tensor_data))
-        if batch_output:
+        tensors = list(tensors)
+        if compiled.single and (
+            compiled.expand or TRICYCLE_CONTEXT.grad_enabled
+        ):
+            tensors.append(self._ones_like(tensors[0]))
+
+        inputs = (
+            tensors[:1] if compiled.single and not compiled.expand else tensors
+        )
+        result = Tensor(compiled.forward(*[t.array for t in inputs]))
+        if compiled.batch_output:
             result.is_batched = True
-
-        result.args = tuple(tensors)
-        result.back_fns = tuple(self._build_back_ops(tensors, subscript))
         result.name = f"einsum {self.subscript}"
+        if not TRICYCLE_CONTEXT.grad_enabled:
+            return result
+
+        result.args = tuple(inputs)
+        result.back_fns = tuple(
+            EinsumBackOp(
+                idx,
+                tensors,
+                compiled.back_subscript,
+                combined_subscript=compiled.back_subscripts[idx],
+            )
+            for idx in range(len(inputs))
+        )
         return result
@@ -0,0 +1,403 @@
+"""
+Batched text generation for serving many prompts at once.
+
+Generating tokens for one prompt at a time wastes most of the work a CPU can
+do in a single forward pass. The `GenerationEngine` in this module keeps a
+pool of in-flight requests and, every step, passes all of them through the
+model as a single batch. Requests that have finished are dropped from the
+batch and new requests are admitted as soon as there is space for them
+(continuous batching) so the batch stays full.
+
+Example usage:
+    >>> engine = GenerationEngine(model, max_batch_size=8)
+    >>> request = engine.submit([1, 2, 3], max_new_tokens=16)
+    >>> engine.run_until_complete()
+    >>> request.generated
+    [...]
+
+Or, from asyncio code:
+    >>> async for token in engine.stream([1, 2, 3], max_new_tokens=16):
+    ...     print(token)
+"""
+
+import asyncio
+import itertools
+from collections import deque
+from typing import AsyncIterator, Sequence
+
+import numpy as np
+
+from tricycle.context import NoGrad
+from tricycle.functions import Softmax
+from tricycle.models import GPT
+from tricycle.tensor import Tensor
+
+
+class GenerationRequest:
+    """
+    A single prompt that is being generated from.
+
+    Attributes:
+        request_id (int): Unique identifier for the request.
+        tokens (list[int]): The prompt followed by every generated token.
+        generated (list[int]): Only the tokens that have been generated.
+        max_new_tokens (int): Stop after generating this many tokens.
+        temperature (float): Temperature to divide the logits by before
+            sampling.
+        sample (bool): Whether to sample from the predicted distribution or
+            pick the most likely token.
+        stop_token (int | None): Stop as soon as this token is generated.
+        finished (bool): Whether the request has finished generating.
+        stream (asyncio.Queue | None): If set, every generated token is put
+            onto this queue, followed by None once the request finishes.
+            Queues are written to from the thread that runs `step`, so
+            `GenerationEngine` wraps them to be thread safe when they are
+            created inside an event loop.
+    """
+
+    _ids = itertools.count()
+
+    def __init__(
+        self,
+        tokens: Sequence[int],
+        max_new_tokens: int,
+        temperature: float = 0.8,
+        sample: bool = True,
+        stop_token: int | None = None,
+        stream: asyncio.Queue | None = None,
+    ):
+        self.request_id = next(self._ids)
+        self.tokens = [int(token) for token in tokens]
+        self.generated = []
+        self.max_new_tokens = max_new_tokens
+        self.temperature = temperature
+        self.sample = sample
+        self.stop_token = stop_token
+        self.finished = max_new_tokens <= 0
+        self.stream = stream
+
+    def add_token(self, token: int):
+        """
+        Record a newly generated token and check whether we are done.
+
+        Args:
+            token (int): The generated token.
+        """
+        self.tokens.append(token)
+        self.generated.append(token)
+
+        if (
+            len(self.generated) >= self.max_new_tokens
+            or token == self.stop_token
+        ):
+            self.finished = True
+
+    def __repr__(self):
+        return (
+            f"GenerationRequest(id={self.request_id}, "
+            f"generated={len(self.generated)}, finished={self.finished})"
+        )
+
+
+class GenerationEngine:
+    """
+    Generates tokens for many requests at once with continuous batching.
+
+    Each call to `step` builds a batch from every active request, padding
+    shorter prompts at the end, and runs a single forward pass of the model.
+    Because attention is causal, the padding does not change the prediction
+    for any real token.
+
+    The kv cache is not used here because every request in the batch is at
+    a different position in its sequence.
+
+    Attributes:
+        model (GPT): The model to generate tokens with.
+        max_batch_size (int): The maximum number of requests to pass through
+            the model at once.
+        pad_token (int): Token used to pad shorter sequences in a batch.
+        waiting (deque[GenerationRequest]): Requests that have been submitted
+            but not admitted into the batch yet.
+        active (list[GenerationRequest]): Requests currently being generated.
+    """
+
+    def __init__(self, model: GPT, max_batch_size: int = 8, pad_token=0):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.pad_token = pad_token
+        self.waiting = deque()
+        self.active = []
+
+    def submit(
+        self,
+        tokens: Sequence[int],
+        max_new_tokens: int,
+        temperature: float = 0.8,
+        sample: bool = True,
+        stop_token: int | None = None,
+        stream: asyncio.Queue | None = None,
+    ) -> GenerationRequest:
+        """
+        Queue a prompt for generation.
+
+        The request will be admitted into the batch at the start of the next
+        step where there is space for it.
+
+        Args:
+            tokens (Sequence[int]): The prompt.
+            max_new_tokens (int): The maximum number of tokens to generate.
+            temperature (float, optional): Sampling temperature.
+                Defaults to 0.8.
+            sample (bool, optional): Whether to sample or pick the most likely
+                token. Defaults to True.
+            stop_token (int | None, optional): Stop generating once this token
+                is produced. Defaults to None.
+            stream (asyncio.Queue | None, optional): Queue to stream generated
+                tokens to. If this is called from inside an event loop, the
+                tokens are handed back to that loop thread safely so `serve`
+                can run `step` in a worker thread. Defaults to None.
+
+        Returns:
+            GenerationRequest: A handle to the queued request.
+        """
+        if not tokens:
+            raise ValueError("Cannot generate from an empty prompt")
+
+        request = GenerationRequest(
+            tokens=tokens,
+            max_new_tokens=max_new_tokens,
+            temperature=temperature,
+            sample=sample,
+            stop_token=stop_token,
+            stream=_thread_safe(stream),
+        )
+        # deque.append is atomic so this is safe to call while another
+        # thread is running `step`
+        self.waiting.append(request)
+        return request
+
+    @property
+    def has_work(self) -> bool:
+        """
+        Whether there are any requests that still need tokens generated.
+        """
+        return bool(self.active or self.waiting)
+
+    def _admit(self):
+        """
+        Move waiting requests into the batch until it is full.
+        """
+        while self.waiting and len(self.active) < self.max_batch_size:
+            request = self.waiting.popleft()
+            if request.finished:
+                self._finish(request)
+                continue
+            self.active.append(request)
+
+    def _finish(self, request: GenerationRequest):
+        """
+        Tell anyone listening to a request that it is done.
+        """
+        if request.stream is not None:
+            request.stream.put_nowait(None)
+
+    def _build_batch(self) -> tuple[Tensor, list[int]]:
+        """
+        Pad the most recent tokens of every active request into one batch.
+
+        Returns:
+            tuple[Tensor, list[int]]: The padded batch of tokens and the
+                number of real tokens in each row.
+        """
+        context_window = self.model.context_window
+        windows = [request.tokens[-context_window:] for request in self.active]
+        lengths = [len(window) for window in windows]
+
+        batch = np.full(
+            (len(windows), max(lengths)), self.pad_token, dtype=np.int64
+        )
+        for row, window in enumerate(windows):
+            batch[row, : len(window)] = window
+
+        batch = Tensor(batch, requires_grad=False, is_batched=True, dtype=int)
+        return batch, lengths
+
+    def _pick_tokens(self, logits: Tensor) -> list[int]:
+        """
+        Choose the next token for every request from its final logits.
+
+        Args:
+            logits (Tensor): Logits with shape (n_active, vocab_size).
+
+        Returns:
+            list[int]: The next token for each active request.
+        """
+        xp = logits.xp
+        temperatures = xp.asarray(
+            [request.temperature for request in self.active],
+            dtype=logits.dtype,
+        )
+        scaled = Tensor(logits.array / temperatures[:, None], is_batched=True)
+        probabilities = Softmax()(scaled).numpy()
+
+        tokens = []
+        for request, row in zip(self.active, probabilities):
+            if request.sample:
+                # softmax in low precision doesn't quite sum to 1
+                row = row.astype(np.float64)
+                row /= row.sum()
+                token = np.random.choice(len(row), p=row)
+            else:
+                token = np.argmax(row)
+            tokens.append(int(token))
+        return tokens
+
+    def step(self) -> list[tuple[GenerationRequest, int]]:
+        """
+        Generate a single token for every active request.
+
+        Finished requests are removed from the batch and waiting requests
+        are admitted to take their place.
+
+        Returns:
+            list[tuple[GenerationRequest, int]]: Each request that was in the
+                batch along with the token that was generated for it.
+        """
+        self._admit()
+        if not self.active:
+            return []
+
+        batch, lengths = self._build_batch()
+        with NoGrad():
+            logits = self.model(batch, lengths=lengths)
+
+            # we only need the prediction after the final real token of each
+            # row
+            rows = np.arange(len(lengths))
+            last = np.asarray(lengths) - 1
+            logits = Tensor(logits.array[rows, last], is_batched=True)
+            tokens = self._pick_tokens(logits)
+
+        generated = []
+        for request, token in zip(self.active, tokens):
+            request.add_token(token)
+            if request.stream is not None:
+                request.stream.put_nowait(token)
+            generated.append((request, token))
+
+        still_active = []
+        for request in self.active:
+            if request.finished:
+                self._finish(request)
+            else:
+                still_active.append(request)
+        self.active = still_active
+
+        return generated
+
+    def run_until_complete(self):
+        """
+        Keep stepping until every submitted request has finished.
+        """
+        while self.has_work:
+            self.step()
+
+    async def serve(self, requests: asyncio.Queue | None = None):
+        """
+        Generate tokens forever, admitting new requests as they arrive.
+
+        The forward pass runs in a worker thread so the event loop is free to
+        accept new requests and stream tokens back while the model is busy.
+
+        Args:
+            requests (asyncio.Queue | None, optional): A queue of
+                GenerationRequests to admit. Requests can also be added with
+                `submit`. Defaults to None.
+        """
+
+        def admit(request: GenerationRequest):
+            request.stream = _thread_safe(request.stream)
+            self.waiting.append(request)
+
+        while True:
+            if requests is not None:
+                while not requests.empty():
+                    admit(requests.get_nowait())
+
+            if not self.has_work:
+                if requests is None:
+                    await asyncio.sleep(0.001)
+                else:
+                    admit(await requests.get())
+                continue
+
+            await asyncio.to_thread(self.step)
+
+    async def stream(
+        self,
+        tokens: Sequence[int],
+        max_new_tokens: int,
+        temperature: float = 0.8,
+        sample: bool = True,
+        stop_token: int | None = None,
+    ) -> AsyncIterator[int]:
+        """
+        Submit a prompt and yield tokens for it as they are generated.
+
+        `serve` needs to be running in the same event loop for any tokens
+        to be produced.
+
+        Args:
+            tokens (Sequence[int]): The prompt.
+            max_new_tokens (int): The maximum number of tokens to generate.
+            temperature (float, optional): Sampling temperature.
+                Defaults to 0.8.
+            sample (bool, optional): Whether to sample or pick the most likely
+                token. Defaults to True.
+            stop_token (int | None, optional): Stop generating once this token
+                is produced. Defaults to None.
+
+        Yields:
+            int: Each generated token.
+        """
+        queue = asyncio.Queue()
+        self.submit(
+            tokens,
+            max_new_tokens=max_new_tokens,
+            temperature=temperature,
+            sample=sample,
+            stop_token=stop_token,
+            stream=queue,
+        )
+        while (token := await queue.get()) is not None:
+            yield token
+
+
+class _ThreadSafeQueue:
+    """
+    Wraps an asyncio.Queue so it can be written to from another thread.
+    """
+
+    def __init__(self, queue: asyncio.Queue, loop: asyncio.AbstractEventLoop):
+        self.queue = queue
+        self.loop = loop
+
+    def put_nowait(self, item):
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, item)
+
+
+def _thread_safe(stream: asyncio.Queue | None):
+    """
+    Make a stream safe to write to from the thread that runs `step`.
+
+    asyncio queues can only be used from the thread running their event
+    loop. If there is no running loop, `step` must be running in this thread
+    so the queue is left as it is.
+    """
+    if not isinstance(stream, asyncio.Queue):
+        return stream
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return stream
+    return _ThreadSafeQueue(stream, loop)
@@ -0,0 +1,547 @@
+"""
+Faster alternatives to `Tensor.backward` for graphs that are recorded as
+they are built.
+
+Every call to `Tensor.backward` rediscovers the graph: `_attach_parents`
+walks every tensor to label its parents (in a set of ids) and
+`_calculate_gradients` uses those labels to figure out a topological order.
+This bookkeeping is a large share of the time spent in python each step.
+
+A `Tape` records every tensor in the order it was created. Because a tensor
+can only be built from tensors that already exist, walking the tape in
+reverse visits every tensor after all of the tensors that were built from
+it, so `Tape.backward` can pass gradients backwards in a single linear pass.
+Reference counts are used to check that every gradient for a tensor has
+arrived before it is passed on.
+
+Example usage:
+    >>> with Tape() as tape:
+    ...     loss = loss_fn(outputs, model(inputs))
+    >>> tape.backward(loss)
+
+When training a model, the graph is usually identical from one step to the
+next. A `StaticGraph` records the order that tensors are created during a
+forward pass along with the order that gradients were passed between them
+during the first backward pass. On later steps, if the forward pass created
+the same tensors (with the same shapes), the recorded order is replayed
+directly without any graph traversal.
+
+Example usage:
+    >>> graph = StaticGraph()
+    >>> for inputs, outputs in dataloader:
+    ...     with graph.record():
+    ...         loss = loss_fn(outputs, model(inputs))
+    ...     graph.backward(loss)
+    ...     model.update(optimiser)
+    ...     model.zero_grad()
+
+Many backward functions are independent of each other (e.g. the gradients
+for the weights and the input of a dense layer) and spend most of their time
+in numpy calls that release the GIL. A `ThreadedBackward` runs every
+backward function whose inputs are ready on a pool of threads so that these
+calls can overlap. Handing work between threads has a cost so this is only
+worth using on machines with several cores to spare.
+
+Example usage:
+    >>> with ThreadedBackward(n_threads=4) as threaded:
+    ...     for inputs, outputs in dataloader:
+    ...         loss = loss_fn(outputs, model(inputs))
+    ...         threaded.backward(loss)
+    ...         model.update(optimiser)
+    ...         model.zero_grad()
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from tricycle.context import TRICYCLE_CONTEXT
+from tricycle.tensor import Tensor
+
+
+@contextmanager
+def _clipping(clip: float | None):
+    """
+    Let backward functions that run their own backward pass see the clip
+    value for the rest of the block. See `TricycleContext.clip`.
+    """
+    previous, TRICYCLE_CONTEXT.clip = TRICYCLE_CONTEXT.clip, clip
+    try:
+        yield
+    finally:
+        TRICYCLE_CONTEXT.clip = previous
+
+
+class Tape:
+    """
+    Context manager that records every tensor created while it is active.
+
+    Attributes:
+        tensors (list[Tensor]): The tensors that were created, in order.
+    """
+
+    def __init__(self):
+        self.tensors = []
+        self._previous = None
+
+    def __enter__(self):
+        """Start recording tensors."""
+        self._previous = TRICYCLE_CONTEXT.tape
+        TRICYCLE_CONTEXT.tape = self.tensors
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        """Stop recording tensors."""
+        TRICYCLE_CONTEXT.tape = self._previous
+
+    @staticmethod
+    def _call(back_fn, grad: Tensor, arg: Tensor) -> Tensor:
+        """
+        Call a backward function, timing it if a profiler is active.
+        """
+        if TRICYCLE_CONTEXT.profiler is None:
+            return back_fn(grad)
+        return TRICYCLE_CONTEXT.profiler.backward(back_fn, grad, arg)
+
+    def _find(self, tensor: Tensor) -> int:
+        """
+        Find the position of a tensor on the tape.
+        """
+        # the loss is almost always the final tensor created so search from
+        # the end
+        for position in range(len(self.tensors) - 1, -1, -1):
+            if self.tensors[position] is tensor:
+                return position
+        raise ValueError("Tensor was not created while the tape was recording")
+
+    def _count_references(self, root: int) -> dict[int, int] | None:
+        """
+        Count how many gradients each tensor will receive.
+
+        Returns:
+            dict[int, int] | None: The number of edges into each tensor that
+                `root` depends on, keyed by id. None if part of the graph was
+                not recorded on the tape, or was modified after it was
+                created, in which case the tape can't be used.
+        """
+        positions = {
+            id(tensor): position
+            for position, tensor in enumerate(self.tensors[: root + 1])
+        }
+        references = {id(self.tensors[root]): 0}
+
+        for position in range(root, -1, -1):
+            node = self.tensors[position]
+            if id(node) not in references:
+                continue
+            if node.args is None or node.back_fns is None:
+                continue
+
+            for arg in node.args:
+                if not arg.requires_grad:
+                    continue
+
+                # inputs and parameters can come from anywhere but anything
+                # with a gradient of its own must come earlier on the tape
+                has_graph = arg.args is not None and arg.back_fns is not None
+                if has_graph and positions.get(id(arg), position) >= position:
+                    return None
+
+                references[id(arg)] = references.get(id(arg), 0) + 1
+        return references
+
+    def backward(
+        self,
+        loss: Tensor,
+        clip: float | None = None,
+        grad: Tensor | None = None,
+        schedule: list[tuple[int, int]] | None = None,
+        retain_graph: bool = False,
+    ) -> bool:
+        """
+        Calculate gradients for every tensor that `loss` depends on by
+        walking the tape in reverse.
+
+        This calculates the same gradients as `loss.backward()`. If part of
+        the graph was not recorded on this tape, this falls back to
+        `loss.backward()`.
+
+        Args:
+            loss (Tensor): The tensor to differentiate. It must have been
+                created while the tape was recording.
+            clip (float | None, optional): Maximum absolute value for gradient clipping. Defaults to None.
+            grad (Tensor | None, optional): The gradient of `loss`. Defaults
+                to a gradient of ones.
+            schedule (list[tuple[int, int]] | None, optional): If passed,
+                each edge that gradients are passed along is appended to this
+                list as a (tape position, argument index) pair. Defaults to
+                None.
+            retain_graph (bool, optional): Whether to keep the graph after
+                the backward pass. See `Tensor.backward`. Unless this is
+                True, the tape is emptied as it is walked so it can't be
+                used again. Defaults to False.
+
+        Returns:
+            bool: Whether the tape was used. If False, the schedule is left
+                empty.
+        """
+        root = self._find(loss)
+        references = self._count_references(root)
+        if references is None:
+            loss.backward(clip=clip, grad=grad, retain_graph=retain_graph)
+            if not retain_graph:
+                self.tensors.clear()
+            return False
+
+        if grad is None:
+            grad = Tensor(
+                loss.xp.ones(loss.array.shape, dtype=loss.dtype),
+                requires_grad=False,
+                is_batched=loss.is_batched,
+            )
+        loss.grad = grad
+
+        with _clipping(clip):
+            for position in range(root, -1, -1):
+                node = self.tensors[position]
+                if not retain_graph:
+                    # the tape would otherwise keep every activation alive
+                    # until the tape itself is thrown away
+                    self.tensors[position] = None
+                remaining = references.pop(id(node), None)
+                if remaining is None:
+                    # loss does not depend on this tensor
+                    continue
+                assert remaining == 0, "A gradient was not passed backwards"
+                if node.args is None or node.back_fns is None:
+                    continue
+
+                for idx, (arg, back_fn) in enumerate(
+                    zip(node.args, node.back_fns)
+                ):
+                    if not arg.requires_grad:
+                        continue
+
+                    arg._accumulate_grad(
+                        self._call(back_fn, node.grad, arg), clip=clip
+                    )
+                    references[id(arg)] -= 1
+                    if schedule is not None:
+                        schedule.append((position, idx))
+
+                if not retain_graph:
+                    node._release_graph()
+
+        if not retain_graph:
+            self.tensors.clear()
+        return True
+
+
+class StaticGraph:
+    """
+    Capture the backward schedule of a graph and replay it on later steps.
+
+    The schedule is stored as a list of (node, argument) index pairs, where
+    the node index is the position of a tensor on the tape. Replaying the
+    schedule calls exactly the same backward functions, in exactly the same
+    order, as `Tape.backward` so the gradients are identical.
+
+    If the signature of the recorded graph changes (e.g. because the batch
+    has a different shape) the graph is captured again.
+
+    Attributes:
+        signature (tuple | None): Shape and structure of the captured graph.
+        schedule (list[tuple[int, int]] | None): The captured backward
+            schedule.
+        n_captures (int): The number of times a graph was captured.
+        n_replays (int): The number of times a captured graph was replayed.
+    """
+
+    def __init__(self):
+        self.signature = None
+        self.schedule = None
+        self.n_captures = 0
+        self.n_replays = 0
+        self._tape = None
+
+    def record(self) -> Tape:
+        """
+        Record the forward pass for the next call to `backward`.
+
+        Returns:
+            Tape: A context manager that records tensors.
+        """
+        self._tape = Tape()
+        return self._tape
+
+    def _signature(self, tensors: list[Tensor], root: int) -> tuple:
+        """
+        Summarise the structure of a graph so we can tell whether a
+        captured schedule can be reused.
+        """
+        return (root,) + tuple(
+            (
+                tensor.array.shape,
+                tensor.requires_grad,
+                None if tensor.args is None else len(tensor.args),
+            )
+            for tensor in tensors
+        )
+
+    def _capture(
+        self,
+        tape: Tape,
+        loss: Tensor,
+        clip: float | None,
+        retain_graph: bool,
+    ) -> list[tuple[int, int]] | None:
+        """
+        Run a backward pass along the tape, keeping track of the edges it
+        visits.
+
+        Returns:
+            list[tuple[int, int]] | None: The schedule, or None if the graph
+                contains tensors that were created outside of `record`.
+        """
+        schedule = []
+        if not tape.backward(
+            loss, clip=clip, schedule=schedule, retain_graph=retain_graph
+        ):
+            return None
+        return schedule
+
+    def _replay(
+        self,
+        tensors: list[Tensor],
+        loss: Tensor,
+        clip: float | None,
+        retain_graph: bool,
+    ):
+        """
+        Pass gradients backwards along a previously captured schedule.
+        """
+        loss.grad = Tensor(
+            loss.xp.ones(loss.array.shape, dtype=loss.dtype),
+            requires_grad=False,
+            is_batched=loss.is_batched,
+        )
+        # once the last gradient has been passed out of a node, its graph
+        # can be released, just like in Tape.backward
+        last_edges = {
+            node_idx: step for step, (node_idx, _) in enumerate(self.schedule)
+        }
+        with _clipping(clip):
+            for step, (node_idx, arg_idx) in enumerate(self.schedule):
+                node = tensors[node_idx]
+                arg = node.args[arg_idx]
+                grad = Tape._call(node.back_fns[arg_idx], node.grad, arg)
+                arg._accumulate_grad(grad, clip=clip)
+
+                if not retain_graph and last_edges[node_idx] == step:
+                    node._release_graph()
+                    tensors[node_idx] = None
+
+        if not retain_graph:
+            tensors.clear()
+
+    def backward(
+        self,
+        loss: Tensor,
+        clip: float | None = None,
+        retain_graph: bool = False,
+    ):
+        """
+        Calculate gradients for every parameter that `loss` depends on.
+
+        `loss` must have been created inside `record`.
+
+        Args:
+            loss (Tensor): The tensor to differentiate.
+            clip (float | None, optional): Maximum absolute value for gradient clipping. Defaults to None.
+            retain_graph (bool, optional): Whether to keep the graph after
+                the backward pass. See `Tensor.backward`. Defaults to False.
+        """
+        if self._tape is None:
+            raise ValueError(
+                "No forward pass has been recorded. Create the loss inside "
+                "StaticGraph.record first."
+            )
+        tape = self._tape
+        tensors = tape.tensors
+        self._tape = None
+
+        try:
+            root = tape._find(loss)
+        except ValueError:
+            raise ValueError("loss was not created inside StaticGraph.record")
+
+        signature = self._signature(tensors, root)
+        if self.schedule is not None and signature == self.signature:
+            self._replay(tensors, loss, clip, retain_graph)
+            self.n_replays += 1
+            return
+
+        self.schedule = self._capture(tape, loss, clip, retain_graph)
+        self.signature = signature if self.schedule is not None else None
+        self.n_captures += 1
+
+
+class ThreadedBackward:
+    """
+    Pass gradients backwards using a pool of threads.
+
+    Before the backward pass, we count how many gradients each tensor will
+    receive. A tensor is ready once all of them have arrived, at which point
+    a task is queued for each of its backward functions. Gradients for the
+    same tensor are added together one at a time, behind a lock for that
+    tensor, so the result is the same as `Tensor.backward` (up to the order
+    that floating point numbers are added in).
+
+    Backward functions belonging to the same op can run at the same time so
+    they must not write to shared state on the op.
+
+    Attributes:
+        n_threads (int): The number of threads in the pool.
+    """
+
+    def __init__(self, n_threads: int | None = None):
+        self.n_threads = n_threads or os.cpu_count() or 1
+        self._executor = None
+
+    def __enter__(self):
+        """Use this scheduler until the end of the block."""
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        """Stop the thread pool."""
+        self.close()
+
+    def close(self):
+        """Stop the thread pool. It is restarted by the next `backward`."""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    @staticmethod
+    def _count_references(loss: Tensor) -> dict[int, int]:
+        """
+        Count how many gradients each tensor that `loss` depends on will
+        receive, keyed by id.
+
+        Like `Tensor.backward`, this also forgets any gradients left on
+        intermediate tensors by a previous backward pass.
+        """
+        references = {id(loss): 0}
+        stack = [loss]
+        while stack:
+            node = stack.pop()
+            if node.args is None or node.back_fns is None:
+                continue
+            node.grad = None
+            for arg in node.args:
+                if not arg.requires_grad:
+                    continue
+                if id(arg) not in references:
+                    references[id(arg)] = 0
+                    stack.append(arg)
+                references[id(arg)] += 1
+        return references
+
+    def backward(
+        self,
+        loss: Tensor,
+        clip: float | None = None,
+        grad: Tensor | None = None,
+        retain_graph: bool = False,
+    ):
+        """
+        Calculate gradients for every tensor that `loss` depends on.
+
+        Args:
+            loss (Tensor): The tensor to differentiate.
+            clip (float | None, optional): Maximum absolute value for gradient clipping. Defaults to None.
+            grad (Tensor | None, optional): The gradient of `loss`. Defaults
+                to a gradient of ones.
+            retain_graph (bool, optional): Whether to keep the graph after
+                the backward pass. See `Tensor.backward`. Defaults to False.
+        """
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.n_threads,
+                thread_name_prefix="tricycle-backward",
+            )
+
+        references = self._count_references(loss)
+        locks = {key: threading.Lock() for key in references}
+        remaining_edges = {}
+        state_lock = threading.Lock()
+        finished = threading.Event()
+        outstanding = 0
+        errors = []
+
+        if grad is None:
+            grad = Tensor(
+                loss.xp.ones(loss.array.shape, dtype=loss.dtype),
+                requires_grad=False,
+                is_batched=loss.is_batched,
+            )
+        loss.grad = grad
+
+        def submit(node: Tensor):
+            """Queue every backward function of a node whose gradient is
+            complete."""
+            nonlocal outstanding
+            if node.args is None or node.back_fns is None:
+                return
+            edges = [
+                (arg, back_fn)
+                for arg, back_fn in zip(node.args, node.back_fns)
+                if arg.requires_grad
+            ]
+            if not edges:
+                if not retain_graph:
+                    node._release_graph()
+                return
+
+            with state_lock:
+                remaining_edges[id(node)] = len(edges)
+                outstanding += len(edges)
+            for arg, back_fn in edges:
+                self._executor.submit(run, node, arg, back_fn)
+
+        def run(node: Tensor, arg: Tensor, back_fn):
+            """Pass a gradient along a single edge."""
+            nonlocal outstanding
+            try:
+                if not errors:
+                    result = Tape._call(back_fn, node.grad, arg)
+                    with locks[id(arg)]:
+                        arg._accumulate_grad(result, clip=clip)
+                        references[id(arg)] -= 1
+                        ready = references[id(arg)] == 0
+                    if ready:
+                        submit(arg)
+
+                    with state_lock:
+                        remaining_edges[id(node)] -= 1
+                        node_done = remaining_edges[id(node)] == 0
+                    if node_done and not retain_graph:
+                        node._release_graph()
+            except Exception as e:
+                errors.append(e)
+            finally:
+                with state_lock:
+                    outstanding -= 1
+                    if outstanding == 0:
+                        finished.set()
+
+        with _clipping(clip):
+            submit(loss)
+            with state_lock:
+                if outstanding == 0:
+                    finished.set()
+            finished.wait()
+
+        if errors:
+            raise errors[0]
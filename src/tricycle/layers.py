@@ -3,10 +3,13 @@ from typing import Sequence
 
 from numpy._typing import ArrayLike
 
+from tricycle import arena
 from tricycle.binary import BinaryMultiply
 from tricycle.context import TRICYCLE_CONTEXT
 from tricycle.initialisers import init_xavier
 from tricycle.optimisers import Optimiser
+from tricycle.precision import activation_dtype, cast_parameter, compute_dtype
+from tricycle.sparse import RowSparseTensor, segment_sum
 from tricycle.tensor import Tensor
 from tricycle.unary import nothing
 
@@ -48,7 +51,15 @@ class Layer(ABC):
         Returns:
             The result of the forward pass.
         """
-        return self.forward(tensor, *args, **kwargs)
+        if TRICYCLE_CONTEXT.profiler is not None:
+            result = TRICYCLE_CONTEXT.profiler.forward(
+                self, self.forward, (tensor, *args), kwargs, category="layer"
+            )
+        else:
+            result = self.forward(tensor, *args, **kwargs)
+        if not TRICYCLE_CONTEXT.grad_enabled:
+            self.clear_activations()
+        return result
 
     def update(self, optimiser: Optimiser):
         """
@@ -63,6 +74,30 @@ class Layer(ABC):
         """Reset gradients to zero."""
         pass
 
+    def parameters(self) -> list[Tensor]:
+        """
+        Get every trainable tensor in this layer.
+
+        By default, this collects the parameters of every sub-layer.
+
+        Returns:
+            list[Tensor]: The parameters of this layer.
+        """
+        return [
+            parameter
+            for layer in self.layers
+            for parameter in layer.parameters()
+        ]
+
+    def clear_activations(self):
+        """
+        Forget any intermediate values stored for the backward pass.
+
+        By default, this clears the activations of every sub-layer.
+        """
+        for layer in self.layers:
+            layer.clear_activations()
+
     def to_gpu(self, device: int = 0):
         """
         Move the layer to GPU.
@@ -146,11 +181,8 @@ class Dense(Layer):
         """
         xp = grad.xp
 
-        weights = self.weights.array
-        if TRICYCLE_CONTEXT.use_mixed_precision:
-            weights = weights.astype(xp.float16)
-
-        result = xp.tensordot(grad.array, self.weights.array, axes=[-1, -1])
+        weights = cast_parameter(self.weights, "dense")
+        result = xp.tensordot(grad.array, weights, axes=[-1, -1])
         return Tensor(
             result,
             requires_grad=grad.requires_grad,
@@ -171,12 +203,17 @@ class Dense(Layer):
         xp = tensor.xp
 
         self._input = tensor.array
-        weights = self.weights.array
-
-        if TRICYCLE_CONTEXT.use_mixed_precision:
-            weights = weights.astype(xp.float16)
-
-        result = xp.tensordot(tensor.array, weights, axes=[-1, 0])
+        # under mixed precision, this reuses a low precision copy of the
+        # weights until the optimiser updates them
+        weights = cast_parameter(self.weights, "dense")
+
+        # a dense layer is a matrix multiplication over the final axis so we
+        # can write the output straight into a buffer
+        out_shape = tensor.shape[:-1] + (self.to_size,)
+        out = arena.empty(
+            out_shape, xp.result_type(tensor.array, weights), xp=xp
+        )
+        result = xp.matmul(tensor.array, weights, out=out)
 
         return Tensor(
             result,
@@ -199,6 +236,14 @@ class Dense(Layer):
         """Reset gradients to zero."""
         self.weights.grad = None
 
+    def parameters(self) -> list[Tensor]:
+        """Get the weights of this layer."""
+        return [self.weights]
+
+    def clear_activations(self):
+        """Forget the input stored for the backward pass."""
+        self._input = None
+
     def to_gpu(self, device: int = 0):
         """
         Move the layer to GPU.
@@ -302,8 +347,9 @@ class LayerNorm(Layer):
         xp = tensor.xp
         x = tensor.array
 
-        if TRICYCLE_CONTEXT.use_mixed_precision:
-            x = x.astype(xp.float32)
+        dtype = compute_dtype("layer_norm")
+        if dtype is not None:
+            x = x.astype(dtype, copy=False)
         self._mean = x.mean(axis=-1, keepdims=True)
         self._var = x.var(axis=-1, keepdims=True)
         self._input = x
@@ -311,8 +357,9 @@ class LayerNorm(Layer):
         x_norm = (x - self._mean) / xp.sqrt(self._var + self.eps)
         output = self.gamma.array * x_norm + self.beta.array
 
-        if TRICYCLE_CONTEXT.use_mixed_precision:
-            output = output.astype(xp.float16)
+        dtype = activation_dtype()
+        if dtype is not None:
+            output = output.astype(dtype, copy=False)
 
         return Tensor(
             output,
@@ -421,6 +468,16 @@ class LayerNorm(Layer):
         self.gamma.grad = None
         self.beta.grad = None
 
+    def parameters(self) -> list[Tensor]:
+        """Get the scale and shift of this layer."""
+        return [self.gamma, self.beta]
+
+    def clear_activations(self):
+        """Forget the input and statistics stored for the backward pass."""
+        self._input = None
+        self._mean = None
+        self._var = None
+
     def to_gpu(self, device: int = 0):
         """
         Move the layer to GPU.
@@ -481,10 +538,12 @@ class RMSNorm(Layer):
         xp = tensor.xp
         x = tensor.array
 
-        # RMSNorm is pretty sensitive to errors so we'll use full precision
-        if TRICYCLE_CONTEXT.use_mixed_precision:
-            x = x.astype(xp.float32)
-            self.weights.array = self.weights.array.astype(xp.float32)
+        # RMSNorm is pretty sensitive to errors so, by default, the
+        # precision policy uses full precision
+        dtype = compute_dtype("rms_norm")
+        if dtype is not None:
+            x = x.astype(dtype, copy=False)
+            self.weights.array = self.weights.array.astype(dtype, copy=False)
 
         # Compute square mean along the feature dimension
         mean_square = (x**2).mean(axis=-1, keepdims=True)
@@ -495,8 +554,9 @@ class RMSNorm(Layer):
         x_norm = x * self._divisor
         output = self.weights.array * x_norm
 
-        if TRICYCLE_CONTEXT.use_mixed_precision:
-            output = output.astype(xp.float16)
+        dtype = activation_dtype()
+        if dtype is not None:
+            output = output.astype(dtype, copy=False)
 
         return Tensor(
             output,
@@ -571,6 +631,15 @@ class RMSNorm(Layer):
         """Resets the gradient of the weights to None."""
         self.weights.grad = None
 
+    def parameters(self) -> list[Tensor]:
+        """Get the weights of this layer."""
+        return [self.weights]
+
+    def clear_activations(self):
+        """Forget the input and statistics stored for the backward pass."""
+        self._input = None
+        self._divisor = None
+
     def to_gpu(self, device: int = 0):
         """Moves the layer's parameters to the GPU.
 
@@ -602,6 +671,9 @@ class Embedding(Layer):
     Attributes:
         weights (Tensor): The embedding matrix.
         vocab_size (int): Size of the vocabulary (number of embeddings).
+        sparse_grad (bool): Whether to return row-sparse gradients. If True,
+            the gradient only contains the rows that were looked up and
+            the optimisers only update those rows.
 
     """
 
@@ -611,11 +683,13 @@ class Embedding(Layer):
         to_size: int,
         name: str | None = None,
         initialiser=init_xavier,
+        sparse_grad: bool = False,
     ):
         self.weights = initialiser(
             (from_size, to_size), name=name or "weights"
         )
         self.vocab_size = from_size
+        self.sparse_grad = sparse_grad
 
     def back_fn(self, grad: Tensor):
         """Computes the gradient with respect to the embedding weights.
@@ -624,21 +698,36 @@ class Embedding(Layer):
             grad (Tensor): The gradient tensor.
 
         Returns:
-            Tensor: The gradient with respect to the embedding weights.
+            Tensor: The gradient with respect to the embedding weights. This
+                is a RowSparseTensor if `sparse_grad` is True.
         """
         xp = grad.xp
-        out = xp.zeros(self.weights.shape)
 
         match grad.ndim - self.input.ndim:
             case 1:
-                xp.add.at(out, self.input.array, grad.array)
+                values = grad.array
             case 2:
-                xp.add.at(out, self.input.array, grad.array.sum(axis=0))
+                values = grad.array.sum(axis=0)
             case _:
                 raise NotImplementedError(
                     f"{grad.ndim=}, {self.input.ndim=} are not supported"
                 )
 
+        # sum the gradients for repeated tokens together. This is much
+        # faster than scattering with add.at
+        rows, values = segment_sum(
+            self.input.array, values.astype(self.weights.dtype, copy=False)
+        )
+        if self.sparse_grad:
+            return RowSparseTensor(
+                rows,
+                values,
+                self.weights.shape,
+                requires_grad=grad.requires_grad,
+            )
+
+        out = arena.zeros(self.weights.shape, self.weights.dtype, xp=xp)
+        out[rows] = values
         return Tensor(out, requires_grad=grad.requires_grad)
 
     def forward(self, tensor: Tensor):
@@ -654,14 +743,9 @@ class Embedding(Layer):
             tensor.requires_grad is False
         ), "Cannot embed a differentiable tensor"
 
-        xp = tensor.xp
         self.input = tensor
 
-        weights = self.weights.array
-        # if were using mixed precision, copy the weights into 16 bit for
-        # processing
-        if TRICYCLE_CONTEXT.use_mixed_precision:
-            weights = weights.astype(xp.float16)
+        weights = cast_parameter(self.weights, "embedding")
 
         if tensor.is_batched:
             self._out = weights[tensor.array.flatten()].reshape(
@@ -669,12 +753,12 @@ class Embedding(Layer):
             )
         else:
             self._out = weights[tensor.array]
-        result = Tensor(self._out, is_batched=tensor.is_batched)
-
-        result.args = (tensor, self.weights)
-
-        result.back_fns = (nothing, self.back_fn)
-        return result
+        return Tensor(
+            self._out,
+            is_batched=tensor.is_batched,
+            args=(tensor, self.weights),
+            back_fns=(nothing, self.back_fn),
+        )
 
     def update(self, optimiser: Optimiser):
         """Updates the embedding weights using the given optimizer.
@@ -688,6 +772,15 @@ class Embedding(Layer):
         """Resets the gradient of the weights to None."""
         self.weights.grad = None
 
+    def parameters(self) -> list[Tensor]:
+        """Get the embedding matrix."""
+        return [self.weights]
+
+    def clear_activations(self):
+        """Forget the input and output stored for the backward pass."""
+        self.input = None
+        self._out = None
+
     def to_gpu(self, device: int = 0):
         """Moves the embedding weights to the GPU.
 
@@ -865,16 +958,19 @@ class RotaryEncode(Layer):
         grad_real = grad.array[..., 0::2]
         grad_imaginary = grad.array[..., 1::2]
 
-        input_grad_real = (
-            grad_real * self.freqs_cos + grad_imaginary * self.freqs_sin
-        )
+        # sequences can be shorter than the context window
+        n_tokens = grad.shape[-2]
+        freqs_cos = self.freqs_cos[:n_tokens]
+        freqs_sin = self.freqs_sin[:n_tokens]
+
+        input_grad_real = grad_real * freqs_cos + grad_imaginary * freqs_sin
         input_grad_imaginary = (
-            -grad_real * self.freqs_sin + grad_imaginary * self.freqs_cos
+            -grad_real * freqs_sin + grad_imaginary * freqs_cos
         )
 
         # Interleave the gradients back together so we get:
         # real, imaginary, real, imaginary, ...
-        out = xp.empty(grad.shape)
+        out = arena.empty(grad.shape, input_grad_real.dtype, xp=xp)
         out[..., 0::2] = input_grad_real
         out[..., 1::2] = input_grad_imaginary
 
@@ -901,15 +997,20 @@ class RotaryEncode(Layer):
         real = tensor.array[..., 0::2]
         imaginary = tensor.array[..., 1::2]
 
+        # sequences can be shorter than the context window
+        n_tokens = tensor.shape[-2]
+        freqs_cos = self.freqs_cos[:n_tokens]
+        freqs_sin = self.freqs_sin[:n_tokens]
+
         # combine the real an imaginary parts together with frequencies
-        out_real = real * self.freqs_cos - imaginary * self.freqs_sin
-        out_imaginary = real * self.freqs_sin + imaginary * self.freqs_cos
+        out_real = real * freqs_cos - imaginary * freqs_sin
+        out_imaginary = real * freqs_sin + imaginary * freqs_cos
 
         # Interleave the real and imaginary parts
         # back together so we get:
         # real, imaginary, real, imaginary, ...
         # in the final dimension
-        out = xp.empty(tensor.shape)
+        out = arena.empty(tensor.shape, out_real.dtype, xp=xp)
         out[..., 0::2] = out_real
         out[..., 1::2] = out_imaginary
 
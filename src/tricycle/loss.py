@@ -6,10 +6,14 @@ network training, such as Mean Squared Error and Cross Entropy.
 Classes:
     MeanSquaredError: Calculates the Mean Squared Error loss.
     CrossEntropy: Calculates the Cross Entropy loss.
+    ChunkedCrossEntropy: Calculates the Cross Entropy loss of a language
+        model without ever storing all of its logits.
 """
 
 import logging
+import threading
 
+from tricycle import arena
 from tricycle.context import TRICYCLE_CONTEXT
 from tricycle.ops import Op
 from tricycle.tensor import Tensor
@@ -120,6 +124,13 @@ class CrossEntropy(Op):
         )
         return tensor.array - log_sum_exp
 
+    def clear_activations(self):
+        """Forget everything stored for the backward pass."""
+        self._y_true = None
+        self._log_softmax_pred = None
+        self._out = None
+        self._grad = None
+
     def forward(self, y_true: Tensor, y_pred: Tensor) -> Tensor:
         """Computes the forward pass for Cross Entropy loss.
 
@@ -200,10 +211,14 @@ class CrossEntropy(Op):
         if TRICYCLE_CONTEXT.use_mixed_precision:
             grad.array = grad.array.astype(xp.float32)
 
+        grad_output = arena.empty(
+            self._log_softmax_pred.shape, self._log_softmax_pred.dtype, xp=xp
+        )
+        xp.exp(self._log_softmax_pred, out=grad_output)
+
         if ndim == 3:
             batch_indices = xp.arange(self._y_true.shape[0], dtype=int)
             token_indices = xp.arange(self._y_true.shape[1], dtype=int)
-            grad_output = xp.exp(self._log_softmax_pred)
             grad_output[
                 batch_indices[:, None], token_indices, self._y_true
             ] -= 1
@@ -213,11 +228,9 @@ class CrossEntropy(Op):
 
         elif ndim == 2:
             indices = xp.arange(self._y_true.shape[0], dtype=int)
-            grad_output = xp.exp(self._log_softmax_pred)
             grad_output[indices, self._y_true] -= 1
             grad_output *= grad.array / self._y_true.shape[0]
         elif ndim == 1:
-            grad_output = xp.exp(self._log_softmax_pred)
             grad_output[self._y_true] -= 1
             grad_output *= grad.array
         else:
@@ -232,3 +245,224 @@ class CrossEntropy(Op):
             self._grad = self._grad.astype(xp.float16)
 
         return Tensor(self._grad, is_batched=grad.is_batched)
+
+
+class ChunkedCrossEntropy(Op):
+    """Calculates Cross Entropy loss straight from the final hidden states of
+    a language model, fused with its output (head) layer.
+
+    For a language model with a big vocabulary, the logits are by far the
+    largest activation in the model: (batch, tokens, vocab_size) floats.
+    Regular Cross Entropy also needs a log softmax and a gradient of the
+    same size. This op passes a few tokens (a chunk) through the head at a
+    time and never stores more than one chunk of logits. The logits are
+    recomputed, a chunk at a time, in the backward pass.
+
+    Example usage:
+        >>> loss_fn = ChunkedCrossEntropy()
+        >>> hidden = model.hidden_states(inputs)
+        >>> loss = loss_fn(outputs, hidden, model.head.weights)
+
+    This gives the same loss and gradients as
+    `CrossEntropy()(outputs, model(inputs))`.
+
+    Args:
+        chunk_size: The number of tokens to process at a time.
+            Defaults to 256.
+
+    Attributes:
+        chunk_size: The number of tokens to process at a time.
+        _targets: The flattened true labels (cached for backward pass).
+        _hidden: The flattened hidden states (cached for backward pass).
+        _weights: The head weights (cached for backward pass).
+        _logsumexp: The log of the softmax denominator for each token
+            (cached for backward pass).
+        _lock: Stops the gradients being computed twice when both
+            backward functions run at once.
+    """
+
+    def __init__(self, chunk_size: int = 256):
+        self.chunk_size = chunk_size
+        self._grads = None
+        self._grads_for = None
+        # both back_fns share the gradients so, if they are called from
+        # different threads (see tricycle/graph.py:ThreadedBackward), only
+        # one of them can compute them
+        self._lock = threading.Lock()
+
+    def _logits(self, xp, start: int, end: int, out):
+        """Compute the logits for a chunk of tokens, in full precision."""
+        hidden = self._hidden[start:end].astype(xp.float32, copy=False)
+        return xp.matmul(hidden, self._weight_array, out=out[: end - start])
+
+    def _chunks(self):
+        """Yield the start and end of every chunk of tokens."""
+        n_tokens = len(self._targets)
+        for start in range(0, n_tokens, self.chunk_size):
+            yield start, min(start + self.chunk_size, n_tokens)
+
+    def forward(
+        self, y_true: Tensor, hidden: Tensor, weights: Tensor
+    ) -> Tensor:
+        """Computes the forward pass for Cross Entropy loss.
+
+        Args:
+            y_true: A Tensor containing the true labels.
+            hidden: A Tensor containing the hidden states that are passed to
+                the head layer.
+            weights: The weights of the head layer, with shape
+                (embedding_dim, vocab_size).
+
+        Returns:
+            A Tensor containing the computed Cross Entropy loss.
+        """
+        xp = hidden.xp
+
+        self._targets = y_true.array.reshape(-1)
+        self._hidden = hidden.array.reshape(-1, hidden.shape[-1])
+        self._hidden_shape = hidden.shape
+        self._hidden_is_batched = hidden.is_batched
+        self._hidden_requires_grad = hidden.requires_grad
+        self._weights = weights
+        # cross entropy reduces a huge matrix to a single number which makes
+        # it really sensitive to errors so we always use full precision
+        self._weight_array = weights.array.astype(xp.float32, copy=False)
+        self._grads = None
+        self._grads_for = None
+
+        n_tokens = len(self._targets)
+        self._logsumexp = xp.empty(n_tokens, dtype=xp.float32)
+        buffer = arena.empty(
+            (min(self.chunk_size, n_tokens), weights.shape[-1]),
+            xp.float32,
+            xp=xp,
+        )
+
+        loss = xp.zeros((), dtype=xp.float32)
+        for start, end in self._chunks():
+            logits = self._logits(xp, start, end, out=buffer)
+            rows = xp.arange(end - start)
+            target_logits = logits[rows, self._targets[start:end]]
+
+            x_max = xp.max(logits, axis=-1, keepdims=True)
+            logits -= x_max
+            xp.exp(logits, out=logits)
+            logsumexp = x_max[:, 0] + xp.log(xp.sum(logits, axis=-1))
+
+            self._logsumexp[start:end] = logsumexp
+            loss += xp.sum(logsumexp - target_logits)
+
+        if not TRICYCLE_CONTEXT.grad_enabled:
+            self._release()
+
+        self._out = loss / n_tokens
+        if TRICYCLE_CONTEXT.use_mixed_precision:
+            self._out = (
+                self._out.astype(xp.float16)
+                * TRICYCLE_CONTEXT.loss_scale_factor
+            )
+
+        return Tensor(
+            self._out,
+            is_batched=False,
+            args=(hidden, weights),
+            back_fns=(self.hidden_back_fn, self.weight_back_fn),
+            name="chunked_cross_entropy",
+        )
+
+    def _release(self):
+        """Forget everything stored for the backward pass."""
+        self._targets = None
+        self._hidden = None
+        self._weights = None
+        self._weight_array = None
+        self._logsumexp = None
+        self._grads = None
+        self._grads_for = None
+
+    def clear_activations(self):
+        """Forget everything stored for the backward pass."""
+        self._release()
+
+    def _take_grad(self, grad: Tensor, idx: int):
+        """Get the gradient for an input, computing it if needed."""
+        with self._lock:
+            if self._grads_for is not grad:
+                self._backward(grad)
+            result, self._grads[idx] = self._grads[idx], None
+
+            # once every gradient has been handed out, the next backward pass
+            # (e.g. with retain_graph) needs to compute them again. Anything
+            # else is freed by clear_activations when the graph is released
+            if all(grad is None for grad in self._grads):
+                self._grads = None
+                self._grads_for = None
+        return result
+
+    def _backward(self, grad: Tensor):
+        """Compute the gradients for the hidden states and the head weights
+        in a single pass over the chunks.
+        """
+        xp = grad.xp
+        n_tokens = len(self._targets)
+        scale = grad.array.astype(xp.float32) / n_tokens
+
+        hidden_grad = None
+        if self._hidden_requires_grad:
+            hidden_grad = xp.empty(self._hidden.shape, dtype=xp.float32)
+        weight_grad = None
+        if self._weights.requires_grad:
+            weight_grad = xp.zeros(self._weight_array.shape, dtype=xp.float32)
+
+        buffer = arena.empty(
+            (min(self.chunk_size, n_tokens), self._weight_array.shape[-1]),
+            xp.float32,
+            xp=xp,
+        )
+        for start, end in self._chunks():
+            # softmax(logits) - one_hot(targets)
+            probs = self._logits(xp, start, end, out=buffer)
+            probs -= self._logsumexp[start:end, None]
+            xp.exp(probs, out=probs)
+            rows = xp.arange(end - start)
+            probs[rows, self._targets[start:end]] -= 1
+            probs *= scale
+
+            if hidden_grad is not None:
+                hidden_grad[start:end] = probs @ self._weight_array.T
+            if weight_grad is not None:
+                hidden = self._hidden[start:end].astype(xp.float32, copy=False)
+                weight_grad += hidden.T @ probs
+
+        if hidden_grad is not None:
+            hidden_grad = hidden_grad.reshape(self._hidden_shape)
+            # remember to convert the gradient back to the right precision
+            if TRICYCLE_CONTEXT.use_mixed_precision:
+                hidden_grad = hidden_grad.astype(xp.float16)
+        self._grads = [hidden_grad, weight_grad]
+        self._grads_for = grad
+
+    def hidden_back_fn(self, grad: Tensor) -> Tensor:
+        """Computes the gradient of the loss with respect to the hidden
+        states.
+
+        Args:
+            grad: A Tensor containing the gradient from the previous layer.
+
+        Returns:
+            A Tensor containing the computed gradients.
+        """
+        is_batched = self._hidden_is_batched
+        return Tensor(self._take_grad(grad, 0), is_batched=is_batched)
+
+    def weight_back_fn(self, grad: Tensor) -> Tensor:
+        """Computes the gradient of the loss with respect to the head
+        weights.
+
+        Args:
+            grad: A Tensor containing the gradient from the previous layer.
+
+        Returns:
+            A Tensor containing the computed gradients.
+        """
+        return Tensor(self._take_grad(grad, 1), is_batched=False)
@@ -0,0 +1,297 @@
+"""
+Find out what is using memory during training.
+
+A `MemoryTracker` adds up the size of every array that a model and its
+optimiser are holding on to, split into categories:
+
+- parameters: the weights of the model
+- gradients: the gradients attached to the weights
+- activations: anything else stored on a layer or op (mostly values saved
+  for the backward pass) along with every tensor in the graph of any loss
+  passed to `watch`
+- optimiser: momentum (and any other state) stored by the optimiser
+- arena: memory reserved by the active tricycle/arena.py:BufferArena
+
+Arrays that share memory (e.g. views, or parameters that have been
+flattened) are only counted once.
+
+The categories are measured at the end of each phase of a step. If
+`trace` is True, we also use tracemalloc to find the largest amount of
+memory that numpy had allocated at any point during the phase, which
+catches temporary arrays that were freed before the end of the phase.
+
+Example usage:
+    >>> tracker = MemoryTracker(model, optimiser)
+    >>> for step, (inputs, outputs) in enumerate(dataloader):
+    ...     with tracker.phase("forward"):
+    ...         loss = loss_fn(outputs, model(inputs))
+    ...         tracker.watch(loss)
+    ...     with tracker.phase("backward"):
+    ...         loss.backward()
+    ...     with tracker.phase("update"):
+    ...         model.update(optimiser)
+    ...         model.zero_grad()
+    ...     tracker.end_step(step)
+"""
+
+import logging
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any
+
+import humanize
+
+from tricycle.context import TRICYCLE_CONTEXT
+from tricycle.layers import Layer
+from tricycle.ops import Op
+from tricycle.tensor import Tensor
+
+LOGGER = logging.getLogger(__name__)
+
+CATEGORIES = ["parameters", "gradients", "activations", "optimiser", "arena"]
+
+
+def _buffer(array: Any) -> Any:
+    """
+    Find the array that actually owns the memory for a (possibly view)
+    array.
+    """
+    while getattr(getattr(array, "base", None), "nbytes", None) is not None:
+        array = array.base
+    return array
+
+
+def _arrays_in(value: Any):
+    """
+    Find every array stored in an attribute of a layer or op.
+    """
+    if isinstance(value, Tensor):
+        yield value.array
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            yield from _arrays_in(item)
+    elif isinstance(value, dict):
+        for item in value.values():
+            yield from _arrays_in(item)
+    elif hasattr(value, "nbytes") and hasattr(value, "shape"):
+        yield value
+
+
+class MemoryTracker:
+    """
+    Count the memory used by a model, split by category and phase.
+
+    Attributes:
+        model (Layer): The model to track.
+        optimiser (Optimiser | None): The optimiser to track.
+        trace (bool): Whether to use tracemalloc to measure peak memory.
+        path (Path | None): If set, every record is appended to this file
+            as a row of csv.
+        history (list[dict]): A record for every phase of every step that
+            has finished.
+    """
+
+    def __init__(
+        self,
+        model: Layer,
+        optimiser=None,
+        trace: bool = True,
+        path: Path | None = None,
+    ):
+        self.model = model
+        self.optimiser = optimiser
+        self.trace = trace
+        self.path = path
+        self.history = []
+
+        self._watched = []
+        self._current = {}
+        self._started_tracing = False
+        if trace and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+
+    def close(self):
+        """Stop tracemalloc if this tracker started it."""
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def watch(self, tensor: Tensor):
+        """
+        Count the tensors in the graph of `tensor` as activations until
+        the end of the step.
+
+        Args:
+            tensor (Tensor): Usually the loss.
+        """
+        self._watched.append(tensor)
+
+    def _parameters(self) -> list[Tensor]:
+        return self.model.parameters()
+
+    def _layer_state(self):
+        """
+        Find every array stored on the layers and ops of the model.
+        """
+        stack = [self.model]
+        seen = set()
+        while stack:
+            obj = stack.pop()
+            if id(obj) in seen:
+                continue
+            seen.add(id(obj))
+
+            for value in vars(obj).values():
+                items = value if isinstance(value, (list, tuple)) else [value]
+                children = [
+                    item for item in items if isinstance(item, (Layer, Op))
+                ]
+                if children:
+                    stack.extend(children)
+                    continue
+                yield from _arrays_in(value)
+
+    def _graph_state(self):
+        """
+        Find the array of every tensor in the graphs being watched.
+        """
+        stack = list(self._watched)
+        seen = set()
+        while stack:
+            tensor = stack.pop()
+            if id(tensor) in seen:
+                continue
+            seen.add(id(tensor))
+            yield tensor.array
+            if tensor.args is not None:
+                stack.extend(tensor.args)
+
+    def _optimiser_state(self):
+        if self.optimiser is None:
+            return
+        for value in vars(self.optimiser).values():
+            if isinstance(value, dict):
+                yield from _arrays_in(value)
+
+    def snapshot(self) -> dict[str, int]:
+        """
+        Measure how much memory each category is using right now.
+
+        Returns:
+            dict[str, int]: The number of bytes used by each category.
+        """
+        parameters = self._parameters()
+        sources = {
+            "parameters": (parameter.array for parameter in parameters),
+            "gradients": (
+                parameter.grad.array
+                for parameter in parameters
+                if parameter.grad is not None
+            ),
+            "optimiser": self._optimiser_state(),
+            "activations": (
+                array
+                for source in [self._layer_state(), self._graph_state()]
+                for array in source
+            ),
+        }
+
+        # count each block of memory once, in the first category it
+        # appears in
+        counted = set()
+        usage = {}
+        for category, arrays in sources.items():
+            usage[category] = 0
+            for array in arrays:
+                buffer = _buffer(array)
+                if id(buffer) in counted:
+                    continue
+                counted.add(id(buffer))
+                usage[category] += buffer.nbytes
+
+        arena = TRICYCLE_CONTEXT.arena
+        usage["arena"] = arena.reserved_bytes if arena is not None else 0
+        usage["total"] = sum(usage[category] for category in CATEGORIES)
+        return {key: usage[key] for key in CATEGORIES + ["total"]}
+
+    @contextmanager
+    def phase(self, name: str):
+        """
+        Measure the memory used during part of a step.
+
+        Args:
+            name (str): The name of the phase, e.g. "forward".
+        """
+        if self.trace and tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+        try:
+            yield self
+        finally:
+            record = self.snapshot()
+            if self.trace and tracemalloc.is_tracing():
+                _, record["traced_peak"] = tracemalloc.get_traced_memory()
+            self._current[name] = record
+
+    def peak(self, category: str = "total") -> int:
+        """
+        The largest amount of memory used by a category in any phase of
+        any step.
+
+        Args:
+            category (str, optional): The category. Defaults to "total".
+
+        Returns:
+            int: The peak usage in bytes.
+        """
+        return max((record[category] for record in self.history), default=0)
+
+    def end_step(self, step: int) -> list[dict]:
+        """
+        Finish a step: log the memory used in each phase and stop watching
+        any graphs.
+
+        Args:
+            step (int): The step number.
+
+        Returns:
+            list[dict]: A record for each phase in this step.
+        """
+        records = [
+            {"step": step, "phase": name, **usage}
+            for name, usage in self._current.items()
+        ]
+        self._current = {}
+        self._watched = []
+
+        for record in records:
+            summary = ", ".join(
+                f"{category}={humanize.naturalsize(record[category])}"
+                for category in CATEGORIES + ["total"]
+            )
+            if "traced_peak" in record:
+                peak = humanize.naturalsize(record["traced_peak"])
+                summary += f", traced_peak={peak}"
+            LOGGER.info(f"step {step} {record['phase']}: {summary}")
+
+        if self.path is not None:
+            self._write(records)
+
+        self.history.extend(records)
+        return records
+
+    def _write(self, records: list[dict]):
+        """
+        Append records to the csv at `path`.
+        """
+        columns = ["step", "phase"] + CATEGORIES + ["total", "traced_peak"]
+        path = Path(self.path)
+        if not path.exists():
+            path.write_text(",".join(columns) + "\n")
+        with open(path, "a") as f:
+            for record in records:
+                f.write(
+                    ",".join(str(record.get(column, "")) for column in columns)
+                    + "\n"
+                )
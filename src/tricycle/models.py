@@ -5,10 +5,12 @@ This module defines the GPT class, which implements a GPT-style transformer mode
 using components from the Tricycle framework.
 """
 
+from typing import Sequence
+
 import humanize
 import numpy as np
 
-from tricycle.blocks import GPT2TransformerBlock
+from tricycle.blocks import CheckpointedBlock, GPT2TransformerBlock
 from tricycle.configs import GPTConfig
 from tricycle.layers import (
     Dense,
@@ -18,7 +20,8 @@ from tricycle.layers import (
     LayerNorm,
     RMSNorm,
 )
-from tricycle.optimisers import Optimiser
+from tricycle.optimisers import FusedOptimiser, Optimiser
+from tricycle.parameters import FlatParameters
 from tricycle.tensor import Tensor
 
 
@@ -36,10 +39,14 @@ class GPT(Layer):
         token_embedding (Embedding): Embedding layer for input tokens.
         position_embedding (Embedding): Embedding layer for positional information.
         input_dropout (Dropout): Dropout layer applied to the input embeddings.
-        blocks (list): List of GPT2TransformerBlock instances.
+        blocks (list): List of GPT2TransformerBlock instances, wrapped in
+            CheckpointedBlocks if gradient checkpointing is enabled.
         head (Dense): Final dense layer for output.
         norm (LayerNorm or RMSNorm): Normalization layer.
         layers (list): List of all layers in the model.
+        n_cached_tokens (int): Number of tokens stored in the kv cache.
+        flat_parameters (FlatParameters | None): Flat parameter and gradient
+            buffers, if `flatten_parameters` has been called.
     """
 
     def __init__(self, config: GPTConfig):
@@ -55,6 +62,7 @@ class GPT(Layer):
             to_size=self.embedding_dim,
             from_size=config.vocab_size,
             name="token_embedding",
+            sparse_grad=config.sparse_embedding_grad,
         )
         self.position_embedding = Embedding(
             to_size=self.embedding_dim,
@@ -74,6 +82,8 @@ class GPT(Layer):
             )
             for _ in range(config.n_layers)
         ]
+        if config.gradient_checkpointing:
+            self.blocks = [CheckpointedBlock(block) for block in self.blocks]
 
         self.head = Dense(
             to_size=config.vocab_size,
@@ -96,34 +106,116 @@ class GPT(Layer):
             self.norm,
             self.head,
         ]
-
-    def forward(self, tensor: Tensor) -> Tensor:
+        self.n_cached_tokens = 0
+        self.flat_parameters = None
+
+    def forward(
+        self,
+        tensor: Tensor,
+        use_cache: bool = False,
+        lengths: Sequence[int] | None = None,
+    ) -> Tensor:
         """
         Performs a forward pass through the GPT model.
 
+        See `hidden_states` for details.
+
         Args:
             tensor (Tensor): Input tensor, expected to be one-hot encoded.
+            use_cache (bool, optional): Whether to use the kv cache.
+                Defaults to False.
+            lengths (Sequence[int] | None, optional): The number of real
+                (non-padding) tokens in each sequence in the batch.
+                Defaults to None.
 
         Returns:
             Tensor: Output tensor after passing through the model.
+        """
+        embedding = self.hidden_states(
+            tensor, use_cache=use_cache, lengths=lengths
+        )
+        return self.head(embedding)
+
+    def hidden_states(
+        self,
+        tensor: Tensor,
+        use_cache: bool = False,
+        lengths: Sequence[int] | None = None,
+    ) -> Tensor:
+        """
+        Performs a forward pass through every layer of the model except the
+        head.
+
+        The result can be passed to tricycle/loss.py:ChunkedCrossEntropy,
+        along with the weights of the head, to calculate a loss without
+        storing every logit.
+
+        Sequences can be any length up to the context window. Shorter
+        sequences are cheaper to process because attention and every
+        dense layer only run over the tokens that are actually there.
+
+        To pass a batch of sequences with different lengths, pad them at the
+        end to a common length and pass the length of each sequence in
+        `lengths`. The batch is trimmed to the longest sequence before it is
+        passed through the model. Because attention is causal, predictions
+        for real tokens never depend on the padding after them, so only
+        outputs at positions past the end of a sequence should be ignored.
+
+        When `use_cache` is True, the tensor should only contain tokens that
+        have not been passed through the model since the kv cache was last
+        reset. Keys and values for earlier tokens are read from the cache so
+        generation only needs to process the newest token each step.
+
+        Args:
+            tensor (Tensor): Input tensor, expected to be one-hot encoded.
+            use_cache (bool, optional): Whether to use the kv cache.
+                Defaults to False.
+            lengths (Sequence[int] | None, optional): The number of real
+                (non-padding) tokens in each sequence in the batch.
+                Defaults to None.
+
+        Returns:
+            Tensor: The normalised hidden state for every token.
 
         Raises:
-            AssertionError: If the input tensor doesn't match the expected context window size.
+            AssertionError: If the input tensor is longer than the context window.
         """
         xp = tensor.xp
         if tensor.ndim == 1:
-            n_tokens = tensor.shape[-1]
             tensor.array = xp.expand_dims(tensor.array, 0)
             tensor = tensor.to_batched()
+
+        if lengths is not None:
+            assert len(lengths) == tensor.shape[0], (
+                "Expected a length for every sequence in the batch. ",
+                f"Found {len(lengths)=} and {tensor.shape[0]=}",
+            )
+            max_length = int(max(lengths))
+            if max_length < tensor.shape[-1]:
+                tensor = Tensor(
+                    tensor.array[:, :max_length],
+                    requires_grad=False,
+                    is_batched=True,
+                    dtype=tensor.dtype,
+                )
+
+        n_tokens = tensor.shape[-1]
+
+        if use_cache:
+            start = self.n_cached_tokens
+            assert start + n_tokens <= self.context_window, (
+                "Too many tokens for the kv cache. ",
+                f"Found {start=}, {n_tokens=} and {self.context_window=}",
+            )
         else:
-            n_tokens = tensor.shape[-1]
-        assert n_tokens == self.context_window, (
-            "Expected a full context window. ",
-            f"Found {n_tokens=} and {self.context_window=}",
-        )
+            start = 0
+            assert n_tokens <= self.context_window, (
+                "Sequence is longer than the context window. ",
+                f"Found {n_tokens=} and {self.context_window=}",
+            )
 
         position = Tensor(
-            xp.arange(self.context_window),
+            xp.arange(start, start + n_tokens),
             requires_grad=False,
             dtype=int,
         )
@@ -136,12 +228,37 @@ class GPT(Layer):
         embedding = self.input_dropout(embedding)
 
         for i, block in enumerate(self.blocks):
-            embedding = block(embedding)
+            embedding = block(embedding, use_cache=use_cache)
+
+        if use_cache:
+            self.n_cached_tokens += n_tokens
+
+        return self.norm(embedding)
+
+    def reset_kv_cache(self):
+        """
+        Forget any keys and values stored in the kv cache of every block.
+
+        Returns:
+            GPT: The current GPT instance.
+        """
+        self.n_cached_tokens = 0
+        for block in self.blocks:
+            block.reset_kv_cache()
+        return self
 
-        embedding = self.norm(embedding)
+    def flatten_parameters(self) -> FlatParameters:
+        """
+        Store every parameter and gradient in a single contiguous buffer.
 
-        embedding = self.head(embedding)
-        return embedding
+        This should be called after the model has been moved to the device
+        it will be trained on.
+
+        Returns:
+            FlatParameters: The flat parameter and gradient buffers.
+        """
+        self.flat_parameters = FlatParameters(self.parameters())
+        return self.flat_parameters
 
     def zero_grad(self):
         """
@@ -150,6 +267,10 @@ class GPT(Layer):
         Returns:
             GPT: The current GPT instance.
         """
+        if self.flat_parameters is not None:
+            self.flat_parameters.zero_grad()
+            return self
+
         self.token_embedding.zero_grad()
         self.position_embedding.zero_grad()
         self.norm.zero_grad()
@@ -168,6 +289,12 @@ class GPT(Layer):
         Returns:
             GPT: The current GPT instance.
         """
+        if self.flat_parameters is not None and isinstance(
+            optimiser, FusedOptimiser
+        ):
+            optimiser.update_flat(self.flat_parameters)
+            return self
+
         self.token_embedding.update(optimiser)
         self.position_embedding.update(optimiser)
         self.norm.update(optimiser)
@@ -1,16 +1,19 @@
 """Operations module for tensor manipulations.
 
 This module contains various operations that can be applied to tensors,
-including repeat, split, reshape, and mean operations.
+including repeat, slice, split, reshape, transpose and mean operations.
 """
 
+import numbers
 from abc import abstractmethod
+from functools import partial
 from typing import Sequence
 
 from numpy.typing import ArrayLike
 
 from tricycle.context import TRICYCLE_CONTEXT
 from tricycle.einsum import Einsum, Subscript
+from tricycle.sparse import SlicedTensor
 from tricycle.tensor import Tensor
 
 
@@ -29,6 +32,10 @@ class Op:
         Returns:
             Tensor: The result of the forward operation.
         """
+        if TRICYCLE_CONTEXT.profiler is not None:
+            return TRICYCLE_CONTEXT.profiler.forward(
+                self, self.forward, args, kwargs
+            )
         return self.forward(*args, **kwargs)
 
     @abstractmethod
@@ -76,26 +83,115 @@ class Repeat(Op):
         return Einsum(subscript)(tensor, ones)
 
 
+def _is_basic_index(idx) -> bool:
+    """
+    Check whether indexing with `idx` returns a view (rather than a copy).
+    """
+    if not isinstance(idx, tuple):
+        idx = (idx,)
+    return all(
+        isinstance(i, (numbers.Integral, slice, type(None), type(Ellipsis)))
+        for i in idx
+    )
+
+
+class Slice(Op):
+    """Operation to index into a tensor.
+
+    Basic indices (integers, slices, None and Ellipsis) return a view of the
+    input that shares its memory. The gradient of a view is added straight
+    into the gradient of the input. Any other index (e.g. an array of
+    integers) returns a copy.
+    """
+
+    def back_fn(self, grad: Tensor) -> Tensor:
+        """The backwards operation for a view.
+
+        Args:
+            grad (Tensor): The gradient of the view.
+
+        Returns:
+            SlicedTensor: The gradient for the input tensor.
+        """
+        return SlicedTensor(
+            self._idx,
+            grad.array,
+            self._in_shape,
+            requires_grad=grad.requires_grad,
+            is_batched=self._is_batched,
+            dtype=grad.dtype,
+        )
+
+    def copy_back_fn(self, grad: Tensor) -> Tensor:
+        """The backwards operation for a copy.
+
+        The index might contain duplicates so we need to use add.at
+
+        Args:
+            grad (Tensor): The gradient of the copy.
+
+        Returns:
+            Tensor: The gradient for the input tensor.
+        """
+        xp = grad.xp
+        out = xp.zeros(self._in_shape, dtype=grad.dtype)
+        xp.add.at(out, self._idx, grad.array)
+        return Tensor(out, is_batched=self._is_batched, dtype=out.dtype)
+
+    def forward(self, tensor: Tensor, idx) -> Tensor:
+        """Index into a tensor.
+
+        The result is only batched if the input is batched and the index
+        doesn't add or remove any dimensions.
+
+        Args:
+            tensor (Tensor): The input tensor.
+            idx: Anything that can be used to index an array.
+
+        Returns:
+            Tensor: The indexed tensor.
+        """
+        if isinstance(idx, Tensor):
+            idx = idx.array
+
+        self._idx = idx
+        self._in_shape = tensor.shape
+        self._is_batched = tensor.is_batched
+        self._out = tensor.array[idx]
+
+        back_fn = self.back_fn if _is_basic_index(idx) else self.copy_back_fn
+        return Tensor(
+            self._out,
+            args=(tensor,),
+            back_fns=(back_fn,),
+            requires_grad=tensor.requires_grad,
+            is_batched=tensor.is_batched and self._out.ndim == tensor.ndim,
+            dtype=tensor.dtype,
+        )
+
+
 class Split(Op):
-    """Operation to split a tensor along an axis."""
+    """Operation to split a tensor along an axis.
+
+    Each piece is a view of the input. The gradient of every piece is added
+    straight into a single gradient for the input.
+    """
 
-    _indices: tuple[int]
-    _axis: int
-    _n_splits: int
-    _grad: list[ArrayLike]
+    _indices: list[tuple]
+    _in_shape: tuple[int, ...]
 
     def back_fn(self, grad: Tensor, idx: int) -> Tensor:
         """The backwards operation for a split operation.
 
-        Produces a tensor of zeros the same shape as the input
-        except in the section that was split.
+        The gradient is the gradient of the piece, placed in the section of
+        the input that the piece came from. Everywhere else is 0.
 
         Args:
             grad (Tensor): The gradient tensor.
             idx (int): The index of the split.
 
         Returns:
-            Tensor: The gradient for the input tensor.
+            SlicedTensor: The gradient for the input tensor.
 
         Example:
             >>> result = split([1,2,3,4], 2)
@@ -103,27 +199,17 @@ class Split(Op):
             [tensor([1, 2]), tensor([3, 4])]
             # set an arbitrary derivative for first split
             >>> result[0].grad = Tensor([1,1])
-            >>> undo_split(result[0].grad)
+            >>> undo_split(result[0].grad).to_dense()
             [1, 1, 0, 0]
         """
-        xp = grad.xp
-        self._grad[idx] = xp.zeros(self._in_shape)
-
-        # TODO: this loop is really slow and should be replaced
-        indices = []
-        for i in range(self._grad[idx].ndim):
-            if i == self._axis % self._grad[idx].ndim:
-                step = self._in_shape[i] // self._n_splits
-                start = step * idx
-                end = step * (idx + 1)
-                indices.append(slice(start, end))
-            else:
-                indices.append(slice(None))
-        self._grad[idx][tuple(indices)] = grad.array
-
-        result = Tensor(self._grad[idx])
-        result.is_batched = grad.is_batched
-        return result
+        return SlicedTensor(
+            self._indices[idx],
+            grad.array,
+            self._in_shape,
+            requires_grad=grad.requires_grad,
+            is_batched=grad.is_batched,
+            dtype=grad.dtype,
+        )
 
     def forward(
         self, tensor: Tensor, n_splits: int, axis: int = -1
@@ -138,34 +224,42 @@ class Split(Op):
         Returns:
             Sequence[Tensor]: A sequence of split tensors.
         """
-        xp = tensor.xp
-
         assert isinstance(n_splits, int)
 
-        self._out = xp.split(tensor.array, n_splits, axis=axis)
         self._in_shape = tensor.shape
-        self._axis = axis
-        self._n_splits = n_splits
-        self._grad = [None] * n_splits
-
-        # TODO: this loop is really slow and should be replaced
-        results = []
-        for idx, result in enumerate(self._out):
-            # the back_fn depends on index so we need to
-            # dynamically create this function
-            def back_fn(grad, idx=idx):
-                return self.back_fn(grad, idx=idx)
-
-            result = Tensor(result)
-            result.back_fns = (back_fn,)
-            result.args = (tensor,)
-            result.is_batched = tensor.is_batched
-            results.append(result)
-        return results
+        axis = axis % tensor.ndim
+        if tensor.shape[axis] % n_splits != 0:
+            raise ValueError(
+                f"Cannot split an axis of size {tensor.shape[axis]} into "
+                f"{n_splits} equal pieces"
+            )
+        step = tensor.shape[axis] // n_splits
+
+        self._indices = [
+            (slice(None),) * axis + (slice(step * idx, step * (idx + 1)),)
+            for idx in range(n_splits)
+        ]
+        self._out = [tensor.array[index] for index in self._indices]
+
+        return [
+            Tensor(
+                result,
+                args=(tensor,),
+                # the back_fn depends on index. A partial is smaller (and
+                # quicker to build) than a closure
+                back_fns=(partial(self.back_fn, idx=idx),),
+                is_batched=tensor.is_batched,
+                dtype=tensor.dtype,
+            )
+            for idx, result in enumerate(self._out)
+        ]
 
 
 class Reshape(Op):
-    """Operation to reshape a tensor."""
+    """Operation to reshape a tensor.
+
+    If possible, the result is a view of the input.
+    """
 
     _original_shape: Sequence[int]
 
@@ -182,7 +276,9 @@ class Reshape(Op):
 
         self._grad = xp.reshape(grad.array, self._original_shape)
 
-        return Tensor(array=self._grad, is_batched=grad.is_batched)
+        return Tensor(
+            array=self._grad, is_batched=grad.is_batched, dtype=grad.dtype
+        )
 
     def forward(self, tensor: Tensor, shape: Sequence[int]) -> Tensor:
         """Reshape a tensor.
@@ -213,6 +309,69 @@ class Reshape(Op):
             back_fns=(self.back_fn,),
             name="reshape",
             is_batched=tensor.is_batched,
+            dtype=tensor.dtype,
+        )
+
+
+class Transpose(Op):
+    """Operation to reorder the axes of a tensor.
+
+    The result is always a view of the input.
+    """
+
+    _axes: tuple[int, ...]
+
+    def back_fn(self, grad: Tensor) -> Tensor:
+        """Backward function for the transpose operation.
+
+        Args:
+            grad (Tensor): The gradient tensor.
+
+        Returns:
+            Tensor: The gradient with the axes put back in their original
+                order.
+        """
+        xp = grad.xp
+        inverse = tuple(int(i) for i in xp.argsort(xp.asarray(self._axes)))
+        return Tensor(
+            xp.transpose(grad.array, inverse),
+            is_batched=grad.is_batched,
+            dtype=grad.dtype,
+        )
+
+    def forward(
+        self, tensor: Tensor, axes: Sequence[int] | None = None
+    ) -> Tensor:
+        """Reorder the axes of a tensor.
+
+        Args:
+            tensor (Tensor): The input tensor.
+            axes (Sequence[int] | None, optional): The new order of the axes.
+                If the tensor is batched, the batch dimension is not included
+                and stays first. Defaults to reversing the axes.
+
+        Returns:
+            Tensor: The transposed tensor.
+        """
+        xp = tensor.xp
+
+        n_dims = tensor.ndim - 1 if tensor.is_batched else tensor.ndim
+        if axes is None:
+            axes = tuple(reversed(range(n_dims)))
+        axes = tuple(axis % n_dims for axis in axes)
+        if tensor.is_batched:
+            axes = (0,) + tuple(axis + 1 for axis in axes)
+
+        self._axes = axes
+        self._out = xp.transpose(tensor.array, axes)
+
+        return Tensor(
+            self._out,
+            args=(tensor,),
+            back_fns=(self.back_fn,),
+            name="transpose",
+            is_batched=tensor.is_batched,
+            dtype=tensor.dtype,
         )
 
 
@@ -9,6 +9,8 @@ from logging import getLogger
 from warnings import warn
 
 from tricycle.context import TRICYCLE_CONTEXT
+from tricycle.parameters import FlatParameters
+from tricycle.precision import CAST_CACHE
 from tricycle.tensor import Tensor
 
 LOGGER = getLogger(__name__)
@@ -45,6 +47,9 @@ class Optimiser:
         tensor.grad = None
         tensor.args = None
         tensor.back_fns = None
+        # the weights have (probably) changed so any low precision copy is
+        # out of date
+        CAST_CACHE.invalidate(tensor)
         return tensor
 
 
@@ -111,6 +116,9 @@ class StochasticGradientDescent(Optimiser):
             if not tensor.array.dtype == xp.float32:
                 tensor.array = tensor.array.astype(xp.float32)
 
+        if tensor.grad.is_sparse:
+            return self._update_rows(tensor)
+
         if tensor.grad.is_batched:
             tensor.grad = tensor.grad.from_batched().einsum("z...->...")
 
@@ -160,6 +168,50 @@ class StochasticGradientDescent(Optimiser):
         tensor.grad.array.fill(0)
         return tensor
 
+    def _update_rows(self, tensor: Tensor) -> Tensor:
+        """
+        Update only the rows of a tensor that have a row-sparse gradient.
+
+        Rows that are missing from the gradient are left untouched: they
+        don't decay and their momentum is only applied the next time they
+        appear in a gradient.
+
+        Args:
+            tensor (Tensor): The tensor to update.
+
+        Returns:
+            Tensor: The updated tensor.
+        """
+        xp = tensor.xp
+        rows = tensor.grad.indices
+
+        grad = self.learning_rate * tensor.grad.array
+        if self.weight_decay is not None:
+            grad += self.learning_rate * self.weight_decay * tensor.array[rows]
+
+        if self.momentum is not None and self.momentum > 0:
+            if tensor._id not in self.momentum_store:
+                self.momentum_store[tensor._id] = xp.zeros(tensor.array.shape)
+            momentum_store = self.momentum_store[tensor._id]
+            grad += self.momentum * momentum_store[rows]
+            momentum_store[rows] = grad
+
+        # make sure our gradients aren't underflowing or overflow
+        if not xp.isfinite(grad).all():
+            warn(
+                "Found nans in gradient, skipping this gradient and"
+                "decreasing loss scaling. If this warning persists, "
+                "check that your learning rate isn't too high"
+            )
+            TRICYCLE_CONTEXT.loss_scale_factor /= 2
+            self.logger.warn(
+                f"New scaling factor: {TRICYCLE_CONTEXT.loss_scale_factor}"
+            )
+            return tensor
+
+        tensor.array[rows] -= grad.astype(tensor.dtype)
+        return tensor
+
     def __call__(self, tensor: Tensor) -> Tensor:
         """
         Apply the SGD optimisation to the given tensor.
@@ -245,6 +297,9 @@ class AdamW(Optimiser):
             if not tensor.array.dtype == xp.float32:
                 tensor.array = tensor.array.astype(xp.float32)
 
+        if tensor.grad.is_sparse:
+            return self._update_rows(tensor, grad)
+
         # initialise stores
         if key not in self.momentum:
             self.momentum[key] = xp.zeros_like(grad, dtype=xp.float32)
@@ -304,6 +359,71 @@ class AdamW(Optimiser):
         tensor.grad.array.fill(0)
         return tensor
 
+    def _update_rows(self, tensor: Tensor, grad) -> Tensor:
+        """
+        Lazily update only the rows of a tensor that have a row-sparse
+        gradient.
+
+        The moment estimates (and weight decay) for rows that are missing
+        from the gradient are left as they are instead of being decayed
+        towards 0. With a large embedding table most rows are missing every
+        step so this is much cheaper than a dense update.
+
+        Args:
+            tensor (Tensor): The tensor to update.
+            grad (ArrayLike): The gradient for each row in
+                `tensor.grad.indices`.
+
+        Returns:
+            Tensor: The updated tensor.
+        """
+        key = tensor._id
+        xp = tensor.xp
+        rows = tensor.grad.indices
+
+        if key not in self.momentum:
+            self.momentum[key] = xp.zeros(tensor.array.shape, dtype=xp.float32)
+        if key not in self.square_momentum:
+            self.square_momentum[key] = xp.zeros(
+                tensor.array.shape, dtype=xp.float32
+            )
+
+        momentum = (
+            self.betas[0] * self.momentum[key][rows]
+            + (1 - self.betas[0]) * grad
+        )
+        square_momentum = self.betas[1] * self.square_momentum[key][rows] + (
+            1 - self.betas[1]
+        ) * (grad * grad)
+
+        momentum_estimate = momentum / (1 - self.betas[0] ** self.timestep)
+        square_momentum_estimate = square_momentum / (
+            1 - self.betas[1] ** self.timestep
+        )
+
+        combined_grad = self.learning_rate * (
+            momentum_estimate / (xp.sqrt(square_momentum_estimate) + self.eps)
+            + self.weight_decay * tensor.array[rows]
+        )
+
+        # make sure our gradients aren't underflowing or overflow
+        if not xp.isfinite(combined_grad).all():
+            warn(
+                "Found nans in gradient, skipping this gradient and"
+                "decreasing loss scaling. If this warning persists, "
+                "check that your learning rate isn't too high"
+            )
+            TRICYCLE_CONTEXT.loss_scale_factor /= 2
+            LOGGER.warn(
+                f"New scaling factor: {TRICYCLE_CONTEXT.loss_scale_factor}"
+            )
+            return tensor
+
+        self.momentum[key][rows] = momentum
+        self.square_momentum[key][rows] = square_momentum
+        tensor.array[rows] -= combined_grad.astype(tensor.dtype)
+        return tensor
+
     def __call__(self, tensor: Tensor) -> Tensor:
         """
         Apply the AdamW optimisation to the given tensor.
@@ -315,3 +435,169 @@ class AdamW(Optimiser):
             Tensor: The optimised tensor.
         """
         return self._reset_grad(self.update_weight(tensor))
+
+
+class FusedOptimiser(Optimiser):
+    """
+    Base class for optimisers that can update every parameter of a model
+    at once.
+
+    Instead of being called once per tensor, a fused optimiser updates the
+    flat parameter buffer created by tricycle/parameters.py:FlatParameters
+    in a handful of vectorised, in-place operations.
+    """
+
+    def _scratch(self, parameters: FlatParameters, name: str):
+        """
+        Get a reusable scratch buffer the same size as the parameters.
+        """
+        if not hasattr(self, "_scratch_buffers"):
+            self._scratch_buffers = {}
+        buffer = self._scratch_buffers.get(name)
+        if buffer is None or buffer.shape != parameters.params.shape:
+            buffer = parameters.xp.empty_like(parameters.params)
+            self._scratch_buffers[name] = buffer
+        return buffer
+
+    def _unscale_and_check(self, parameters: FlatParameters) -> bool:
+        """
+        Undo loss scaling and make sure the gradients are usable.
+
+        Returns:
+            bool: False if the update should be skipped.
+        """
+        xp = parameters.xp
+        grads = parameters.grads
+
+        if TRICYCLE_CONTEXT.use_mixed_precision:
+            grads /= TRICYCLE_CONTEXT.loss_scale_factor
+
+        # summing first is much cheaper than checking every element and
+        # the sum is only finite if every element is
+        if not xp.isfinite(grads.sum()):
+            warn(
+                "Found nans in gradient, skipping this gradient and"
+                "decreasing loss scaling. If this warning persists, "
+                "check that your learning rate isn't too high"
+            )
+            TRICYCLE_CONTEXT.loss_scale_factor /= 2
+            LOGGER.warning(
+                f"New scaling factor: {TRICYCLE_CONTEXT.loss_scale_factor}"
+            )
+            return False
+        return True
+
+    def update_flat(self, parameters: FlatParameters):
+        """
+        Update every parameter in a flat buffer.
+
+        Args:
+            parameters (FlatParameters): The parameters to update.
+
+        Raises:
+            NotImplementedError: This method should be implemented by subclasses.
+        """
+        raise NotImplementedError
+
+
+class FusedStochasticGradientDescent(
+    FusedOptimiser, StochasticGradientDescent
+):
+    """
+    Stochastic Gradient Descent that updates a flat parameter buffer in
+    place.
+
+    When called on a single tensor, this behaves exactly like
+    `StochasticGradientDescent`.
+    """
+
+    def update_flat(self, parameters: FlatParameters):
+        """
+        Perform a gradient update on every parameter at once.
+
+        Args:
+            parameters (FlatParameters): The parameters to update.
+        """
+        xp = parameters.xp
+        if not self._unscale_and_check(parameters):
+            return
+
+        update = self._scratch(parameters, "update")
+        xp.multiply(parameters.grads, self.learning_rate, out=update)
+
+        if self.weight_decay is not None:
+            decay = self._scratch(parameters, "decay")
+            xp.multiply(
+                parameters.params,
+                self.learning_rate * self.weight_decay,
+                out=decay,
+            )
+            update += decay
+
+        if self.momentum is not None and self.momentum > 0:
+            velocity = self.momentum_store.get("flat")
+            if velocity is None or velocity.shape != update.shape:
+                velocity = xp.zeros_like(update)
+                self.momentum_store["flat"] = velocity
+            velocity *= self.momentum
+            velocity += update
+            update = velocity
+
+        parameters.params -= update
+        CAST_CACHE.invalidate()
+
+
+class FusedAdamW(FusedOptimiser, AdamW):
+    """
+    AdamW that updates a flat parameter buffer in place.
+
+    When called on a single tensor, this behaves exactly like `AdamW`.
+    """
+
+    def update_flat(self, parameters: FlatParameters):
+        """
+        Perform an AdamW update on every parameter at once.
+
+        Args:
+            parameters (FlatParameters): The parameters to update.
+        """
+        xp = parameters.xp
+        if not self._unscale_and_check(parameters):
+            return
+
+        grads = parameters.grads
+        momentum = self.momentum.get("flat")
+        square_momentum = self.square_momentum.get("flat")
+        if momentum is None or momentum.shape != grads.shape:
+            momentum = xp.zeros_like(grads, dtype=xp.float32)
+            square_momentum = xp.zeros_like(grads, dtype=xp.float32)
+            self.momentum["flat"] = momentum
+            self.square_momentum["flat"] = square_momentum
+
+        scratch = self._scratch(parameters, "scratch")
+
+        # m = b1 * m + (1 - b1) * g
+        momentum *= self.betas[0]
+        xp.multiply(grads, 1 - self.betas[0], out=scratch)
+        momentum += scratch
+
+        # v = b2 * v + (1 - b2) * g^2
+        square_momentum *= self.betas[1]
+        xp.multiply(grads, grads, out=scratch)
+        scratch *= 1 - self.betas[1]
+        square_momentum += scratch
+
+        # update = lr * m_hat / (sqrt(v_hat) + eps)
+        xp.divide(
+            square_momentum, 1 - self.betas[1] ** self.timestep, out=scratch
+        )
+        xp.sqrt(scratch, out=scratch)
+        scratch += self.eps
+        xp.divide(momentum, scratch, out=scratch)
+        scratch *= self.learning_rate / (1 - self.betas[0] ** self.timestep)
+
+        # weight decay is applied directly to the weights. This is the
+        # same as adding lr * weight_decay * w to the update
+        parameters.params *= 1 - self.learning_rate * self.weight_decay
+        parameters.params -= scratch
+        CAST_CACHE.invalidate()
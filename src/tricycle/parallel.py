@@ -0,0 +1,235 @@
+"""
+Data parallel training across several CPU processes.
+
+NumPy only parallelises inside individual BLAS calls, so a single training
+process can't keep a large machine busy. `DataParallel` forks several
+worker processes that each hold a copy of the model. Every batch is split
+into one shard per worker and each worker runs a forward and backward pass
+on its own shard.
+
+The parameters of the model live in shared memory so, when the main process
+updates them, every worker sees the new values without anything being
+copied. Each worker writes its gradients into its own slot of a shared
+gradient buffer and the main process sums these slots (an all-reduce)
+before the optimiser runs.
+
+Example usage:
+    >>> model = GPT(config)
+    >>> with DataParallel(model, CrossEntropy(), n_workers=8) as parallel:
+    ...     for inputs, outputs in dataloader:
+    ...         loss = parallel.forward_backward(inputs, outputs)
+    ...         model.update(optimiser)
+    ...         model.zero_grad()
+
+Because the parameters are stored in a flat buffer, this works best with a
+fused optimiser (see tricycle/optimisers.py:FusedAdamW).
+
+This is only supported on CPU and needs the "fork" multiprocessing start
+method (i.e. Linux or MacOS).
+"""
+
+import multiprocessing
+import traceback
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from tricycle.layers import Layer
+from tricycle.ops import Op
+from tricycle.tensor import Tensor
+
+
+class DataParallel:
+    """
+    Runs forward and backward passes on shards of a batch in parallel.
+
+    Attributes:
+        model (Layer): The model to train. It must have a
+            `flatten_parameters` method (e.g. GPT).
+        loss_fn (Op): The loss function.
+        n_workers (int): The number of worker processes.
+        seed (int): Each worker's random number generator is seeded with
+            `seed + rank` so that dropout masks differ between workers.
+    """
+
+    def __init__(
+        self, model: Layer, loss_fn: Op, n_workers: int, seed: int = 0
+    ):
+        if n_workers < 1:
+            raise ValueError(f"Need at least 1 worker, got {n_workers}")
+
+        self.model = model
+        self.loss_fn = loss_fn
+        self.n_workers = n_workers
+        self.seed = seed
+
+        self._workers = []
+        self._connections = []
+        self._memory = []
+        self._shared_grads = None
+
+    def _shared_array(self, shape, dtype) -> np.ndarray:
+        """
+        Allocate an array in shared memory.
+        """
+        dtype = np.dtype(dtype)
+        size = max(int(np.prod(shape)) * dtype.itemsize, 1)
+        memory = SharedMemory(create=True, size=size)
+        self._memory.append(memory)
+        return np.ndarray(shape, dtype=dtype, buffer=memory.buf)
+
+    def start(self):
+        """
+        Move the model parameters into shared memory and fork the workers.
+
+        Returns:
+            DataParallel: The current instance.
+        """
+        if self._workers:
+            return self
+
+        parameters = self.model.flat_parameters
+        if parameters is None:
+            parameters = self.model.flatten_parameters()
+        if parameters.xp is not np:
+            raise NotImplementedError(
+                "Data parallel training is only supported on CPU"
+            )
+
+        shared_params = self._shared_array(
+            parameters.params.shape, parameters.params.dtype
+        )
+        parameters.move_to(params=shared_params)
+        self._shared_grads = self._shared_array(
+            (self.n_workers,) + parameters.grads.shape, parameters.grads.dtype
+        )
+
+        context = multiprocessing.get_context("fork")
+        for rank in range(self.n_workers):
+            parent, child = context.Pipe()
+            worker = context.Process(
+                target=self._work, args=(rank, child), daemon=True
+            )
+            worker.start()
+            child.close()
+            self._workers.append(worker)
+            self._connections.append(parent)
+        return self
+
+    def _work(self, rank: int, connection):
+        """
+        The main loop run by each worker process.
+        """
+        np.random.seed(self.seed + rank)
+        parameters = self.model.flat_parameters
+        parameters.move_to(grads=self._shared_grads[rank])
+
+        while True:
+            message = connection.recv()
+            if message is None:
+                break
+
+            inputs, outputs, weight = message
+            try:
+                parameters.zero_grad()
+                inputs = Tensor(
+                    inputs, requires_grad=False, is_batched=True, dtype=int
+                )
+                outputs = Tensor(
+                    outputs, requires_grad=False, is_batched=True, dtype=int
+                )
+
+                loss = self.loss_fn(outputs, self.model(inputs))
+                loss.backward()
+
+                # each worker's loss is a mean over its shard so we need to
+                # weight it by the size of the shard
+                parameters.grads *= weight
+                connection.send(("ok", float(loss.array) * weight))
+            except Exception:
+                connection.send(("error", traceback.format_exc()))
+        connection.close()
+
+    def forward_backward(self, inputs: Tensor, outputs: Tensor) -> float:
+        """
+        Calculate gradients for a batch, split across every worker.
+
+        The gradients are added to any gradients already stored in the model
+        so this can be called several times to accumulate gradients.
+
+        Args:
+            inputs (Tensor): A batch of input tokens.
+            outputs (Tensor): A batch of output tokens.
+
+        Returns:
+            float: The mean loss over the batch.
+        """
+        self.start()
+
+        inputs = inputs.numpy() if isinstance(inputs, Tensor) else inputs
+        outputs = outputs.numpy() if isinstance(outputs, Tensor) else outputs
+        batch_size = len(inputs)
+        if batch_size < self.n_workers:
+            raise ValueError(
+                f"Cannot split a batch of {batch_size} between "
+                f"{self.n_workers} workers"
+            )
+
+        shards = zip(
+            np.array_split(inputs, self.n_workers),
+            np.array_split(outputs, self.n_workers),
+        )
+        for connection, (input_shard, output_shard) in zip(
+            self._connections, shards
+        ):
+            weight = len(input_shard) / batch_size
+            connection.send((input_shard, output_shard, weight))
+
+        loss = 0
+        errors = []
+        for connection in self._connections:
+            status, result = connection.recv()
+            if status == "error":
+                errors.append(result)
+            else:
+                loss += result
+        if errors:
+            raise RuntimeError(
+                "A data parallel worker failed:\n" + "\n".join(errors)
+            )
+
+        # all-reduce
+        parameters = self.model.flat_parameters
+        parameters.attach_grads()
+        parameters.grads += self._shared_grads.sum(axis=0)
+        return loss
+
+    def close(self):
+        """
+        Stop every worker and release the shared memory.
+
+        The model keeps its current parameters and can still be used
+        afterwards.
+        """
+        for connection in self._connections:
+            connection.send(None)
+            connection.close()
+        for worker in self._workers:
+            worker.join()
+        self._workers = []
+        self._connections = []
+
+        if self._memory:
+            parameters = self.model.flat_parameters
+            parameters.move_to(params=parameters.params.copy())
+            self._shared_grads = None
+            for memory in self._memory:
+                memory.close()
+                memory.unlink()
+            self._memory = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args, **kwargs):
+        self.close()
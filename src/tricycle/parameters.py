@@ -0,0 +1,170 @@
+"""
+Store every parameter of a model in a single contiguous buffer.
+
+By default, each parameter in a model owns its own array and so does its
+gradient. This means an optimiser needs to loop over every parameter in
+python and do a handful of small operations for each of them.
+
+`FlatParameters` copies every parameter into one large array and replaces
+each parameter's array with a view into it. Gradients get the same
+treatment: each parameter's gradient is a view into a single, flat gradient
+buffer that the backward pass accumulates into directly. An optimiser can
+then update every parameter at once with a few vectorised operations over
+the flat buffers (see `FusedAdamW` and `FusedStochasticGradientDescent` in
+tricycle/optimisers.py).
+
+Example usage:
+    >>> model = GPT(config)
+    >>> parameters = model.flatten_parameters()
+    >>> optimiser = FusedAdamW()
+    >>> loss.backward()
+    >>> parameters.clip_grad_norm(1.0)
+    >>> model.update(optimiser)
+    >>> model.zero_grad()
+
+Parameters should be flattened after a model has been moved to the device
+it will be trained on, because moving a parameter replaces its array.
+"""
+
+from typing import Sequence
+
+import numpy as np
+
+from tricycle.tensor import Tensor
+
+
+class FlatParameters:
+    """
+    Flat, contiguous parameter and gradient buffers for a set of tensors.
+
+    Attributes:
+        tensors (list[Tensor]): The parameters stored in the buffers.
+        params (ArrayLike): A 1D array containing every parameter.
+        grads (ArrayLike): A 1D array containing every gradient.
+        slices (list[slice]): Where each tensor is stored in the buffers.
+    """
+
+    def __init__(self, tensors: Sequence[Tensor], dtype=np.float32):
+        """
+        Copy tensors into flat buffers and replace their arrays with views.
+
+        Args:
+            tensors (Sequence[Tensor]): The parameters to flatten. Duplicates
+                are only stored once.
+            dtype: The dtype of the buffers. Defaults to float32.
+        """
+        unique = {}
+        for tensor in tensors:
+            unique.setdefault(id(tensor), tensor)
+        self.tensors = list(unique.values())
+        if not self.tensors:
+            raise ValueError("Cannot flatten an empty list of parameters")
+
+        xp = self.tensors[0].xp
+        self.slices = []
+        offset = 0
+        for tensor in self.tensors:
+            self.slices.append(slice(offset, offset + tensor.array.size))
+            offset += tensor.array.size
+
+        params = xp.empty(offset, dtype=dtype)
+        for tensor, idx in zip(self.tensors, self.slices):
+            params[idx] = tensor.array.ravel()
+
+        self.params = None
+        self.grads = None
+        self.move_to(params=params, grads=xp.zeros(offset, dtype=dtype))
+
+    def move_to(self, params=None, grads=None):
+        """
+        Store the parameters and/or gradients in different arrays.
+
+        The current values are copied into the new arrays and every tensor
+        is updated to point at them. This is useful for moving the buffers
+        into shared memory.
+
+        Args:
+            params (ArrayLike | None, optional): A 1D array to store the
+                parameters in. Defaults to None.
+            grads (ArrayLike | None, optional): A 1D array to store the
+                gradients in. Defaults to None.
+        """
+        if params is not None:
+            if self.params is not None and params is not self.params:
+                params[...] = self.params
+            self.params = params
+            self._param_views = []
+            for tensor, idx in zip(self.tensors, self.slices):
+                view = self.params[idx].reshape(tensor.array.shape)
+                tensor.array = view
+                self._param_views.append(view)
+
+        if grads is not None:
+            if self.grads is not None and grads is not self.grads:
+                grads[...] = self.grads
+            self.grads = grads
+            self._grad_views = [
+                self.grads[idx].reshape(view.shape)
+                for idx, view in zip(self.slices, self._param_views)
+            ]
+            self.attach_grads()
+
+    @property
+    def xp(self):
+        """The array module (numpy or cupy) that the buffers live on."""
+        return self.tensors[0].xp
+
+    @property
+    def size(self) -> int:
+        """The total number of parameters."""
+        return self.params.size
+
+    def attach_grads(self):
+        """
+        Point the gradient of every tensor at its slice of the gradient
+        buffer.
+
+        Once attached, the backward pass accumulates gradients straight into
+        the flat buffer. Optimisers that are not flat-aware replace the
+        gradients of the tensors they update, so this needs calling again
+        before the next backward pass (`zero_grad` does this for you).
+        """
+        for tensor, view in zip(self.tensors, self._grad_views):
+            if tensor.grad is not None and tensor.grad.array is view:
+                continue
+            grad = Tensor(view, requires_grad=False)
+            grad.array = view
+            tensor.grad = grad
+
+    def zero_grad(self):
+        """
+        Set every gradient to 0.
+        """
+        self.grads.fill(0)
+        self.attach_grads()
+
+    def grad_norm(self) -> float:
+        """
+        Calculate the L2 norm of the gradient of every parameter combined.
+
+        Returns:
+            float: The global gradient norm.
+        """
+        xp = self.xp
+        return float(xp.sqrt(xp.dot(self.grads, self.grads)))
+
+    def clip_grad_norm(self, max_norm: float) -> float:
+        """
+        Scale the gradients down so that their global L2 norm is at most
+        `max_norm`.
+
+        Args:
+            max_norm (float): The largest allowed gradient norm.
+
+        Returns:
+            float: The gradient norm before clipping.
+        """
+        norm = self.grad_norm()
+        if norm > max_norm:
+            self.grads *= max_norm / norm
+        return norm
@@ -0,0 +1,192 @@
+"""
+Control which precision each op uses when training with mixed precision.
+
+When mixed precision is turned on (see tricycle/utils.py:UseMixedPrecision)
+parameters are stored in 32 bit but most ops run in 16 bit. Some ops (e.g.
+normalisation layers and anything that uses exponents) are too sensitive to
+rounding errors so they compute in 32 bit instead. A `PrecisionPolicy`
+decides which dtype each op computes in.
+
+Casting a parameter to 16 bit copies the whole thing, so instead of casting
+on every call we keep a 16 bit copy of each parameter in `CAST_CACHE`. The
+optimisers invalidate a parameter's copy whenever they update it so, when
+accumulating gradients over several batches, each parameter is only cast
+once per step.
+
+Example usage:
+    >>> policy = PrecisionPolicy(op_dtypes={"dense": "float32"})
+    >>> with UseMixedPrecision(policy=policy):
+    ...     loss = loss_fn(outputs, model(inputs))
+"""
+
+from dataclasses import dataclass, field
+
+import numpy as np
+from numpy.typing import ArrayLike
+
+from tricycle.context import TRICYCLE_CONTEXT
+
+
+def _full_precision_ops() -> dict[str, str]:
+    return {
+        "layer_norm": "float32",
+        "rms_norm": "float32",
+        "gelu": "float32",
+    }
+
+
+@dataclass
+class PrecisionPolicy:
+    """
+    The dtype that each op computes in when using mixed precision.
+
+    Attributes:
+        compute_dtype (str): The dtype used by any op that isn't in
+            `op_dtypes`. This is also the dtype of activations passed between
+            ops.
+        op_dtypes (dict[str, str]): The dtype for specific ops, keyed by
+            name (e.g. "layer_norm").
+        cache_casts (bool): Whether to reuse low precision copies of
+            parameters until the optimiser updates them.
+    """
+
+    compute_dtype: str = "float16"
+    op_dtypes: dict[str, str] = field(default_factory=_full_precision_ops)
+    cache_casts: bool = True
+
+    def dtype_for(self, op: str) -> np.dtype:
+        """
+        Get the dtype an op should compute in.
+
+        Args:
+            op (str): The name of the op.
+
+        Returns:
+            np.dtype: The dtype.
+        """
+        return np.dtype(self.op_dtypes.get(op, self.compute_dtype))
+
+
+DEFAULT_POLICY = PrecisionPolicy()
+
+
+def current_policy() -> PrecisionPolicy:
+    """
+    Get the policy that is currently active.
+
+    Returns:
+        PrecisionPolicy: The active policy, or the default one.
+    """
+    return TRICYCLE_CONTEXT.precision_policy or DEFAULT_POLICY
+
+
+def compute_dtype(op: str) -> np.dtype | None:
+    """
+    Get the dtype an op should compute in.
+
+    Args:
+        op (str): The name of the op.
+
+    Returns:
+        np.dtype | None: The dtype, or None if mixed precision is turned off
+            (in which case ops should use whatever dtype they are given).
+    """
+    if not TRICYCLE_CONTEXT.use_mixed_precision:
+        return None
+    return current_policy().dtype_for(op)
+
+
+def activation_dtype() -> np.dtype | None:
+    """
+    Get the dtype that activations should be passed between ops in.
+
+    Returns:
+        np.dtype | None: The dtype, or None if mixed precision is turned off.
+    """
+    if not TRICYCLE_CONTEXT.use_mixed_precision:
+        return None
+    return np.dtype(current_policy().compute_dtype)
+
+
+class CastCache:
+    """
+    Low precision copies of parameters.
+
+    Copies are keyed by the id of the parameter. A copy is only reused if
+    the parameter still holds the same array that was copied, so replacing
+    a parameter's array (e.g. moving it to the GPU) invalidates its copy
+    automatically. Updating the array in place does not, so anything that
+    does this needs to call `invalidate`.
+
+    Attributes:
+        hits (int): The number of times a copy was reused.
+        misses (int): The number of times a new copy was made.
+    """
+
+    def __init__(self):
+        self._copies = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, tensor, dtype: np.dtype) -> ArrayLike:
+        """
+        Get the array of a tensor in the given dtype.
+
+        Args:
+            tensor (Tensor): The parameter to cast.
+            dtype (np.dtype): The dtype to cast to.
+
+        Returns:
+            ArrayLike: The cast array.
+        """
+        source = tensor.array
+        if source.dtype == dtype:
+            return source
+
+        entry = self._copies.get(tensor._id)
+        if entry is not None and entry[0] is source and entry[1] == dtype:
+            self.hits += 1
+            return entry[2]
+
+        copy = source.astype(dtype)
+        self._copies[tensor._id] = (source, dtype, copy)
+        self.misses += 1
+        return copy
+
+    def invalidate(self, tensor=None):
+        """
+        Forget the copy of a tensor.
+
+        Args:
+            tensor (Tensor | None, optional): The tensor whose copy should be
+                forgotten. If None, every copy is forgotten. Defaults to None.
+        """
+        if tensor is None:
+            self._copies.clear()
+        else:
+            self._copies.pop(tensor._id, None)
+
+    def __len__(self):
+        return len(self._copies)
+
+
+CAST_CACHE = CastCache()
+
+
+def cast_parameter(tensor, op: str) -> ArrayLike:
+    """
+    Get the array of a parameter in the dtype that an op computes in.
+
+    Args:
+        tensor (Tensor): The parameter.
+        op (str): The name of the op that will use the parameter.
+
+    Returns:
+        ArrayLike: The array, cast if we are using mixed precision.
+    """
+    dtype = compute_dtype(op)
+    if dtype is None:
+        return tensor.array
+    if not current_policy().cache_casts:
+        return tensor.array.astype(dtype)
+    return CAST_CACHE.get(tensor, dtype)
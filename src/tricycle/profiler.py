@@ -0,0 +1,390 @@
+"""
+Find out where the time goes during a forward and backward pass.
+
+While a `Profiler` is active, every `Op`, `Einsum` and `Layer` call and every
+backward function is timed. For each call we record how long it took, the
+shapes of its inputs and outputs and the size of the arrays it returned.
+
+Example usage:
+    >>> with Profiler() as profiler:
+    ...     for inputs, outputs in dataloader:
+    ...         loss = loss_fn(outputs, model(inputs))
+    ...         loss.backward()
+    ...         model.update(optimiser)
+    ...         model.zero_grad()
+    ...         profiler.step()
+    >>> print(profiler.table(n=10))
+    >>> profiler.export_chrome_trace("trace.json")
+
+The exported trace can be opened in chrome://tracing or https://ui.perfetto.dev
+
+Layers contain ops, so the time for a layer includes the time spent in every
+op it calls. Backward functions are called outside of any layer so their
+time is not double counted.
+
+When no profiler is active, the only overhead is checking
+`TRICYCLE_CONTEXT.profiler`.
+"""
+
+import json
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable
+
+from tricycle.context import TRICYCLE_CONTEXT
+
+
+@dataclass
+class ProfileEvent:
+    """
+    A single timed call.
+
+    Attributes:
+        name (str): The class of the op (or the backward function) that was
+            called.
+        category (str): One of "layer", "forward" or "backward".
+        tensor (str | None): The name of the most relevant tensor: the
+            output of a forward op (or the first named input if the output
+            doesn't have a name) and the tensor receiving the gradient for a
+            backward function.
+        step (int): The step that the call happened in.
+        start (float): When the call started, in seconds since the profiler
+            was created.
+        duration (float): How long the call took, in seconds.
+        input_shapes (list[tuple[int, ...]]): The shapes of the inputs.
+        output_shapes (list[tuple[int, ...]]): The shapes of the outputs.
+        output_bytes (int): The size of the arrays that were returned.
+        thread (int): The thread that made the call.
+    """
+
+    name: str
+    category: str
+    tensor: str | None
+    step: int
+    start: float
+    duration: float
+    input_shapes: list[tuple[int, ...]] = field(default_factory=list)
+    output_shapes: list[tuple[int, ...]] = field(default_factory=list)
+    output_bytes: int = 0
+    thread: int = 0
+
+
+@dataclass
+class OpStats:
+    """
+    Every call to a single op, added together.
+
+    Attributes:
+        name (str): The class of the op (or the backward function).
+        category (str): One of "layer", "forward" or "backward".
+        tensor (str | None): The name of the tensor the op was called on.
+        calls (int): The number of calls.
+        total_time (float): The total time spent in the op, in seconds.
+        output_bytes (int): The total size of every array the op returned.
+    """
+
+    name: str
+    category: str
+    tensor: str | None
+    calls: int = 0
+    total_time: float = 0.0
+    output_bytes: int = 0
+
+    @property
+    def mean_time(self) -> float:
+        """The average time per call, in seconds."""
+        return self.total_time / self.calls if self.calls else 0.0
+
+
+def _arrays(value: Any) -> list:
+    """
+    Find every tensor or array in an argument or result.
+    """
+    if isinstance(value, (tuple, list)):
+        return [array for item in value for array in _arrays(item)]
+    if hasattr(value, "shape") and hasattr(value, "dtype"):
+        return [value]
+    return []
+
+
+def _nbytes(value: Any) -> int:
+    """
+    The number of bytes in a tensor or array.
+    """
+    array = getattr(value, "array", value)
+    return getattr(array, "nbytes", 0)
+
+
+def _tensor_name(output: Any, inputs: tuple) -> str | None:
+    """
+    Pick a name to report an op call under.
+    """
+    for value in _arrays(output) + _arrays(inputs):
+        name = getattr(value, "name", None)
+        if name is not None:
+            return name
+    return None
+
+
+def _back_fn_name(back_fn: Callable) -> str:
+    """
+    Get a readable name for a backward function.
+    """
+    owner = getattr(back_fn, "__self__", None)
+    if owner is not None:
+        return f"{type(owner).__name__}.{back_fn.__name__}"
+    if hasattr(back_fn, "__qualname__"):
+        return back_fn.__qualname__
+    # callable objects, e.g. EinsumBackOp
+    return type(back_fn).__name__
+
+
+class Profiler:
+    """
+    Context manager that times every op, layer and backward function.
+
+    Attributes:
+        events (list[ProfileEvent]): Every call that has been recorded.
+        current_step (int): The step that new events are assigned to.
+    """
+
+    def __init__(self):
+        self.events = []
+        self.current_step = 0
+        self._origin = time.perf_counter()
+        self._previous = None
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        """Start profiling."""
+        self._previous = TRICYCLE_CONTEXT.profiler
+        TRICYCLE_CONTEXT.profiler = self
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        """Stop profiling."""
+        TRICYCLE_CONTEXT.profiler = self._previous
+
+    def step(self):
+        """
+        Start a new step. Events recorded after this are aggregated
+        separately from the ones before it.
+        """
+        self.current_step += 1
+
+    def _record(
+        self,
+        name: str,
+        category: str,
+        tensor: str | None,
+        start: float,
+        end: float,
+        inputs: tuple,
+        output: Any,
+    ):
+        outputs = _arrays(output)
+        event = ProfileEvent(
+            name=name,
+            category=category,
+            tensor=tensor,
+            step=self.current_step,
+            start=start - self._origin,
+            duration=end - start,
+            input_shapes=[tuple(value.shape) for value in _arrays(inputs)],
+            output_shapes=[tuple(value.shape) for value in outputs],
+            output_bytes=sum(_nbytes(value) for value in outputs),
+            thread=threading.get_ident(),
+        )
+        with self._lock:
+            self.events.append(event)
+
+    def forward(
+        self,
+        op: Any,
+        fn: Callable,
+        args: tuple,
+        kwargs: dict,
+        category: str = "forward",
+    ):
+        """
+        Call (and time) the forward pass of an op or layer.
+
+        Args:
+            op (Any): The op or layer being called.
+            fn (Callable): The function that does the work.
+            args (tuple): Positional arguments for `fn`.
+            kwargs (dict): Keyword arguments for `fn`.
+            category (str, optional): What kind of call this is. Defaults to
+                "forward".
+
+        Returns:
+            The result of `fn`.
+        """
+        start = time.perf_counter()
+        output = fn(*args, **kwargs)
+        end = time.perf_counter()
+
+        self._record(
+            name=type(op).__name__,
+            category=category,
+            tensor=_tensor_name(output, args),
+            start=start,
+            end=end,
+            inputs=args,
+            output=output,
+        )
+        return output
+
+    def backward(self, back_fn: Callable, grad: Any, arg: Any):
+        """
+        Call (and time) a backward function.
+
+        Args:
+            back_fn (Callable): The backward function.
+            grad (Tensor): The gradient to pass backwards.
+            arg (Tensor): The tensor that will receive the result.
+
+        Returns:
+            Tensor: The result of `back_fn`.
+        """
+        start = time.perf_counter()
+        output = back_fn(grad)
+        end = time.perf_counter()
+
+        self._record(
+            name=_back_fn_name(back_fn),
+            category="backward",
+            tensor=getattr(arg, "name", None),
+            start=start,
+            end=end,
+            inputs=(grad,),
+            output=output,
+        )
+        return output
+
+    def summary(self, step: int | None = None) -> list[OpStats]:
+        """
+        Add together the events for each op.
+
+        Args:
+            step (int | None, optional): Only include events from this step.
+                Defaults to every step.
+
+        Returns:
+            list[OpStats]: The stats for each (category, op, tensor), slowest
+                first.
+        """
+        stats = {}
+        for event in self.events:
+            if step is not None and event.step != step:
+                continue
+            key = (event.category, event.name, event.tensor)
+            if key not in stats:
+                stats[key] = OpStats(
+                    name=event.name,
+                    category=event.category,
+                    tensor=event.tensor,
+                )
+            stats[key].calls += 1
+            stats[key].total_time += event.duration
+            stats[key].output_bytes += event.output_bytes
+
+        return sorted(
+            stats.values(), key=lambda stat: stat.total_time, reverse=True
+        )
+
+    def step_times(self) -> dict[int, dict[str, float]]:
+        """
+        Total time spent in each category for every step.
+
+        Returns:
+            dict[int, dict[str, float]]: Time in seconds, keyed by step and
+                then by category.
+        """
+        times = {}
+        for event in self.events:
+            step = times.setdefault(event.step, {})
+            step[event.category] = step.get(event.category, 0.0) + (
+                event.duration
+            )
+        return times
+
+    def table(
+        self,
+        n: int = 20,
+        step: int | None = None,
+        category: str | None = None,
+    ) -> str:
+        """
+        Build a table of the slowest ops.
+
+        Args:
+            n (int, optional): The number of rows. Defaults to 20.
+            step (int | None, optional): Only include events from this step.
+                Defaults to every step.
+            category (str | None, optional): Only include ops from this
+                category. Defaults to every category.
+
+        Returns:
+            str: The table.
+        """
+        stats = [
+            stat
+            for stat in self.summary(step=step)
+            if category is None or stat.category == category
+        ][:n]
+
+        header = (
+            f"{'category':<10} {'op':<40} {'tensor':<30} {'calls':>7} "
+            f"{'total ms':>10} {'mean ms':>10} {'MB out':>10}"
+        )
+        rows = [header, "-" * len(header)]
+        for stat in stats:
+            rows.append(
+                f"{stat.category:<10} {stat.name[:40]:<40} "
+                f"{str(stat.tensor)[:30]:<30} {stat.calls:>7} "
+                f"{stat.total_time * 1e3:>10.3f} "
+                f"{stat.mean_time * 1e3:>10.3f} "
+                f"{stat.output_bytes / 1e6:>10.3f}"
+            )
+        return "\n".join(rows)
+
+    def chrome_trace(self) -> dict:
+        """
+        Convert the recorded events to the Chrome trace event format.
+
+        Returns:
+            dict: A trace that can be saved as JSON.
+        """
+        trace_events = [
+            {
+                "name": event.name,
+                "cat": event.category,
+                "ph": "X",
+                # chrome traces are measured in microseconds
+                "ts": event.start * 1e6,
+                "dur": event.duration * 1e6,
+                "pid": 0,
+                "tid": event.thread,
+                "args": {
+                    "step": event.step,
+                    "tensor": event.tensor,
+                    "input_shapes": event.input_shapes,
+                    "output_shapes": event.output_shapes,
+                    "output_bytes": event.output_bytes,
+                },
+            }
+            for event in self.events
+        ]
+        return {"traceEvents": trace_events, "displayTimeUnit": "ms"}
+
+    def export_chrome_trace(self, path: str | Path):
+        """
+        Save the recorded events as a Chrome trace.
+
+        Args:
+            path (str | Path): Where to save the trace.
+        """
+        Path(path).write_text(json.dumps(self.chrome_trace()))
@@ -0,0 +1,435 @@
+"""
+Weight-only quantisation for running trained models.
+
+Generating text from a trained model only needs a forward pass, and a
+forward pass with a small batch spends most of its time reading weights
+from memory. Storing the weights of every `Dense` and `Embedding` layer as
+8 bit (or 4 bit) integers, with a 32 bit scale for each output channel,
+reduces the amount of memory that needs to be read by 4x (or 8x).
+
+The weights are dequantised on the fly: a `QuantisedDense` layer converts
+a block of columns back to floats, multiplies by it and moves on to the
+next block, so only a small block of float weights exists at any time.
+How much faster this is depends on how quickly the backend can convert
+integers to floats. With numpy, converting 8 bit weights costs about as
+much as reading float weights, so 8 bit layers are about as fast as float
+ones for a single sequence and faster for small batches. Unpacking 4 bit
+weights costs more than it saves, so 4 bit layers are slower. On the CPU,
+the main benefit is the smaller model.
+
+Example usage:
+    >>> model = quantise_model(model, bits=8)
+    >>> save_quantised(model, "model.pkl")
+    >>> model = load_quantised("model.pkl")
+    >>> with NoGrad():
+    ...     logits = model(tokens)
+
+Quantised layers have no parameters so they can't be trained.
+"""
+
+import pickle
+from pathlib import Path
+
+from numpy.typing import ArrayLike
+
+from tricycle.layers import Dense, Embedding, Layer
+from tricycle.tensor import Tensor, select_backend
+
+QUANTISED_FORMAT = "tricycle-quantised"
+QUANTISED_VERSION = 1
+
+
+def pack_int4(array: ArrayLike, axis: int = 0) -> ArrayLike:
+    """
+    Pack pairs of 4 bit integers into single bytes.
+
+    Args:
+        array (ArrayLike): Integers between -8 and 7.
+        axis (int, optional): The axis to pack along. Defaults to 0.
+
+    Returns:
+        ArrayLike: A uint8 array, half the size of `array` along `axis`
+            (rounded up).
+    """
+    xp = select_backend(array)
+    array = xp.moveaxis(array, axis, -1)
+    if array.shape[-1] % 2:
+        padding = xp.zeros(array.shape[:-1] + (1,), dtype=array.dtype)
+        array = xp.concatenate([array, padding], axis=-1)
+
+    low = array[..., 0::2].astype(xp.uint8) & 0xF
+    high = array[..., 1::2].astype(xp.uint8) & 0xF
+    return xp.ascontiguousarray(xp.moveaxis(low | (high << 4), -1, axis))
+
+
+def unpack_int4(packed: ArrayLike, size: int, axis: int = 0) -> ArrayLike:
+    """
+    Undo `pack_int4`.
+
+    Args:
+        packed (ArrayLike): The packed uint8 array.
+        size (int): The size of the original array along `axis`.
+        axis (int, optional): The axis that was packed. Defaults to 0.
+
+    Returns:
+        ArrayLike: An int8 array of integers between -8 and 7.
+    """
+    xp = select_backend(packed)
+    packed = xp.moveaxis(packed, axis, -1)
+
+    # shift each nibble into the top of an int8 then shift back down so
+    # the sign bit is extended
+    low = (packed << 4).view(xp.int8) >> 4
+    high = packed.view(xp.int8) >> 4
+
+    unpacked = xp.stack([low, high], axis=-1).reshape(
+        packed.shape[:-1] + (-1,)
+    )
+    return xp.moveaxis(unpacked[..., :size], -1, axis)
+
+
+def quantise(array: ArrayLike, bits: int = 8, axis: int = 0):
+    """
+    Symmetrically quantise an array with a separate scale for each channel.
+
+    Args:
+        array (ArrayLike): The array to quantise.
+        bits (int, optional): Either 8 or 4. Defaults to 8.
+        axis (int, optional): The axis to reduce over when calculating the
+            scales, i.e. every slice along the other axes gets its own scale.
+            4 bit values are packed along this axis. Defaults to 0.
+
+    Returns:
+        tuple[ArrayLike, ArrayLike]: The quantised values and the scales.
+            Multiplying the (unpacked) values by the scales gets back an
+            approximation of `array`.
+    """
+    if bits not in (4, 8):
+        raise ValueError(f"Only 4 and 8 bit quantisation is supported: {bits}")
+
+    xp = select_backend(array)
+    array = xp.ascontiguousarray(array, dtype=xp.float32)
+    largest = 2 ** (bits - 1) - 1
+
+    scales = xp.abs(array).max(axis=axis, keepdims=True) / largest
+    # avoid dividing by 0 for channels that are entirely 0
+    scales = xp.where(scales == 0, 1, scales).astype(xp.float32)
+
+    values = xp.clip(xp.rint(array / scales), -largest - 1, largest)
+    values = values.astype(xp.int8)
+    if bits == 4:
+        values = pack_int4(values, axis=axis)
+    return values, scales
+
+
+class QuantisedDense(Layer):
+    """
+    A dense layer with integer weights, for inference only.
+
+    The weights are stored transposed, with one row per output column, so
+    that each block of output columns is a contiguous block of memory.
+
+    Attributes:
+        values (ArrayLike): The quantised (transposed) weights.
+        scales (ArrayLike): A scale for each output column.
+        bits (int): The number of bits in each weight.
+        from_size (int): Input size.
+        to_size (int): Output size.
+        block_size (int): The number of columns to dequantise at once.
+        name (str | None): Optional name for the layer.
+    """
+
+    def __init__(
+        self,
+        weights: ArrayLike,
+        bits: int = 8,
+        block_size: int = 256,
+        name: str | None = None,
+    ):
+        self.from_size, self.to_size = weights.shape
+        values, scales = quantise(weights.T, bits=bits, axis=1)
+        self.values = values
+        self.scales = scales.reshape(-1)
+        self.bits = bits
+        self.block_size = block_size
+        self.name = name
+
+    @classmethod
+    def from_dense(
+        cls, dense: Dense, bits: int = 8, block_size: int = 256
+    ) -> "QuantisedDense":
+        """
+        Quantise the weights of a trained dense layer.
+
+        Args:
+            dense (Dense): The layer to quantise.
+            bits (int, optional): Either 8 or 4. Defaults to 8.
+            block_size (int, optional): The number of columns to dequantise
+                at once. Defaults to 256.
+
+        Returns:
+            QuantisedDense: The quantised layer.
+        """
+        return cls(
+            dense.weights.array,
+            bits=bits,
+            block_size=block_size,
+            name=dense.name,
+        )
+
+    def _unpack(self, rows: slice) -> ArrayLike:
+        values = self.values[rows]
+        if self.bits == 4:
+            values = unpack_int4(values, self.from_size, axis=1)
+        return values
+
+    def dequantise(self) -> ArrayLike:
+        """
+        Convert the weights back to floats.
+
+        Returns:
+            ArrayLike: A float32 array with shape (from_size, to_size).
+        """
+        values = self._unpack(slice(None)).astype(self.scales.dtype)
+        return (values * self.scales[:, None]).T
+
+    def forward(self, tensor: Tensor) -> Tensor:
+        """
+        Multiply the input by the weights, one block of columns at a time.
+
+        Each block is cast into the same small buffer so the full float
+        weights never exist. The scales are applied to the output instead of
+        the weights, which saves a multiplication for every weight.
+
+        Args:
+            tensor (Tensor): Input tensor.
+
+        Returns:
+            Tensor: Output of the dense layer.
+        """
+        xp = tensor.xp
+        # a 2D matmul can write straight into a slice of the output, a
+        # batched one can't
+        inputs = tensor.array.reshape(-1, self.from_size)
+
+        out = xp.empty(
+            (inputs.shape[0], self.to_size),
+            dtype=xp.result_type(inputs, self.scales),
+        )
+        buffer = xp.empty(
+            (min(self.block_size, self.to_size), self.from_size),
+            dtype=self.scales.dtype,
+        )
+        for start in range(0, self.to_size, self.block_size):
+            rows = slice(start, start + self.block_size)
+            values = self._unpack(rows)
+            weights = buffer[: values.shape[0]]
+            weights[...] = values
+            xp.matmul(inputs, weights.T, out=out[..., rows])
+        out *= self.scales
+        out = out.reshape(tensor.array.shape[:-1] + (self.to_size,))
+
+        return Tensor(
+            out,
+            name="quantised_dense",
+            is_batched=tensor.is_batched,
+            requires_grad=False,
+            dtype=out.dtype,
+        )
+
+    def to_gpu(self, device: int = 0):
+        """Move the quantised weights to the GPU."""
+        import cupy
+
+        cupy.cuda.Device(device).use()
+        self.values = cupy.asarray(self.values)
+        self.scales = cupy.asarray(self.scales)
+        return self
+
+    def from_gpu(self):
+        """Move the quantised weights back to the CPU."""
+        import cupy
+
+        self.values = cupy.asnumpy(self.values)
+        self.scales = cupy.asnumpy(self.scales)
+        return self
+
+
+class QuantisedEmbedding(Layer):
+    """
+    An embedding layer with integer weights, for inference only.
+
+    Only the rows that are looked up are dequantised.
+
+    Attributes:
+        values (ArrayLike): The quantised embedding matrix.
+        scales (ArrayLike): A scale for each row.
+        bits (int): The number of bits in each weight.
+        vocab_size (int): Size of the vocabulary (number of embeddings).
+        embedding_dim (int): The size of each embedding.
+    """
+
+    def __init__(self, weights: ArrayLike, bits: int = 8):
+        self.vocab_size, self.embedding_dim = weights.shape
+        self.values, self.scales = quantise(weights, bits=bits, axis=1)
+        self.bits = bits
+
+    @classmethod
+    def from_embedding(
+        cls, embedding: Embedding, bits: int = 8
+    ) -> "QuantisedEmbedding":
+        """
+        Quantise the weights of a trained embedding layer.
+
+        Args:
+            embedding (Embedding): The layer to quantise.
+            bits (int, optional): Either 8 or 4. Defaults to 8.
+
+        Returns:
+            QuantisedEmbedding: The quantised layer.
+        """
+        return cls(embedding.weights.array, bits=bits)
+
+    def forward(self, tensor: Tensor) -> Tensor:
+        """
+        Look up and dequantise the embedding for each index.
+
+        Args:
+            tensor (Tensor): Input tensor containing indices to be embedded.
+
+        Returns:
+            Tensor: The embedded representation of the input indices.
+        """
+        indices = tensor.array
+        values = self.values[indices]
+        if self.bits == 4:
+            values = unpack_int4(values, self.embedding_dim, axis=-1)
+        out = values.astype(self.scales.dtype) * self.scales[indices]
+
+        return Tensor(
+            out,
+            is_batched=tensor.is_batched,
+            requires_grad=False,
+            dtype=out.dtype,
+        )
+
+    def to_gpu(self, device: int = 0):
+        """Move the quantised weights to the GPU."""
+        import cupy
+
+        cupy.cuda.Device(device).use()
+        self.values = cupy.asarray(self.values)
+        self.scales = cupy.asarray(self.scales)
+        return self
+
+    def from_gpu(self):
+        """Move the quantised weights back to the CPU."""
+        import cupy
+
+        self.values = cupy.asnumpy(self.values)
+        self.scales = cupy.asnumpy(self.scales)
+        return self
+
+
+def quantise_model(
+    model: Layer, bits: int = 8, block_size: int = 256
+) -> Layer:
+    """
+    Replace every `Dense` and `Embedding` layer in a model with a quantised
+    version.
+
+    The model is modified in place. Layers that appear in several places
+    (e.g. as an attribute and in `layers`) are replaced with the same
+    quantised layer.
+
+    Args:
+        model (Layer): The model to quantise, usually a GPT.
+        bits (int, optional): Either 8 or 4. Defaults to 8.
+        block_size (int, optional): The number of columns that quantised
+            dense layers dequantise at once. Defaults to 256.
+
+    Returns:
+        Layer: The quantised model.
+    """
+    replacements = {}
+
+    def replace(layer):
+        if id(layer) not in replacements:
+            if isinstance(layer, Dense):
+                replacements[id(layer)] = QuantisedDense.from_dense(
+                    layer, bits=bits, block_size=block_size
+                )
+            else:
+                replacements[id(layer)] = QuantisedEmbedding.from_embedding(
+                    layer, bits=bits
+                )
+        return replacements[id(layer)]
+
+    stack = [model]
+    seen = set()
+    while stack:
+        layer = stack.pop()
+        if id(layer) in seen:
+            continue
+        seen.add(id(layer))
+
+        for name, value in vars(layer).items():
+            if isinstance(value, (Dense, Embedding)):
+                setattr(layer, name, replace(value))
+            elif isinstance(value, Layer):
+                stack.append(value)
+            elif isinstance(value, list):
+                for idx, item in enumerate(value):
+                    if isinstance(item, (Dense, Embedding)):
+                        value[idx] = replace(item)
+                    elif isinstance(item, Layer):
+                        stack.append(item)
+
+    # any flattened parameters belonged to the layers we just replaced
+    if getattr(model, "flat_parameters", None) is not None:
+        model.flat_parameters = None
+    return model
+
+
+def save_quantised(model: Layer, path: str | Path):
+    """
+    Save a quantised model.
+
+    Args:
+        model (Layer): A model that has been through `quantise_model`.
+        path (str | Path): Where to save the model.
+    """
+    with open(path, "wb") as f:
+        pickle.dump(
+            {
+                "format": QUANTISED_FORMAT,
+                "version": QUANTISED_VERSION,
+                "model": model,
+            },
+            f,
+        )
+
+
+def load_quantised(path: str | Path) -> Layer:
+    """
+    Load a model saved with `save_quantised`.
+
+    Args:
+        path (str | Path): Where the model was saved.
+
+    Returns:
+        Layer: The quantised model.
+
+    Raises:
+        ValueError: If the file doesn't contain a quantised model.
+    """
+    with open(path, "rb") as f:
+        saved = pickle.load(f)
+
+    if not isinstance(saved, dict) or saved.get("format") != QUANTISED_FORMAT:
+        raise ValueError(f"{path} does not contain a quantised model")
+    if saved["version"] != QUANTISED_VERSION:
+        raise ValueError(
+            f"Unsupported quantised model version: {saved['version']}"
+        )
+    return saved["model"]
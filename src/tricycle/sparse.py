@@ -0,0 +1,255 @@
+"""
+Row-sparse and sliced gradients.
+
+The gradient of an embedding table is zero for every row that was not looked
+up in the batch. With a large vocabulary this is almost every row so, rather
+than building (and then updating) a dense vocab x embedding_dim matrix, we can
+store just the rows that were used:
+
+    >>> grad = RowSparseTensor(indices=[1, 3], values=[[1, 1], [2, 2]],
+    ...                        shape=(4, 2))
+    >>> grad.to_dense()
+    array([[0., 0.],
+           [1., 1.],
+           [0., 0.],
+           [2., 2.]], dtype=float32)
+
+`Tensor._accumulate_grad` knows how to add row-sparse gradients together (and
+to dense gradients) and the non-fused optimisers have a lazy update path that
+only touches the rows that are present.
+
+Similarly, the gradient of a view (e.g. one piece of a split) is zero
+everywhere outside of the view. View ops return a `SlicedTensor` from their
+backward functions, which `Tensor._accumulate_grad` adds straight into the
+gradient of the base tensor. If a tensor is split into several pieces, the
+gradient of every piece ends up in a single buffer rather than each piece
+building a full-size array of zeros.
+"""
+
+import numpy as np
+from numpy.typing import ArrayLike
+
+from tricycle.tensor import Tensor, select_backend
+
+
+def segment_sum(rows: ArrayLike, values: ArrayLike):
+    """
+    Sum together every value that shares a row index.
+
+    Args:
+        rows (ArrayLike): An array of row indices.
+        values (ArrayLike): An array with one vector per entry in `rows`.
+
+    Returns:
+        tuple[ArrayLike, ArrayLike]: The sorted, unique row indices and the
+            sum of the values for each of them.
+    """
+    xp = select_backend(rows, values)
+    rows = rows.reshape(-1)
+    values = values.reshape(rows.shape[0], -1)
+
+    if xp is np:
+        # sort the rows so that duplicates are next to each other and then
+        # sum each run of duplicates in a single pass
+        order = np.argsort(rows, kind="stable")
+        unique, starts = np.unique(rows[order], return_index=True)
+        return unique, np.add.reduceat(values[order], starts, axis=0)
+
+    # cupy doesn't have reduceat but atomic adds into a small output are fast
+    unique, inverse = xp.unique(rows, return_inverse=True)
+    summed = xp.zeros((unique.shape[0], values.shape[1]), dtype=values.dtype)
+    xp.add.at(summed, inverse, values)
+    return unique, summed
+
+
+class RowSparseTensor(Tensor):
+    """
+    A matrix where only some of the rows are non-zero.
+
+    `array` holds the non-zero rows and `indices` holds the (unique) position
+    of each of them in the full matrix.
+
+    Attributes:
+        indices (ArrayLike): The index of each stored row.
+        dense_shape (tuple[int, ...]): The shape of the full matrix.
+    """
+
+    is_sparse = True
+
+    __slots__ = ("indices", "dense_shape")
+
+    def __init__(
+        self,
+        indices: ArrayLike,
+        values: ArrayLike,
+        shape: tuple[int, ...],
+        requires_grad: bool = False,
+        dtype: np.typing.DTypeLike = None,
+        name: str | None = None,
+    ):
+        super().__init__(
+            values, requires_grad=requires_grad, dtype=dtype, name=name
+        )
+        self.indices = indices
+        self.dense_shape = tuple(shape)
+
+    @classmethod
+    def from_rows(
+        cls,
+        rows: ArrayLike,
+        values: ArrayLike,
+        shape: tuple[int, ...],
+        requires_grad: bool = False,
+    ) -> "RowSparseTensor":
+        """
+        Build a row-sparse matrix from rows that may contain duplicates.
+
+        Rows with the same index are added together.
+
+        Args:
+            rows (ArrayLike): The index of each row.
+            values (ArrayLike): The value of each row.
+            shape (tuple[int, ...]): The shape of the full matrix.
+            requires_grad (bool, optional): Whether the result requires a
+                gradient. Defaults to False.
+
+        Returns:
+            RowSparseTensor: The combined rows.
+        """
+        indices, values = segment_sum(rows, values)
+        return cls(indices, values, shape, requires_grad=requires_grad)
+
+    def to_dense(self) -> ArrayLike:
+        """
+        Build the full matrix.
+
+        Returns:
+            ArrayLike: A dense array with shape `dense_shape`.
+        """
+        out = self.xp.zeros(self.dense_shape, dtype=self.dtype)
+        # indices are unique so there is no need for add.at here
+        out[self.indices] = self.array
+        return out
+
+    def accumulate(self, other: Tensor) -> Tensor:
+        """
+        Add another gradient to this one.
+
+        Args:
+            other (Tensor): A dense or row-sparse gradient with the same
+                (dense) shape.
+
+        Returns:
+            Tensor: A row-sparse tensor if `other` is row-sparse, otherwise a
+                dense one.
+        """
+        xp = self.xp
+        if other.is_sparse:
+            return RowSparseTensor.from_rows(
+                xp.concatenate([self.indices, other.indices]),
+                xp.concatenate([self.array, other.array.astype(self.dtype)]),
+                self.dense_shape,
+                requires_grad=self.requires_grad,
+            )
+
+        # other might share memory with another tensor so we can't add to
+        # it in place
+        out = other.array.copy()
+        out[self.indices] += self.array
+        return Tensor(
+            out,
+            requires_grad=other.requires_grad,
+            is_batched=other.is_batched,
+            dtype=out.dtype,
+        )
+
+    def to_gpu(self, device: int = 0):
+        """
+        Move this tensor to the GPU.
+
+        Args:
+            device (int, optional): The GPU device number. Defaults to 0.
+
+        Returns:
+            RowSparseTensor: This tensor.
+        """
+        super().to_gpu(device)
+        import cupy
+
+        self.indices = cupy.asarray(self.indices)
+        return self
+
+    def from_gpu(self):
+        """
+        Move this tensor from the GPU to the CPU.
+
+        Returns:
+            RowSparseTensor: This tensor.
+        """
+        super().from_gpu()
+        import cupy
+
+        self.indices = cupy.asnumpy(self.indices)
+        return self
+
+    def __repr__(self):
+        return (
+            f"RowSparseTensor(indices={self.indices}, values={self.array}, "
+            f"shape={self.dense_shape})"
+        )
+
+
+class SlicedTensor(Tensor):
+    """
+    A tensor that is zero everywhere except for a single slice.
+
+    `array` holds the values inside the slice and `indices` holds the (basic)
+    index of the slice in the full tensor.
+
+    Attributes:
+        indices (tuple): The index of the slice. This must be a basic index
+            (made of integers, slices, None and Ellipsis) so that the slice is
+            a view with no repeated elements.
+        dense_shape (tuple[int, ...]): The shape of the full tensor.
+    """
+
+    is_sliced = True
+
+    __slots__ = ("indices", "dense_shape")
+
+    def __init__(
+        self,
+        indices: tuple,
+        values: ArrayLike,
+        shape: tuple[int, ...],
+        requires_grad: bool = False,
+        is_batched: bool = False,
+        dtype: np.typing.DTypeLike = None,
+        name: str | None = None,
+    ):
+        super().__init__(
+            values,
+            requires_grad=requires_grad,
+            is_batched=is_batched,
+            dtype=dtype,
+            name=name,
+        )
+        self.indices = indices
+        self.dense_shape = tuple(shape)
+
+    def to_dense(self) -> ArrayLike:
+        """
+        Build the full tensor.
+
+        Returns:
+            ArrayLike: A dense array with shape `dense_shape`.
+        """
+        out = self.xp.zeros(self.dense_shape, dtype=self.dtype)
+        out[self.indices] = self.array
+        return out
+
+    def __repr__(self):
+        return (
+            f"SlicedTensor(indices={self.indices}, values={self.array}, "
+            f"shape={self.dense_shape})"
+        )
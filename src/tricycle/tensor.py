@@ -10,9 +10,9 @@ This file also contains a few other helpful functions like `batch` which
 converts tensors to batched tensors.
 """
 
+import itertools
 import logging
 import numbers
-import uuid
 from typing import TYPE_CHECKING, List, Optional, Sequence, Union
 
 import numpy as np
@@ -21,7 +21,6 @@ from numpy.typing import ArrayLike
 from tricycle import GPU_ENABLED
 from tricycle.context import TRICYCLE_CONTEXT
 from tricycle.exceptions import GPUDisabledException
-from tricycle.weakset import WeakSet
 
 if TYPE_CHECKING:
     from tricycle.ops import Op
@@ -30,6 +29,20 @@ logger = logging.getLogger(__name__)
 
 DEFAULT_DTYPE = np.float32
 
+# Tensor ids only need to be unique within a process so a counter is enough
+# (and much cheaper than a uuid)
+_TENSOR_IDS = itertools.count(1)
+
+
+def _reserve_id(_id: int):
+    """
+    Make sure that new tensors never get an id that was already used by a
+    tensor loaded from a pickle.
+    """
+    global _TENSOR_IDS
+    next_id = next(_TENSOR_IDS)
+    _TENSOR_IDS = itertools.count(max(next_id, _id + 1))
+
 
 class Tensor:
     """
@@ -38,16 +51,42 @@ class Tensor:
 
     Attributes:
         _id (int): Unique identifier for the tensor.
-        _parents (set[Tensor] | None): Parent tensors in the computation graph.
+        _parents (set[int] | None): The ids of the parents of this tensor in
+            the computation graph.
         array (ArrayLike): The underlying numpy/cupy array.
         args (tuple[Tensor, ...] | None): Arguments used to create this tensor.
         back_fns (tuple[Op, ...] | None): Backward functions for gradient computation.
+            Each edge of the graph is the pair (args[i], back_fns[i]); the
+            two tuples are kept separate rather than as one tuple of edges.
         grad (Optional[Tensor]): Gradient of this tensor.
         name (Optional[str]): Name of the tensor.
         requires_grad (bool): Whether this tensor requires gradient computation.
         is_batched (bool): Whether this tensor is batched.
+        is_sparse (bool): Whether only some rows of this tensor are stored.
+            See tricycle/sparse.py:RowSparseTensor.
+        is_sliced (bool): Whether only a single slice of this tensor is
+            stored. See tricycle/sparse.py:SlicedTensor.
     """
 
+    is_sparse = False
+    is_sliced = False
+
+    # Graphs contain a lot of tensors so we use slots to keep them small
+    # and quick to create
+    __slots__ = (
+        "_id",
+        "_parents",
+        "_borrowed_grad",
+        "array",
+        "grad",
+        "requires_grad",
+        "is_batched",
+        "args",
+        "back_fns",
+        "name",
+        "__weakref__",
+    )
+
     def __init__(
         self,
         array: ArrayLike,
@@ -57,11 +96,18 @@ class Tensor:
         back_fns: tuple["Op", ...] | None = None,
         dtype: np.typing.DTypeLike = None,
         name: str | None = None,
+        copy: bool = False,
         _id: int | None = None,
     ):
         """
         Initializes a new Tensor object.
 
+        If `array` is already an array with the right dtype, the tensor wraps
+        it without copying, so changes to one are visible in the other. Pass
+        `copy=True` if the tensor needs its own memory (e.g. wrapping an array
+        that you are going to modify, or that an optimiser should not update
+        in place).
+
         Args:
             array (ArrayLike): The underlying numpy/cupy array.
             requires_grad (bool, optional): Whether this tensor requires gradient computation. Defaults to True.
@@ -70,22 +116,22 @@ class Tensor:
             back_fns (tuple[Op, ...] | None, optional): Backward functions for gradient computation. Defaults to None.
             dtype (np.typing.DTypeLike, optional): Data type of the tensor. Defaults to None.
             name (str | None, optional): Name of the tensor. Defaults to None.
+            copy (bool, optional): Whether to always copy `array`. Defaults to False.
             _id (int | None, optional): Unique identifier for the tensor. Defaults to None.
         """
         if isinstance(array, Tensor):
             self = array
             return
-        self._id = _id or uuid.uuid4().int
+        self._id = _id or next(_TENSOR_IDS)
         self._parents = None
-        if GPU_ENABLED:
-            import cupy
+        if not isinstance(array, np.ndarray):
+            if GPU_ENABLED:
+                import cupy
 
-            if isinstance(array, (np.ndarray, cupy.ndarray)):
-                self.array = array
+                if not isinstance(array, cupy.ndarray):
+                    array = np.asarray(array)
             else:
-                self.array = np.array(array)
-        else:
-            self.array = np.array(array)
+                array = np.asarray(array)
 
         if dtype is None:
             if TRICYCLE_CONTEXT.use_mixed_precision:
@@ -93,8 +139,15 @@ class Tensor:
             else:
                 dtype = DEFAULT_DTYPE
 
-        self.array = self.array.astype(dtype)
+        # astype only copies if the dtype changes (or we ask it to)
+        self.array = array.astype(dtype, copy=copy)
         self.grad = None
+        self._borrowed_grad = None
+
+        if not TRICYCLE_CONTEXT.grad_enabled:
+            # don't hold onto the graph if we aren't going to go backward
+            args = None
+            back_fns = None
 
         self.requires_grad = requires_grad
         self.is_batched = is_batched
@@ -102,6 +155,11 @@ class Tensor:
         self.back_fns = back_fns
         self.name = name
 
+        # tensors without a graph will never be passed a gradient so there
+        # is no need to keep them alive on the tape
+        if TRICYCLE_CONTEXT.tape is not None and TRICYCLE_CONTEXT.grad_enabled:
+            TRICYCLE_CONTEXT.tape.append(self)
+
     def _attach_parents(self):
         """
         Traverses through the graph, labelling each tensor with the tensors that
@@ -118,23 +176,104 @@ class Tensor:
             if not node.args:
                 continue
 
+            # forget any gradient from a previous backward pass through
+            # this part of the graph (only inputs and parameters keep
+            # accumulating)
+            node.grad = None
+
             for arg in node.args:
                 if not arg.requires_grad:
                     continue
 
                 if arg._parents is None:
-                    # if we use a set, we get a circular reference
-                    # which can't be garbage collected, leading to a memory
-                    # leak so we need to do a weakref to avoid the circular
-                    # reference
-                    arg._parents = WeakSet()
+                    # we store ids rather than the parents themselves so we
+                    # don't create a circular reference that stops the
+                    # graph from being garbage collected
+                    arg._parents = set()
 
                 # if a node has a parent we haven't visited yet, store it
-                if node not in arg._parents:
+                if node._id not in arg._parents:
                     stack.append(arg)
-                    arg._parents.add(node)
+                    arg._parents.add(node._id)
+
+    def _accumulate_grad(self, grad: "Tensor", clip: float | None = None):
+        """
+        Add a gradient to any gradient already calculated for this tensor.
+
+        Args:
+            grad (Tensor): The gradient to add.
+            clip (float | None, optional): Maximum absolute value for gradient clipping. Defaults to None.
+        """
+        # gradient clipping
+        # TODO: allow clipping by norm instead of just by value
+        if clip is not None:
+            grad.array = grad.xp.clip(grad.array, -clip, clip)
+
+        # add current gradient to any gradients we have already
+        # calculated for this node
+        if grad.is_sliced:
+            self._accumulate_slice(grad)
+        elif self.grad is None:
+            # tensors wrap arrays without copying them so this gradient
+            # might share memory with another tensor. We can't add to it in
+            # place until we've made our own copy
+            self.grad = grad
+            self._borrowed_grad = grad
+        elif self.grad.is_sparse:
+            self.grad = self.grad.accumulate(grad)
+        elif self.grad is self._borrowed_grad:
+            if grad.is_sparse:
+                array = self.grad.array.copy()
+                array[grad.indices] += grad.array
+            else:
+                array = self.grad.array + grad.array
+            self.grad = Tensor(
+                array,
+                requires_grad=self.grad.requires_grad,
+                is_batched=self.grad.is_batched,
+                dtype=self.grad.dtype,
+            )
+        elif grad.is_sparse:
+            # the indices of a row-sparse gradient are unique so we can
+            # scatter without add.at
+            self.grad.array[grad.indices] += grad.array
+        else:
+            self.grad.array += grad.array
+
+    def _accumulate_slice(self, grad: "Tensor"):
+        """
+        Add the gradient of a view of this tensor straight into the gradient
+        for this tensor.
+
+        Args:
+            grad (SlicedTensor): The gradient to add.
+        """
+        if self.grad is None:
+            array = grad.xp.zeros(grad.dense_shape, dtype=grad.dtype)
+        elif self.grad.is_sparse:
+            array = self.grad.to_dense()
+        elif self.grad is self._borrowed_grad:
+            array = self.grad.array.copy()
+        else:
+            # we own this gradient so we can add to it in place
+            self.grad.array[grad.indices] += grad.array
+            return
+
+        array[grad.indices] += grad.array
+        self.grad = Tensor(
+            array,
+            requires_grad=grad.requires_grad,
+            is_batched=grad.is_batched,
+            dtype=array.dtype,
+        )
 
-    def _calculate_gradients(self, clip: float | None = None):
+    def _calculate_gradients(
+        self,
+        clip: float | None = None,
+        schedule: list[tuple["Tensor", int]] | None = None,
+        grad: Optional["Tensor"] = None,
+        retain_graph: bool = True,
+    ):
         """
         Calculates gradients for the computation graph.
 
@@ -143,12 +282,23 @@ class Tensor:
 
         Args:
             clip (float | None, optional): Maximum absolute value for gradient clipping. Defaults to None.
-        """
-        self.grad = Tensor(
-            self.xp.ones(self.array.shape, dtype=self.dtype),
-            requires_grad=False,
-            is_batched=self.is_batched,
-        )
+            schedule (list[tuple[Tensor, int]] | None, optional): If passed,
+                each edge that gradients are passed along is appended to this
+                list as a (node, argument index) pair, in the order they were
+                visited. Defaults to None.
+            grad (Tensor | None, optional): The gradient of this tensor. If
+                None, a gradient of ones is used. Defaults to None.
+            retain_graph (bool, optional): If False, the graph behind each
+                tensor is released as soon as its gradient has been passed
+                on. See `_release_graph`. Defaults to True.
+        """
+        if grad is None:
+            grad = Tensor(
+                self.xp.ones(self.array.shape, dtype=self.dtype),
+                requires_grad=False,
+                is_batched=self.is_batched,
+            )
+        self.grad = grad
 
         stack: list["Tensor"] = [self]
 
@@ -159,7 +309,9 @@ class Tensor:
             if node.args is None or node.back_fns is None:
                 continue
 
-            for arg, back_fns in zip(node.args, node.back_fns):
+            for idx, (arg, back_fns) in enumerate(
+                zip(node.args, node.back_fns)
+            ):
                 # if we reach a tensor that does not need gradient computation
                 # (e.g a constant) then we're done along this path
                 if not arg.requires_grad:
@@ -173,51 +325,104 @@ class Tensor:
                     )
 
                 # already visited along this edge, dont do it again
-                if node not in arg._parents:
+                if node._id not in arg._parents:
                     continue
 
-                arg._parents.remove(node)
+                arg._parents.remove(node._id)
 
                 try:
                     # actuall calculate gradient for this node
-                    grad = back_fns(node.grad)
-
-                    # gradient clipping
-                    # TODO: allow clipping by norm instead of just by value
-                    if clip is not None:
-                        grad.array = grad.xp.clip(grad.array, -clip, clip)
-
-                    # add current gradient to any gradients we have already
-                    # calculated for this node
-                    if arg.grad is None:
-                        arg.grad = grad
+                    if TRICYCLE_CONTEXT.profiler is None:
+                        grad = back_fns(node.grad)
                     else:
-                        arg.grad.array += grad.array
+                        grad = TRICYCLE_CONTEXT.profiler.backward(
+                            back_fns, node.grad, arg
+                        )
+                    arg._accumulate_grad(grad, clip=clip)
 
                 except Exception as e:
                     raise e
 
+                if schedule is not None:
+                    schedule.append((node, idx))
+
                 # only move to a new node if we have been to all of its parents
-                if len(arg._parents) == 0:
-                    # get rid of the weakref once we're done with a node so we
-                    # can pickle the model. Weakrefs can't be pickled
+                if not arg._parents:
+                    # we're done with this node so we can free the set
                     arg._parents = None
                     stack.append(arg)
 
-    def backward(self, clip: float | None = None):
+            if not retain_graph:
+                node._release_graph()
+
+    def _release_graph(self):
+        """
+        Forget how this tensor was made, along with anything the ops and
+        layers that made it stored for the backward pass.
+
+        Once the gradient of a tensor has been passed backwards, nothing else
+        needs its arguments so this lets activations be freed during the
+        backward pass instead of when the next forward pass overwrites them.
+        """
+        if self.back_fns is not None:
+            for back_fn in self.back_fns:
+                owner = getattr(back_fn, "__self__", None)
+                clear_activations = getattr(owner, "clear_activations", None)
+                if clear_activations is not None:
+                    clear_activations()
+        self.args = None
+        self.back_fns = None
+
+    def backward(
+        self,
+        clip: float | None = None,
+        grad: Optional["Tensor"] = None,
+        retain_graph: bool = False,
+    ):
         """
         Performs a backward pass through the graph, calculating the gradient
         for each parameter.
 
+        By default, the graph is released as it is used so activations can
+        be freed as early as possible. This means `backward` can only be
+        called once for each graph unless `retain_graph` is True.
+
         Args:
             clip (float | None, optional): Maximum absolute value for gradient clipping. Defaults to None.
-        """
-        self._attach_parents()
-        self._calculate_gradients(clip=clip)
+            grad (Tensor | None, optional): The gradient of this tensor, for
+                when it is not the final output of the graph. Defaults to a
+                gradient of ones.
+            retain_graph (bool, optional): Whether to keep the graph (and
+                any activations stored for the backward pass) so that
+                `backward` can be called again. Defaults to False.
+        """
+        previous_clip, TRICYCLE_CONTEXT.clip = TRICYCLE_CONTEXT.clip, clip
+        try:
+            self._attach_parents()
+            self._calculate_gradients(
+                clip=clip, grad=grad, retain_graph=retain_graph
+            )
+        finally:
+            TRICYCLE_CONTEXT.clip = previous_clip
 
     def __hash__(self) -> int:
         return self._id
 
+    def __setstate__(self, state):
+        """
+        Restore a pickled (or copied) tensor.
+
+        Args:
+            state: Either a dict of attributes (for tensors pickled before
+                Tensor had slots) or a (dict, slots) pair.
+        """
+        if isinstance(state, tuple):
+            state = {**(state[0] or {}), **state[1]}
+        self._borrowed_grad = None
+        for key, value in state.items():
+            setattr(self, key, value)
+        _reserve_id(self._id)
+
     def __add__(self, other: Union[float, "Tensor"]) -> "Tensor":
         """
         Implements addition for Tensor objects.
@@ -442,7 +647,9 @@ class Tensor:
         return f"Tensor({self.array.__str__()}{name})"
 
     def __getitem__(self, idx):
-        return Tensor(self.array[idx], requires_grad=self.requires_grad)
+        from tricycle.ops import Slice
+
+        return Slice()(self, idx)
 
     def __setitem__(self, idx, value):
         self.array[idx] = value
@@ -529,6 +736,21 @@ class Tensor:
 
         return Reshape()(self, shape)
 
+    def transpose(self, axes: Sequence[int] | None = None) -> "Tensor":
+        """
+        Permutes the axes of the tensor without copying it.
+
+        Args:
+            axes (Sequence[int] | None, optional): The new order of the axes.
+                Defaults to reversing them.
+
+        Returns:
+            Tensor: The transposed tensor.
+        """
+        from tricycle.ops import Transpose
+
+        return Transpose()(self, axes)
+
     def split(self, n_splits: int, axis: int = -1) -> List["Tensor"]:
         """
         Splits the tensor into multiple sub-tensors.
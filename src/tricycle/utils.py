@@ -6,7 +6,9 @@ tensor shape matching, and performance logging.
 
 """
 
+import sys
 import time
+import tracemalloc
 from abc import abstractmethod
 from pathlib import Path
 from typing import TYPE_CHECKING, Iterable
@@ -18,10 +20,10 @@ import numpy as np
 from tricycle import GPU_ENABLED
 from tricycle.configs import GPTConfig
 from tricycle.context import TRICYCLE_CONTEXT
-from tricycle.exceptions import GPUDisabledException
 
 if TYPE_CHECKING:
     from tricycle.models import GPT
+    from tricycle.precision import PrecisionPolicy
     from tricycle.tensor import Tensor
 
 
@@ -61,10 +63,17 @@ class UseMixedPrecision:
     Args:
         initial_loss_scale_factor (int): The initial loss scale factor for mixed
             precision training. Defaults to 128.
+        policy (PrecisionPolicy | None): Which dtype each op computes in. See
+            tricycle/precision.py. Defaults to the default policy.
     """
 
-    def __init__(self, initial_loss_scale_factor: int = 128):
+    def __init__(
+        self,
+        initial_loss_scale_factor: int = 128,
+        policy: "PrecisionPolicy | None" = None,
+    ):
         self.active = False
+        self.policy = policy
         TRICYCLE_CONTEXT.loss_scale_factor = initial_loss_scale_factor
         warn(
             "Mixed precision training is unstable. Expect your loss to "
@@ -75,11 +84,17 @@ class UseMixedPrecision:
         """Enables mixed precision training."""
         self.active = True
         TRICYCLE_CONTEXT.use_mixed_precision = True
+        TRICYCLE_CONTEXT.precision_policy = self.policy
 
     def __exit__(self, *args, **kwargs):
         """Disables mixed precision training."""
+        from tricycle.precision import CAST_CACHE
+
         self.active = False
         TRICYCLE_CONTEXT.use_mixed_precision = False
+        TRICYCLE_CONTEXT.precision_policy = None
+        # the low precision copies of parameters aren't needed any more
+        CAST_CACHE.invalidate()
 
 
 def shapes_match(tensor_1: "Tensor", tensor_2: "Tensor") -> bool:
@@ -154,38 +169,53 @@ def r_squared(actual_values, predicted_values):
 
 
 def log_memory_and_time(stage: str, path: Path = Path("memory.log")):
-    """Logs the current GPU memory usage and timestamp to a file.
+    """Logs the current memory usage and timestamp to a file.
+
+    On the GPU, this logs the bytes used and reserved by the cupy memory
+    pool. On the CPU, this logs the bytes currently allocated (as measured
+    by tracemalloc, so this is 0 unless tracemalloc is tracing) and the peak
+    resident memory of the process.
 
     Args:
         stage: A string describing the current stage of execution.
         path: The path to the log file. Defaults to "memory.log".
-
-    Raises:
-        GPUDisabledException: If GPU is not enabled.
     """
-    if not GPU_ENABLED:
-        raise GPUDisabledException(
-            "Cannot log GPU memory if GPU is not enabled"
-        )
-
-    import cupy
-
     if not path.exists():
         path.write_text(
             "stage,used_bytes_human,total_bytes_human,used_bytes,total_bytes,timestamp\n"  # noqa: E501
         )
 
-    pool = cupy.get_default_memory_pool()
-    now = time.perf_counter()
+    if GPU_ENABLED:
+        import cupy
+
+        pool = cupy.get_default_memory_pool()
+        used_bytes = pool.used_bytes()
+        total_bytes = pool.total_bytes()
+    else:
+        used_bytes, _ = tracemalloc.get_traced_memory()
+        total_bytes = _peak_resident_bytes()
 
-    used_bytes = humanize.naturalsize(pool.used_bytes())
-    total_bytes = humanize.naturalsize(pool.total_bytes())
+    now = time.perf_counter()
+    used_bytes_human = humanize.naturalsize(used_bytes)
+    total_bytes_human = humanize.naturalsize(total_bytes)
     with open(path, "a") as f:
         f.write(
-            f"{stage},{used_bytes},{total_bytes},{pool.used_bytes()},{pool.total_bytes()},{now}\n"  # noqa: E501
+            f"{stage},{used_bytes_human},{total_bytes_human},{used_bytes},{total_bytes},{now}\n"  # noqa: E501
         )
 
 
+def _peak_resident_bytes() -> int:
+    """Returns the most memory this process has had resident at once."""
+    try:
+        import resource
+    except ImportError:  # windows
+        return 0
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # linux reports kilobytes, macos reports bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
 def optimal_n_tokens(model: "GPT", config: GPTConfig) -> tuple[int, int]:
     """Estimates the compute-optimal number of tokens to train on using Chinchilla scaling.
 
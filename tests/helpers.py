@@ -0,0 +1,20 @@
+import numpy as np
+
+from tricycle.configs import DebugConfig
+from tricycle.tensor import Tensor
+
+
+class NoDropoutConfig(DebugConfig):
+    input_dropout_prob = 0
+    residual_dropout_prob = 0
+    linear_dropout_prob = 0
+
+
+def get_batch(config, batch_size=4, n_tokens=None):
+    if n_tokens is None:
+        n_tokens = config.context_window
+    inputs = np.random.randint(0, config.vocab_size, (batch_size, n_tokens))
+    outputs = np.random.randint(0, config.vocab_size, (batch_size, n_tokens))
+    inputs = Tensor(inputs, requires_grad=False, is_batched=True, dtype=int)
+    outputs = Tensor(outputs, requires_grad=False, is_batched=True, dtype=int)
+    return inputs, outputs
@@ -0,0 +1,86 @@
+import numpy as np
+
+from tests.helpers import NoDropoutConfig
+from tricycle.arena import BufferArena, UseArena
+from tricycle.context import TRICYCLE_CONTEXT
+from tricycle.layers import Dense
+from tricycle.loss import CrossEntropy
+from tricycle.models import GPT
+from tricycle.tensor import Tensor
+
+
+def test_arena_reuses_buffers():
+    arena = BufferArena()
+
+    first = arena.acquire((3, 4), np.float32)
+    second = arena.acquire((3, 4), np.float32)
+    assert first is not second
+    assert arena.peak_bytes == 2 * first.nbytes
+
+    arena.release(first)
+    assert arena.acquire((3, 4), np.float32) is first
+
+    # a different dtype needs a different buffer
+    assert arena.acquire((3, 4), np.float64) is not second
+
+    arena.reset()
+    assert arena.in_use_bytes == 0
+    assert arena.acquire((3, 4), np.float32) in (first, second)
+
+    stats = arena.stats()
+    assert stats["n_requests"] == 5
+    assert stats["n_reused"] == 2
+    assert stats["reserved_bytes"] == 2 * first.nbytes + 3 * 4 * 8
+
+
+def test_arena_training_step_matches():
+    np.random.seed(0)
+    config = NoDropoutConfig()
+    model = GPT(config)
+    loss_fn = CrossEntropy()
+
+    inputs = np.random.randint(
+        0, config.vocab_size, (4, config.context_window)
+    )
+    outputs = np.random.randint(
+        0, config.vocab_size, (4, config.context_window)
+    )
+    inputs = Tensor(inputs, requires_grad=False, is_batched=True, dtype=int)
+    outputs = Tensor(outputs, requires_grad=False, is_batched=True, dtype=int)
+
+    loss_fn(outputs, model(inputs)).backward()
+    expected = model.token_embedding.weights.grad.array.copy()
+    model.zero_grad()
+
+    arena = BufferArena()
+    with UseArena(arena):
+        for _ in range(2):
+            loss_fn(outputs, model(inputs)).backward()
+            result = model.token_embedding.weights.grad.array.copy()
+            model.zero_grad()
+            arena.reset()
+
+            assert np.allclose(result, expected)
+
+    assert TRICYCLE_CONTEXT.arena is None
+    assert arena.reuse_rate >= 0.5
+
+
+def test_arena_outputs_are_only_valid_until_reset():
+    np.random.seed(0)
+    layer = Dense(4, 3)
+    first_input = Tensor(np.random.random((2, 4)), is_batched=True)
+    second_input = Tensor(np.random.random((2, 4)), is_batched=True)
+
+    arena = BufferArena()
+    with UseArena(arena):
+        output = layer(first_input)
+        kept = Tensor(output.array, copy=True)
+        expected = output.array.copy()
+        arena.reset()
+
+        layer(second_input)
+
+    # the output was written into an arena array that has been reused
+    assert not np.allclose(output.array, expected)
+    assert np.allclose(kept.array, expected)
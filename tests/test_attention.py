@@ -1,7 +1,7 @@
 import numpy as np
 import torch
 
-from tricycle.attention import Attention, build_mask
+from tricycle.attention import Attention, FlashAttention, build_mask
 from tricycle.blocks import MultiHeadSelfAttention
 from tricycle.context import TRICYCLE_CONTEXT
 from tricycle.einsum import Einsum
@@ -306,3 +306,86 @@ def test_attention_block():
     assert tricycle_in_weights.close_to(
         c_attn.weight.grad.T.numpy(), rtol=1e-2, atol=1e-4
     )
+
+
+def test_attention_kv_cache_matches_full_attention():
+    """
+    Passing tokens through the kv cache a few at a time should give the same
+    result as attending over the whole sequence at once
+    """
+    n_heads = 3
+    embedding_dim = 15
+    n_tokens = 7
+    batch_size = 2
+
+    np.random.seed(0)
+    in_tensor = Tensor(
+        np.random.uniform(-5, 5, (batch_size, n_tokens, embedding_dim * 3))
+    ).to_batched()
+
+    attention = Attention(
+        embedding_dim=embedding_dim,
+        n_heads=n_heads,
+        context_window=n_tokens,
+    )
+    expected = attention(in_tensor)
+
+    # prefill with the first few tokens then add the rest one at a time
+    prefill = Tensor(in_tensor.array[:, :4], is_batched=True)
+    outputs = [attention(prefill, use_cache=True).array]
+    for i in range(4, n_tokens):
+        token = Tensor(in_tensor.array[:, i : i + 1], is_batched=True)
+        outputs.append(attention(token, use_cache=True).array)
+
+    assert attention.n_cached_tokens == n_tokens
+    assert expected.close_to(np.concatenate(outputs, axis=1), rtol=1e-3)
+
+    attention.reset_kv_cache()
+    assert attention.n_cached_tokens == 0
+
+
+def test_flash_attention_matches_attention():
+    """
+    Computing attention in tiles should give the same output and gradients
+    as materialising the full attention matrix
+    """
+    n_heads = 3
+    embedding_dim = 15
+    n_tokens = 11
+    batch_size = 2
+
+    np.random.seed(0)
+    in_array = np.random.uniform(
+        -5, 5, (batch_size, n_tokens, embedding_dim * 3)
+    )
+    out_grad = np.random.uniform(-1, 1, (batch_size, n_tokens, embedding_dim))
+
+    attention = Attention(
+        embedding_dim=embedding_dim,
+        n_heads=n_heads,
+        context_window=n_tokens,
+    )
+    # a block size that doesn't divide the sequence length exercises the
+    # ragged final tile
+    flash_attention = FlashAttention(
+        embedding_dim=embedding_dim,
+        n_heads=n_heads,
+        context_window=n_tokens,
+        block_size=4,
+    )
+
+    expected_input = Tensor(in_array).to_batched()
+    expected = attention(expected_input)
+    flash_input = Tensor(in_array).to_batched()
+    result = flash_attention(flash_input)
+
+    assert result.close_to(expected, rtol=1e-3, atol=1e-5)
+
+    (
+        expected * Tensor(out_grad, is_batched=True)
+    ).from_batched().sum().backward()
+    (
+        result * Tensor(out_grad, is_batched=True)
+    ).from_batched().sum().backward()
+
+    assert flash_input.grad.close_to(expected_input.grad, rtol=1e-3, atol=1e-5)
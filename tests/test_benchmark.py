@@ -0,0 +1,53 @@
+from dataclasses import replace
+
+from tricycle.benchmark import (
+    BENCHMARKS,
+    compare,
+    load_results,
+    main,
+    run_suite,
+    save_results,
+)
+
+
+def test_every_benchmark_runs():
+    results = run_suite(repeats=1, warmup=0)
+
+    assert [result.name for result in results] == list(BENCHMARKS)
+    # sourcery skip: no-loop-in-tests
+    for result in results:
+        assert result.mean_seconds > 0
+        assert result.throughput > 0
+        assert result.peak_memory_bytes > 0
+
+
+def test_results_round_trip_and_compare(tmp_path):
+    results = run_suite(names=["dense", "gelu"], repeats=1, warmup=0)
+    path = tmp_path / "baseline.json"
+    save_results(results, path)
+
+    baseline = load_results(path)
+    assert baseline == results
+    assert compare(results, baseline) == []
+
+    slower = [
+        replace(results[0], mean_seconds=results[0].mean_seconds * 2),
+        results[1],
+    ]
+    regressions = compare(slower, baseline, threshold=0.5)
+    assert len(regressions) == 1
+    assert regressions[0].name == "dense"
+    assert regressions[0].metric == "mean_seconds"
+    assert compare(slower, baseline, threshold=1.5) == []
+
+
+def test_main_fails_on_regression(tmp_path):
+    path = tmp_path / "baseline.json"
+    results = run_suite(names=["dense"], repeats=1, warmup=0)
+    save_results(
+        [replace(results[0], mean_seconds=1e-12, peak_memory_bytes=1)], path
+    )
+
+    args = ["--benchmarks", "dense", "--repeats", "1", "--warmup", "0"]
+    assert main(args + ["--output", str(tmp_path / "out.json")]) == 0
+    assert main(args + ["--baseline", str(path)]) == 1
@@ -1,6 +1,6 @@
 import numpy as np
 
-from tricycle.blocks import GPT2TransformerBlock, MLPBlock
+from tricycle.blocks import CheckpointedBlock, GPT2TransformerBlock, MLPBlock
 from tricycle.tensor import Tensor
 
 
@@ -76,3 +76,87 @@ def test_GPT2TransformerBlock():
 
     assert in_tensor.grad is not None
     assert in_tensor.grad.shape == in_tensor.shape
+
+
+def test_checkpointed_block_matches_block():
+    np.random.seed(0)
+    batch_size = 4
+    n_tokens = 8
+    n_heads = 3
+    embedding_dim = 7 * n_heads
+
+    in_array = np.random.random((batch_size, n_tokens, embedding_dim))
+    block = GPT2TransformerBlock(
+        embedding_dim=embedding_dim,
+        n_heads=n_heads,
+        context_window=n_tokens,
+        residual_dropout_prob=0.2,
+        linear_dropout_prob=0.2,
+    )
+
+    np.random.seed(1)
+    in_tensor = Tensor(in_array, is_batched=True)
+    expected = block(in_tensor)
+    expected.from_batched().sum().backward()
+    expected_weight_grad = block.mlp_block.linear_1.weights.grad.array.copy()
+    block.zero_grad()
+
+    checkpointed = CheckpointedBlock(block)
+
+    np.random.seed(1)
+    checkpoint_tensor = Tensor(in_array, is_batched=True)
+    result = checkpointed(checkpoint_tensor)
+
+    # nothing but the block input should be kept for the backward pass
+    assert block.mlp_block.linear_1._input is None
+    assert block.attention_block.attention._before_smush is None
+
+    result.from_batched().sum().backward()
+
+    assert result.close_to(expected)
+    assert checkpoint_tensor.grad.close_to(in_tensor.grad)
+    assert np.allclose(
+        block.mlp_block.linear_1.weights.grad.array, expected_weight_grad
+    )
+
+
+def test_checkpointed_block_clips_gradients():
+    np.random.seed(0)
+    batch_size = 4
+    n_tokens = 8
+    n_heads = 3
+    embedding_dim = 7 * n_heads
+    clip = 1e-3
+
+    in_array = np.random.random((batch_size, n_tokens, embedding_dim))
+    block = GPT2TransformerBlock(
+        embedding_dim=embedding_dim,
+        n_heads=n_heads,
+        context_window=n_tokens,
+        residual_dropout_prob=0.2,
+        linear_dropout_prob=0.2,
+    )
+
+    np.random.seed(1)
+    in_tensor = Tensor(in_array, is_batched=True)
+    expected = block(in_tensor)
+    expected.from_batched().sum().backward(clip=clip)
+    expected_weight_grad = block.mlp_block.linear_1.weights.grad.array.copy()
+    block.zero_grad()
+
+    checkpointed = CheckpointedBlock(block)
+
+    np.random.seed(1)
+    checkpoint_tensor = Tensor(in_array, is_batched=True)
+    result = checkpointed(checkpoint_tensor)
+    result.from_batched().sum().backward(clip=clip)
+
+    # from the outside, the whole block is a single edge so its input
+    # gradient is clipped once more after the edges inside it are added up
+    assert np.allclose(
+        checkpoint_tensor.grad.array,
+        np.clip(in_tensor.grad.array, -clip, clip),
+    )
+    assert np.allclose(
+        block.mlp_block.linear_1.weights.grad.array, expected_weight_grad
+    )
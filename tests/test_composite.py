@@ -77,3 +77,52 @@ def test_mean():
     assert in_tensor.grad.close_to(
         [1 / 6, 1 / 6, 1 / 6, 1 / 6, 1 / 6, 1 / 6], rtol=1e-3
     )
+
+
+def test_split_pieces_are_views_with_a_single_gradient():
+    in_tensor = Tensor(np.arange(12).reshape(3, 4))
+
+    left, right = in_tensor.split(2)
+
+    assert np.shares_memory(left.array, in_tensor.array)
+    assert np.shares_memory(right.array, in_tensor.array)
+
+    (left * 2 + right * 3).sum().backward()
+
+    expected = np.array([[2, 2, 3, 3]] * 3)
+    assert in_tensor.grad.close_to(expected)
+
+
+def test_slice():
+    in_tensor = Tensor(np.arange(12).reshape(3, 4))
+
+    out_tensor = in_tensor[1:, 1]
+
+    assert np.shares_memory(out_tensor.array, in_tensor.array)
+    assert out_tensor.close_to([5, 9])
+
+    out_tensor.backward()
+    assert in_tensor.grad.close_to([[0, 0, 0, 0], [0, 1, 0, 0], [0, 1, 0, 0]])
+
+    # indexing with an array makes a copy that can contain duplicates
+    in_tensor.grad = None
+    out_tensor = in_tensor[np.array([0, 0, 2])]
+
+    out_tensor.backward()
+    assert in_tensor.grad.close_to([[2, 2, 2, 2], [0, 0, 0, 0], [1, 1, 1, 1]])
+
+
+def test_transpose():
+    in_tensor = Tensor(np.arange(24).reshape(2, 3, 4), is_batched=True)
+
+    out_tensor = in_tensor.transpose()
+
+    assert out_tensor.shape == (2, 4, 3)
+    assert np.shares_memory(out_tensor.array, in_tensor.array)
+    assert out_tensor.close_to(np.transpose(in_tensor.array, (0, 2, 1)))
+
+    (out_tensor * Tensor(np.arange(12).reshape(4, 3))).sum().backward()
+
+    assert in_tensor.grad.close_to(
+        np.broadcast_to(np.arange(12).reshape(4, 3).T, (2, 3, 4))
+    )
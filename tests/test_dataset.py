@@ -1,6 +1,6 @@
 import numpy as np
 
-from tricycle.dataset import CausalLMDataset
+from tricycle.dataset import CausalLMDataset, PrefetchDataset
 
 
 def test_can_build_causal_lm_dataset():
@@ -24,3 +24,53 @@ def test_can_build_causal_lm_dataset():
     inputs, outputs = dataset[0]
     assert inputs.shape == (10, 10)
     assert outputs.shape == (10, 10)
+
+
+def test_batched_causal_lm_dataset_gathers_windows():
+    tokens = np.arange(100)
+    dataset = CausalLMDataset(
+        tokens=tokens, vocab_size=100, batch_size=4, context_window=8
+    ).batch()
+    dataset.batch_indices = np.array([5, 0, 42, 17] + [0] * 10)
+
+    inputs, outputs = dataset[0]
+    for row, start in enumerate([5, 0, 42, 17]):
+        assert np.allclose(inputs[row], tokens[start : start + 8])
+        assert np.allclose(outputs[row], tokens[start + 1 : start + 9])
+
+
+def test_prefetch_dataset_matches_dataset():
+    tokens = np.arange(200)
+    dataset = (
+        CausalLMDataset(
+            tokens=tokens, vocab_size=200, batch_size=4, context_window=8
+        )
+        .batch()
+        .shuffle()
+        .to_tensor()
+    )
+    expected = [(x.array.copy(), y.array.copy()) for x, y in dataset]
+
+    prefetched = dataset.prefetch(depth=3)
+    assert len(prefetched) == len(dataset)
+
+    # iterate twice to check that the prefetcher restarts cleanly
+    for _ in range(2):
+        actual = list(prefetched)
+        assert len(actual) == len(expected)
+        for (x, y), (expected_x, expected_y) in zip(actual, expected):
+            assert np.allclose(x.array, expected_x)
+            assert np.allclose(y.array, expected_y)
+    prefetched.close()
+
+
+def test_prefetch_dataset_supports_next_without_iter():
+    tokens = np.arange(200)
+    dataset = CausalLMDataset(
+        tokens=tokens, vocab_size=200, batch_size=4, context_window=8
+    ).batch()
+    prefetched = PrefetchDataset(dataset, depth=2)
+
+    inputs, _ = next(prefetched)
+    assert np.allclose(inputs, dataset[0][0])
+    prefetched.close()
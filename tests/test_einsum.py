@@ -1,6 +1,7 @@
 import numpy as np
+import pytest
 
-from tricycle.einsum import Einsum, Subscript
+from tricycle.einsum import Einsum, Subscript, einsum, plan
 from tricycle.tensor import Tensor
 
 
@@ -87,3 +88,58 @@ def test_can_parse_split():
     inputs = [["z", "..."], ["z", "..."]]
     output = ["z", "..."]
     assert Subscript.join(inputs, output) == "z...,z...->z..."
+
+
+@pytest.mark.parametrize(
+    "subscript, shapes, kind",
+    [
+        ("ij->ji", [(3, 4)], "transpose"),
+        ("ijk->ki", [(3, 4, 5)], "sum"),
+        ("zTi,ij->zTj", [(2, 3, 4), (4, 5)], "matmul"),
+        ("zTi,zTj->ij", [(2, 3, 4), (2, 3, 5)], "matmul"),
+        ("BNIh, BNJh -> BNIJ", [(2, 3, 4, 5), (2, 3, 6, 5)], "matmul"),
+        ("ij,jk,kl->il", [(3, 4), (4, 5), (5, 6)], "einsum"),
+        ("ii->i", [(3, 3)], "einsum"),
+    ],
+)
+def test_planned_einsum_matches_numpy(subscript, shapes, kind):
+    np.random.seed(0)
+    arrays = [np.random.random(shape) for shape in shapes]
+
+    assert plan(subscript, tuple(shapes)).kind == kind
+    assert np.allclose(
+        einsum(subscript, *arrays),
+        np.einsum(subscript.replace(" ", ""), *arrays),
+    )
+
+
+def test_einsum_plans_are_cached():
+    x = Tensor(np.ones((2, 3, 4)), is_batched=True)
+    y = Tensor(np.ones((4, 5)))
+    first = Einsum.compile("Ti,ij->Tj", (True, False), ((2, 3, 4), (4, 5)))
+
+    Einsum("Ti,ij->Tj")(x, y)
+    second = Einsum.compile("Ti,ij->Tj", (True, False), ((2, 3, 4), (4, 5)))
+    assert first is second
+
+
+def test_batched_matmul_gradients():
+    np.random.seed(0)
+    x = Tensor(np.random.random((2, 3, 4)), is_batched=True)
+    y = Tensor(np.random.random((4, 5)))
+
+    result = Einsum("Ti,ij->Tj")(x, y)
+    assert result.is_batched
+    assert result.close_to(x.array @ y.array, rtol=1e-4)
+
+    result.from_batched().sum().backward()
+    ones = np.ones((2, 3, 5))
+    assert x.grad.close_to(ones @ y.array.T, rtol=1e-4)
+    # gradients for unbatched inputs keep the batch dimension until an
+    # optimiser sums over it
+    assert y.grad.is_batched
+    assert np.allclose(
+        y.grad.array.sum(axis=0),
+        np.einsum("zTi,zTj->ij", x.array, ones),
+        rtol=1e-4,
+    )
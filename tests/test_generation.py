@@ -0,0 +1,112 @@
+import asyncio
+
+import numpy as np
+
+from tests.helpers import NoDropoutConfig
+from tricycle.generation import GenerationEngine
+from tricycle.models import GPT
+from tricycle.tensor import Tensor
+
+
+def greedy(model, tokens, n_tokens):
+    tokens = list(tokens)
+    for _ in range(n_tokens):
+        window = tokens[-model.context_window :]
+        logits = model(Tensor(window, requires_grad=False, dtype=int))
+        tokens.append(int(np.argmax(logits.array[0, -1])))
+    return tokens[-n_tokens:]
+
+
+def test_engine_matches_single_prompt_generation():
+    np.random.seed(0)
+    config = NoDropoutConfig()
+    model = GPT(config)
+
+    prompts = [
+        np.random.randint(0, config.vocab_size, length).tolist()
+        for length in [2, 5, 9, 3]
+    ]
+    max_new_tokens = [4, 7, 3, 6]
+
+    # a batch size smaller than the number of prompts forces requests to be
+    # admitted as others finish
+    engine = GenerationEngine(model, max_batch_size=2)
+    requests = [
+        engine.submit(prompt, max_new_tokens=n, sample=False)
+        for prompt, n in zip(prompts, max_new_tokens)
+    ]
+    engine.run_until_complete()
+
+    for request, prompt, n in zip(requests, prompts, max_new_tokens):
+        assert request.finished
+        assert request.generated == greedy(model, prompt, n)
+
+    assert not engine.has_work
+
+
+def test_engine_stops_on_stop_token():
+    np.random.seed(0)
+    config = NoDropoutConfig()
+    model = GPT(config)
+
+    prompt = [1, 2, 3]
+    expected = greedy(model, prompt, 5)
+
+    engine = GenerationEngine(model)
+    request = engine.submit(
+        prompt, max_new_tokens=5, sample=False, stop_token=expected[1]
+    )
+    engine.run_until_complete()
+
+    assert request.generated == expected[: expected.index(expected[1]) + 1]
+
+
+def test_engine_streams_tokens():
+    np.random.seed(0)
+    config = NoDropoutConfig()
+    model = GPT(config)
+    engine = GenerationEngine(model, max_batch_size=4)
+
+    prompts = [[1, 2, 3], [4, 5]]
+
+    async def collect(prompt):
+        return [
+            token
+            async for token in engine.stream(
+                prompt, max_new_tokens=4, sample=False
+            )
+        ]
+
+    async def main():
+        server = asyncio.create_task(engine.serve())
+        results = await asyncio.gather(*(collect(p) for p in prompts))
+        server.cancel()
+        return results
+
+    results = asyncio.run(main())
+
+    for prompt, result in zip(prompts, results):
+        assert result == greedy(model, prompt, 4)
+
+
+def test_engine_streams_to_submitted_queues():
+    np.random.seed(0)
+    config = NoDropoutConfig()
+    model = GPT(config)
+    engine = GenerationEngine(model)
+
+    prompt = [1, 2, 3]
+
+    async def main():
+        server = asyncio.create_task(engine.serve())
+        queue = asyncio.Queue()
+        engine.submit(prompt, max_new_tokens=3, sample=False, stream=queue)
+
+        tokens = []
+        while (token := await asyncio.wait_for(queue.get(), 5)) is not None:
+            tokens.append(token)
+        server.cancel()
+        return tokens
+
+    # debug mode complains about queues being used from the wrong thread
+    assert asyncio.run(main(), debug=True) == greedy(model, prompt, 3)
@@ -0,0 +1,212 @@
+import weakref
+
+import numpy as np
+import pytest
+
+from tests.helpers import NoDropoutConfig, get_batch
+from tricycle.context import NoGrad
+from tricycle.graph import StaticGraph, Tape, ThreadedBackward
+from tricycle.loss import CrossEntropy
+from tricycle.models import GPT
+from tricycle.tensor import Tensor
+
+
+def collect_grads(model):
+    grads = [
+        model.token_embedding.weights.grad.array.copy(),
+        model.position_embedding.weights.grad.array.copy(),
+        model.head.weights.grad.array.copy(),
+        model.blocks[
+            0
+        ].attention_block.in_projection.weights.grad.array.copy(),
+    ]
+    model.zero_grad()
+    return grads
+
+
+def test_static_graph_matches_backward():
+    np.random.seed(0)
+    config = NoDropoutConfig()
+    model = GPT(config)
+    loss_fn = CrossEntropy()
+    graph = StaticGraph()
+
+    for _ in range(3):
+        inputs, outputs = get_batch(config)
+
+        loss = loss_fn(outputs, model(inputs))
+        loss.backward()
+        expected = collect_grads(model)
+
+        with graph.record():
+            loss = loss_fn(outputs, model(inputs))
+        graph.backward(loss)
+        result = collect_grads(model)
+
+        for got, want in zip(result, expected):
+            assert np.allclose(got, want)
+
+    assert graph.n_captures == 1
+    assert graph.n_replays == 2
+
+
+def test_static_graph_recaptures_when_shapes_change():
+    np.random.seed(0)
+    config = NoDropoutConfig()
+    model = GPT(config)
+    loss_fn = CrossEntropy()
+    graph = StaticGraph()
+
+    for n_tokens in [config.context_window, 4, 4]:
+        inputs, outputs = get_batch(config, n_tokens=n_tokens)
+
+        loss = loss_fn(outputs, model(inputs))
+        loss.backward()
+        expected = collect_grads(model)
+
+        with graph.record():
+            loss = loss_fn(outputs, model(inputs))
+        graph.backward(loss)
+        result = collect_grads(model)
+
+        for got, want in zip(result, expected):
+            assert np.allclose(got, want)
+
+    assert graph.n_captures == 2
+    assert graph.n_replays == 1
+
+
+def test_tape_backward_matches_backward():
+    np.random.seed(0)
+    config = NoDropoutConfig()
+    model = GPT(config)
+    loss_fn = CrossEntropy()
+    inputs, outputs = get_batch(config)
+
+    loss = loss_fn(outputs, model(inputs))
+    loss.backward()
+    expected = collect_grads(model)
+
+    with Tape() as tape:
+        loss = loss_fn(outputs, model(inputs))
+    assert tape.backward(loss)
+    result = collect_grads(model)
+
+    for got, want in zip(result, expected):
+        assert np.allclose(got, want)
+
+
+def test_tape_backward_falls_back_for_unrecorded_graphs():
+    np.random.seed(0)
+    config = NoDropoutConfig()
+    model = GPT(config)
+    loss_fn = CrossEntropy()
+    inputs, outputs = get_batch(config)
+
+    loss = loss_fn(outputs, model(inputs))
+    loss.backward()
+    expected = collect_grads(model)
+
+    # the logits are built outside the tape so the tape can't be used
+    logits = model(inputs)
+    with Tape() as tape:
+        loss = loss_fn(outputs, logits)
+    assert not tape.backward(loss)
+    result = collect_grads(model)
+
+    for got, want in zip(result, expected):
+        assert np.allclose(got, want)
+
+
+def test_tape_backward_frees_activations():
+    np.random.seed(0)
+    config = NoDropoutConfig()
+    model = GPT(config)
+    loss_fn = CrossEntropy()
+    inputs, outputs = get_batch(config)
+
+    with Tape() as tape:
+        # nothing can go backward through these so they aren't recorded
+        with NoGrad():
+            model(inputs)
+        assert not tape.tensors
+
+        loss = loss_fn(outputs, model(inputs))
+    activations = [
+        weakref.ref(tensor) for tensor in tape.tensors if tensor.args
+    ]
+    assert activations
+
+    tape.backward(loss)
+    del loss
+
+    assert not tape.tensors
+    assert all(activation() is None for activation in activations)
+
+
+def test_static_graph_replay_frees_activations():
+    np.random.seed(0)
+    config = NoDropoutConfig()
+    model = GPT(config)
+    loss_fn = CrossEntropy()
+    graph = StaticGraph()
+
+    for _ in range(2):
+        inputs, outputs = get_batch(config)
+        with graph.record() as tape:
+            loss = loss_fn(outputs, model(inputs))
+        activations = [
+            weakref.ref(tensor) for tensor in tape.tensors if tensor.args
+        ]
+        graph.backward(loss)
+        del loss
+
+        assert not tape.tensors
+        assert all(activation() is None for activation in activations)
+    assert graph.n_replays == 1
+
+
+def test_threaded_backward_matches_backward():
+    np.random.seed(0)
+    config = NoDropoutConfig()
+    model = GPT(config)
+    loss_fn = CrossEntropy()
+
+    with ThreadedBackward(n_threads=4) as threaded:
+        for _ in range(2):
+            inputs, outputs = get_batch(config)
+
+            loss = loss_fn(outputs, model(inputs))
+            loss.backward()
+            expected = collect_grads(model)
+
+            loss = loss_fn(outputs, model(inputs))
+            threaded.backward(loss)
+            result = collect_grads(model)
+
+            assert loss.args is None
+            for got, want in zip(result, expected):
+                assert np.allclose(got, want, atol=1e-6)
+
+
+def test_threaded_backward_accumulates_shared_gradients():
+    x = Tensor(np.arange(6).reshape(2, 3))
+    pieces = x.split(3)
+    total = (pieces[0] * 2 + pieces[1] * 3 + pieces[2]).sum() + x.sum()
+
+    with ThreadedBackward(n_threads=4) as threaded:
+        threaded.backward(total)
+
+    assert x.grad.close_to([[3, 4, 2], [3, 4, 2]])
+
+
+def test_threaded_backward_raises_errors():
+    def broken(grad):
+        raise RuntimeError("broken")
+
+    x = Tensor(np.ones(3))
+    y = Tensor(np.ones(3), args=(x,), back_fns=(broken,))
+
+    with ThreadedBackward(n_threads=2) as threaded:
+        with pytest.raises(RuntimeError, match="broken"):
+            threaded.backward(y)
@@ -162,3 +162,33 @@ def test_embedding_batched():
             ],
         ]
     )
+
+
+def test_embedding_sparse_grad():
+    np.random.seed(0)
+    vocab_size = 6
+    out_shape = 5
+    tokens = np.array([[0, 4, 2, 0], [4, 2, 2, 4]])
+    weights = np.random.random((vocab_size, out_shape))
+
+    dense_layer = Embedding(from_size=vocab_size, to_size=out_shape)
+    dense_layer.weights = Tensor(weights)
+    sparse_layer = Embedding(
+        from_size=vocab_size, to_size=out_shape, sparse_grad=True
+    )
+    sparse_layer.weights = Tensor(weights)
+
+    # sourcery skip: no-loop-in-tests
+    for layer in [dense_layer, sparse_layer]:
+        # accumulate over two backward passes
+        for _ in range(2):
+            in_tensor = Tensor(
+                tokens, requires_grad=False, dtype=int
+            ).to_batched()
+            layer(in_tensor).from_batched().sum().backward()
+
+    grad = sparse_layer.weights.grad
+    assert grad.is_sparse
+    assert grad.indices.tolist() == [0, 2, 4]
+    assert grad.shape == (3, out_shape)
+    assert np.allclose(grad.to_dense(), dense_layer.weights.grad.array)
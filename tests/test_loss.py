@@ -5,7 +5,8 @@ from sklearn.preprocessing import RobustScaler
 
 from tricycle.einsum import Einsum
 from tricycle.initialisers import init_xavier
-from tricycle.loss import CrossEntropy, MeanSquaredError
+from tricycle.layers import Dense
+from tricycle.loss import ChunkedCrossEntropy, CrossEntropy, MeanSquaredError
 from tricycle.tensor import Tensor
 from tricycle.utils import r_squared, smooth
 
@@ -322,3 +323,51 @@ def test_CrossEntropy_minibatch():
 
     losses = list(smooth(losses, 0.99))
     assert losses[-1] < 6
+
+
+def test_chunked_cross_entropy_matches_cross_entropy():
+    np.random.seed(0)
+    batch_size, n_tokens, embedding_dim, vocab_size = 3, 5, 8, 11
+
+    hidden = np.random.random((batch_size, n_tokens, embedding_dim))
+    targets = np.random.randint(0, vocab_size, (batch_size, n_tokens))
+    targets = Tensor(targets, requires_grad=False, is_batched=True, dtype=int)
+    head = Dense(from_size=embedding_dim, to_size=vocab_size)
+
+    expected_hidden = Tensor(hidden, is_batched=True)
+    expected = CrossEntropy()(targets, head(expected_hidden))
+    expected.backward()
+    expected_weight_grad = head.weights.grad.array.copy()
+    head.zero_grad()
+
+    # use a chunk size that doesn't divide the number of tokens
+    hidden = Tensor(hidden, is_batched=True)
+    loss = ChunkedCrossEntropy(chunk_size=4)(targets, hidden, head.weights)
+    loss.backward()
+
+    assert loss.close_to(expected, rtol=1e-5)
+    assert hidden.grad.close_to(expected_hidden.grad, rtol=1e-4, atol=1e-7)
+    assert head.weights.grad.close_to(
+        expected_weight_grad, rtol=1e-4, atol=1e-7
+    )
+
+
+def test_chunked_cross_entropy_retain_graph():
+    np.random.seed(0)
+    batch_size, n_tokens, embedding_dim, vocab_size = 2, 5, 8, 11
+
+    hidden = np.random.random((batch_size, n_tokens, embedding_dim))
+    targets = np.random.randint(0, vocab_size, (batch_size, n_tokens))
+    targets = Tensor(targets, requires_grad=False, is_batched=True, dtype=int)
+    head = Dense(from_size=embedding_dim, to_size=vocab_size)
+
+    hidden = Tensor(hidden, is_batched=True)
+    loss = ChunkedCrossEntropy(chunk_size=3)(targets, hidden, head.weights)
+
+    loss.backward(retain_graph=True)
+    hidden_grad = hidden.grad.array.copy()
+    weight_grad = head.weights.grad.array.copy()
+
+    loss.backward(retain_graph=True)
+    assert np.allclose(hidden.grad.array, 2 * hidden_grad)
+    assert np.allclose(head.weights.grad.array, 2 * weight_grad)
@@ -0,0 +1,85 @@
+import numpy as np
+
+from tests.helpers import NoDropoutConfig
+from tricycle.loss import CrossEntropy
+from tricycle.memory import MemoryTracker
+from tricycle.models import GPT
+from tricycle.optimisers import AdamW
+from tricycle.tensor import Tensor
+from tricycle.utils import log_memory_and_time
+
+
+def test_memory_tracker_counts_each_category(tmp_path):
+    np.random.seed(0)
+    config = NoDropoutConfig()
+    model = GPT(config)
+    optimiser = AdamW()
+    loss_fn = CrossEntropy()
+    inputs = Tensor(
+        np.random.randint(0, config.vocab_size, (2, config.context_window)),
+        requires_grad=False,
+        is_batched=True,
+        dtype=int,
+    )
+    outputs = Tensor(
+        np.random.randint(0, config.vocab_size, (2, config.context_window)),
+        requires_grad=False,
+        is_batched=True,
+        dtype=int,
+    )
+    parameter_bytes = sum(
+        parameter.array.nbytes for parameter in model.parameters()
+    )
+
+    tracker = MemoryTracker(model, optimiser, path=tmp_path / "memory.csv")
+    with tracker.phase("forward"):
+        loss = loss_fn(outputs, model(inputs))
+        tracker.watch(loss)
+    with tracker.phase("backward"):
+        loss.backward()
+    with tracker.phase("update"):
+        model.update(optimiser)
+        model.zero_grad()
+    records = tracker.end_step(0)
+    tracker.close()
+
+    forward, backward, update = records
+    assert [record["phase"] for record in records] == [
+        "forward",
+        "backward",
+        "update",
+    ]
+    assert forward["parameters"] == parameter_bytes
+    assert forward["gradients"] == 0
+    assert forward["activations"] > 0
+    assert forward["optimiser"] == 0
+
+    assert backward["gradients"] > 0
+
+    # adam stores two float32 moments for every parameter
+    assert update["gradients"] == 0
+    assert update["optimiser"] == 2 * parameter_bytes
+    assert update["total"] == sum(
+        update[category]
+        for category in [
+            "parameters",
+            "gradients",
+            "activations",
+            "optimiser",
+            "arena",
+        ]
+    )
+    assert all(record["traced_peak"] > 0 for record in records)
+    assert tracker.peak("optimiser") == 2 * parameter_bytes
+
+    lines = (tmp_path / "memory.csv").read_text().splitlines()
+    assert len(lines) == 4
+
+
+def test_log_memory_and_time_on_cpu(tmp_path):
+    path = tmp_path / "memory.log"
+    log_memory_and_time("start", path=path)
+
+    header, row = path.read_text().splitlines()
+    assert header.startswith("stage,")
+    assert row.startswith("start,")
@@ -6,6 +6,12 @@ from tricycle.context import TRICYCLE_CONTEXT
 from tricycle.layers import Dense, Layer
 from tricycle.loss import MeanSquaredError
 from tricycle.optimisers import StochasticGradientDescent
+from tricycle.precision import (
+    CAST_CACHE,
+    PrecisionPolicy,
+    cast_parameter,
+    compute_dtype,
+)
 from tricycle.tensor import Tensor
 from tricycle.utils import UseMixedPrecision
 
@@ -86,3 +92,53 @@ def test_can_train_in_mixed_precision():
 
         # make sure the loss has decreased as expected
         assert 7.5 < loss < 8
+
+
+def test_low_precision_weights_are_cached_until_updated():
+    np.random.seed(0)
+    layer = Dense(from_size=16, to_size=8)
+    optimiser = StochasticGradientDescent(learning_rate=1e-1, logger=logger)
+    inputs = Tensor(
+        np.random.random((4, 16)), is_batched=True, requires_grad=False
+    )
+
+    with UseMixedPrecision():
+        CAST_CACHE.hits = CAST_CACHE.misses = 0
+
+        # accumulate gradients over several batches: the weights should
+        # only be cast once
+        # sourcery skip: no-loop-in-tests
+        for _ in range(3):
+            out = layer(inputs)
+            assert out.dtype == np.float16
+            out.backward()
+        assert CAST_CACHE.misses == 1
+        assert CAST_CACHE.hits == 2
+
+        layer.update(optimiser)
+        out = layer(inputs)
+        assert CAST_CACHE.misses == 2
+        # the output should use the updated weights
+        assert np.allclose(
+            out.array, inputs.array @ layer.weights.array, atol=1e-2
+        )
+    assert len(CAST_CACHE) == 0
+
+
+def test_precision_policy_overrides_op_dtype():
+    np.random.seed(0)
+    layer = Dense(from_size=16, to_size=8)
+    inputs = Tensor(np.random.random((4, 16)), is_batched=True)
+
+    policy = PrecisionPolicy(op_dtypes={"dense": "float32"})
+    with UseMixedPrecision(policy=policy):
+        assert compute_dtype("dense") == np.float32
+        assert compute_dtype("layer_norm") == np.float16
+        # dense layers use the full precision weights directly
+        assert cast_parameter(layer.weights, "dense") is layer.weights.array
+        assert cast_parameter(layer.weights, "embedding").dtype == np.float16
+        # activations are still passed between ops in 16 bit
+        assert layer(inputs).dtype == np.float16
+
+    assert compute_dtype("dense") is None
+    assert TRICYCLE_CONTEXT.precision_policy is None
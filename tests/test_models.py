@@ -0,0 +1,128 @@
+import numpy as np
+
+from tests.helpers import NoDropoutConfig
+from tricycle.context import TRICYCLE_CONTEXT, NoGrad
+from tricycle.models import GPT
+from tricycle.tensor import Tensor
+
+
+def test_gpt_kv_cache_matches_full_forward():
+    np.random.seed(0)
+    config = NoDropoutConfig()
+    model = GPT(config)
+
+    tokens = np.random.randint(0, config.vocab_size, config.context_window)
+    expected = model(Tensor(tokens, requires_grad=False, dtype=int))
+
+    model.reset_kv_cache()
+    prefill = model(
+        Tensor(tokens[:5], requires_grad=False, dtype=int), use_cache=True
+    )
+    assert prefill.close_to(expected.array[:, :5], rtol=1e-3, atol=1e-5)
+
+    for i in range(5, config.context_window):
+        token = Tensor(tokens[i : i + 1], requires_grad=False, dtype=int)
+        predicted = model(token, use_cache=True)
+        assert predicted.close_to(
+            expected.array[:, i : i + 1], rtol=1e-3, atol=1e-5
+        )
+
+    assert model.n_cached_tokens == config.context_window
+
+
+def test_gpt_accepts_short_sequences():
+    np.random.seed(0)
+    config = NoDropoutConfig()
+    model = GPT(config)
+
+    tokens = np.random.randint(0, config.vocab_size, config.context_window)
+    expected = model(Tensor(tokens, requires_grad=False, dtype=int))
+
+    short = model(Tensor(tokens[:4], requires_grad=False, dtype=int))
+
+    assert short.shape == (1, 4, config.vocab_size)
+    assert short.close_to(expected.array[:, :4], rtol=1e-3, atol=1e-5)
+
+    short.from_batched().sum().backward()
+    assert model.head.weights.grad is not None
+    assert model.position_embedding.weights.grad is not None
+
+
+def test_gpt_trims_ragged_batch():
+    np.random.seed(0)
+    config = NoDropoutConfig()
+    model = GPT(config)
+
+    lengths = [3, 6]
+    tokens = np.zeros((2, config.context_window), dtype=int)
+    tokens[0, :3] = np.random.randint(0, config.vocab_size, 3)
+    tokens[1, :6] = np.random.randint(0, config.vocab_size, 6)
+
+    batch = Tensor(tokens, requires_grad=False, is_batched=True, dtype=int)
+    result = model(batch, lengths=lengths)
+
+    assert result.shape == (2, 6, config.vocab_size)
+
+    # each sequence should match running it on its own
+    for row, length in enumerate(lengths):
+        single = model(
+            Tensor(tokens[row, :length], requires_grad=False, dtype=int)
+        )
+        assert single.close_to(
+            result.array[row : row + 1, :length], rtol=1e-3, atol=1e-5
+        )
+
+
+def test_gpt_gradient_checkpointing_matches():
+    config = NoDropoutConfig()
+    np.random.seed(0)
+    model = GPT(config)
+
+    class CheckpointConfig(NoDropoutConfig):
+        gradient_checkpointing = True
+
+    np.random.seed(0)
+    checkpointed = GPT(CheckpointConfig())
+
+    tokens = np.random.randint(
+        0, config.vocab_size, (2, config.context_window)
+    )
+    tokens = Tensor(tokens, requires_grad=False, is_batched=True, dtype=int)
+
+    expected = model(tokens)
+    expected.from_batched().sum().backward()
+    result = checkpointed(tokens)
+    result.from_batched().sum().backward()
+
+    assert result.close_to(expected)
+    assert checkpointed.token_embedding.weights.grad.close_to(
+        model.token_embedding.weights.grad, rtol=1e-3, atol=1e-5
+    )
+    assert checkpointed.blocks[0].block.norm_1.gamma.grad.close_to(
+        model.blocks[0].norm_1.gamma.grad, rtol=1e-3, atol=1e-5
+    )
+
+
+def test_gpt_no_grad_skips_graph():
+    np.random.seed(0)
+    config = NoDropoutConfig()
+    model = GPT(config)
+    tokens = np.random.randint(
+        0, config.vocab_size, (2, config.context_window)
+    )
+    tokens = Tensor(tokens, requires_grad=False, is_batched=True, dtype=int)
+
+    expected = model(tokens)
+    assert expected.args is not None
+    assert model.head._input is not None
+
+    with NoGrad():
+        assert not TRICYCLE_CONTEXT.grad_enabled
+        result = model(tokens)
+    assert TRICYCLE_CONTEXT.grad_enabled
+
+    assert result.close_to(expected)
+    assert result.args is None
+    assert result.back_fns is None
+    assert model.head._input is None
+    assert model.blocks[0].attention_block.attention._input is None
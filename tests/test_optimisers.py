@@ -3,9 +3,10 @@ from sklearn.datasets import load_iris
 
 from tricycle.activation import ReLU
 from tricycle.dataset import InfiniteBatchDataset
-from tricycle.layers import Dense, Sequential
+from tricycle.layers import Dense, Embedding, Sequential
 from tricycle.loss import CrossEntropy
-from tricycle.optimisers import StochasticGradientDescent
+from tricycle.optimisers import AdamW, StochasticGradientDescent
+from tricycle.tensor import Tensor
 
 
 def test_can_train_simple_neural_network_no_wd():
@@ -132,3 +133,31 @@ def test_can_train_simple_neural_network_momentum():
         model.zero_grad()
 
     assert losses[-1] < 1.5
+
+
+def test_sparse_updates_only_touch_seen_rows():
+    np.random.seed(0)
+    weights = np.random.random((6, 3)).astype(np.float32)
+    tokens = Tensor([[0, 4], [4, 4]], requires_grad=False, dtype=int)
+    seen = [0, 4]
+    unseen = [1, 2, 3, 5]
+
+    layer = Embedding(from_size=6, to_size=3, sparse_grad=True)
+    layer.weights = Tensor(weights.copy())
+    layer(tokens.to_batched()).from_batched().sum().backward()
+    grad = layer.weights.grad.to_dense()
+    layer.update(StochasticGradientDescent(learning_rate=1e-1, momentum=0.9))
+
+    assert np.allclose(layer.weights.array[unseen], weights[unseen])
+    assert np.allclose(
+        layer.weights.array[seen], weights[seen] - 1e-1 * grad[seen]
+    )
+
+    layer.weights = Tensor(weights.copy())
+    layer(tokens.to_batched()).from_batched().sum().backward()
+    layer.update(AdamW(learning_rate=1e-1, weight_decay=0.1))
+
+    # on the first step, adam moves each weight by roughly the learning rate
+    expected = weights[seen] - 1e-1 * (1 + 0.1 * weights[seen])
+    assert np.allclose(layer.weights.array[unseen], weights[unseen])
+    assert np.allclose(layer.weights.array[seen], expected, atol=1e-4)
@@ -0,0 +1,53 @@
+import numpy as np
+
+from tests.helpers import NoDropoutConfig, get_batch
+from tricycle.loss import CrossEntropy
+from tricycle.models import GPT
+from tricycle.optimisers import FusedAdamW
+from tricycle.parallel import DataParallel
+
+
+def test_data_parallel_matches_single_process():
+    config = NoDropoutConfig()
+    loss_fn = CrossEntropy()
+
+    np.random.seed(0)
+    model = GPT(config)
+    model.flatten_parameters()
+    np.random.seed(0)
+    parallel_model = GPT(config)
+
+    batches = [get_batch(config, batch_size=6) for _ in range(2)]
+
+    optimiser = FusedAdamW(learning_rate=1e-2)
+    expected_losses = []
+    for inputs, outputs in batches:
+        loss = loss_fn(outputs, model(inputs))
+        loss.backward()
+        expected_losses.append(float(loss.array))
+        expected_grads = model.flat_parameters.grads.copy()
+        model.update(optimiser)
+        optimiser.step()
+        model.zero_grad()
+
+    optimiser = FusedAdamW(learning_rate=1e-2)
+    losses = []
+    # 4 workers don't divide a batch of 6 evenly so the shards have
+    # different sizes
+    with DataParallel(parallel_model, loss_fn, n_workers=4) as parallel:
+        for inputs, outputs in batches:
+            losses.append(parallel.forward_backward(inputs, outputs))
+            grads = parallel_model.flat_parameters.grads.copy()
+            parallel_model.update(optimiser)
+            optimiser.step()
+            parallel_model.zero_grad()
+
+    # the second step can only match if the workers saw the updated weights
+    assert np.allclose(losses, expected_losses, rtol=1e-4)
+    assert np.allclose(grads, expected_grads, rtol=1e-3, atol=1e-6)
+    assert np.allclose(
+        parallel_model.flat_parameters.params,
+        model.flat_parameters.params,
+        rtol=1e-3,
+        atol=1e-6,
+    )
@@ -0,0 +1,139 @@
+import numpy as np
+
+from tests.helpers import NoDropoutConfig
+from tricycle.layers import Dense
+from tricycle.loss import CrossEntropy
+from tricycle.models import GPT
+from tricycle.optimisers import FusedAdamW, FusedStochasticGradientDescent
+from tricycle.parameters import FlatParameters
+from tricycle.tensor import Tensor
+
+
+def test_flat_parameters_are_views():
+    np.random.seed(0)
+    layer_1 = Dense(3, 4)
+    layer_2 = Dense(4, 2)
+    weights_1 = layer_1.weights.array.copy()
+
+    parameters = FlatParameters(layer_1.parameters() + layer_2.parameters())
+
+    assert parameters.size == 3 * 4 + 4 * 2
+    assert np.allclose(layer_1.weights.array, weights_1)
+
+    parameters.params[:] = 1
+    assert np.allclose(layer_1.weights.array, 1)
+    assert np.allclose(layer_2.weights.array, 1)
+
+    x = Tensor(np.random.random((5, 3)), is_batched=True)
+    layer_2(layer_1(x)).from_batched().sum().backward()
+
+    # the backward pass should write straight into the flat buffer
+    assert np.allclose(
+        parameters.grads[:12], layer_1.weights.grad.array.ravel()
+    )
+    assert np.abs(parameters.grads).sum() > 0
+
+    parameters.zero_grad()
+    assert np.allclose(layer_1.weights.grad.array, 0)
+
+
+def test_clip_grad_norm():
+    layer = Dense(3, 4)
+    parameters = FlatParameters(layer.parameters())
+    parameters.grads[:] = 3
+
+    norm = parameters.clip_grad_norm(1.0)
+
+    assert np.isclose(norm, np.sqrt(12 * 9))
+    assert np.isclose(parameters.grad_norm(), 1.0, atol=1e-6)
+
+
+def test_fused_adamw_matches_reference():
+    np.random.seed(0)
+    layer = Dense(3, 4)
+    parameters = FlatParameters(layer.parameters())
+    optimiser = FusedAdamW(learning_rate=1e-2, weight_decay=0.1)
+
+    weights = layer.weights.array.astype(np.float64)
+    momentum = np.zeros_like(weights)
+    square_momentum = np.zeros_like(weights)
+    beta_1, beta_2 = optimiser.betas
+
+    for step in range(1, 4):
+        grad = np.random.random(weights.shape)
+        layer.weights.grad.array[...] = grad
+
+        optimiser.update_flat(parameters)
+        optimiser.step()
+        parameters.zero_grad()
+
+        momentum = beta_1 * momentum + (1 - beta_1) * grad
+        square_momentum = beta_2 * square_momentum + (1 - beta_2) * grad**2
+        momentum_estimate = momentum / (1 - beta_1**step)
+        square_momentum_estimate = square_momentum / (1 - beta_2**step)
+        weights -= 1e-2 * (
+            momentum_estimate / (np.sqrt(square_momentum_estimate) + 1e-6)
+            + 0.1 * weights
+        )
+
+        assert np.allclose(layer.weights.array, weights, atol=1e-6)
+
+
+def test_fused_sgd_matches_reference():
+    np.random.seed(0)
+    layer = Dense(3, 4)
+    parameters = FlatParameters(layer.parameters())
+    optimiser = FusedStochasticGradientDescent(
+        learning_rate=1e-1, weight_decay=0.1, momentum=0.9
+    )
+
+    weights = layer.weights.array.astype(np.float64)
+    velocity = np.zeros_like(weights)
+    for _ in range(3):
+        grad = np.random.random(weights.shape)
+        layer.weights.grad.array[...] = grad
+
+        optimiser.update_flat(parameters)
+        parameters.zero_grad()
+
+        velocity = 0.9 * velocity + 1e-1 * (grad + 0.1 * weights)
+        weights -= velocity
+
+        assert np.allclose(layer.weights.array, weights, atol=1e-6)
+
+
+def test_gpt_flat_parameters_training_step():
+    np.random.seed(0)
+    config = NoDropoutConfig()
+    model = GPT(config)
+    loss_fn = CrossEntropy()
+
+    inputs = np.random.randint(
+        0, config.vocab_size, (4, config.context_window)
+    )
+    outputs = np.random.randint(
+        0, config.vocab_size, (4, config.context_window)
+    )
+    inputs = Tensor(inputs, requires_grad=False, is_batched=True, dtype=int)
+    outputs = Tensor(outputs, requires_grad=False, is_batched=True, dtype=int)
+
+    loss_fn(outputs, model(inputs)).backward()
+    expected = [p.grad.array.copy() for p in model.parameters()]
+    model.zero_grad()
+
+    parameters = model.flatten_parameters()
+    assert parameters.size == sum(p.array.size for p in model.parameters())
+
+    loss = loss_fn(outputs, model(inputs))
+    loss.backward()
+    for parameter, grad in zip(model.parameters(), expected):
+        assert np.allclose(parameter.grad.array, grad, atol=1e-6)
+
+    before = parameters.params.copy()
+    model.update(FusedAdamW(learning_rate=1e-3))
+    model.zero_grad()
+    assert not np.allclose(parameters.params, before)
+    assert np.allclose(parameters.grads, 0)
+
+    new_loss = loss_fn(outputs, model(inputs))
+    assert new_loss.array < loss.array
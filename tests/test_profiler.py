@@ -0,0 +1,71 @@
+import json
+
+import numpy as np
+
+from tests.helpers import NoDropoutConfig
+from tricycle.context import TRICYCLE_CONTEXT
+from tricycle.graph import Tape
+from tricycle.layers import Dense
+from tricycle.models import GPT
+from tricycle.profiler import Profiler
+from tricycle.tensor import Tensor
+
+
+def test_profiler_records_forward_and_backward():
+    np.random.seed(0)
+    layer = Dense(4, 3)
+    layer.weights.name = "dense_weights"
+    tensor = Tensor(np.random.random((2, 4)), is_batched=True)
+
+    with Profiler() as profiler:
+        assert TRICYCLE_CONTEXT.profiler is profiler
+        layer(tensor).from_batched().sum().backward()
+        profiler.step()
+        layer(tensor).from_batched().sum().backward()
+    assert TRICYCLE_CONTEXT.profiler is None
+
+    categories = {event.category for event in profiler.events}
+    assert categories == {"layer", "forward", "backward"}
+
+    dense = [event for event in profiler.events if event.name == "Dense"]
+    assert len(dense) == 2
+    assert [event.step for event in dense] == [0, 1]
+    assert dense[0].input_shapes == [(2, 4)]
+    assert dense[0].output_shapes == [(2, 3)]
+    assert dense[0].output_bytes == 2 * 3 * 4
+
+    # the gradient for the weights is attributed to the weights
+    backward = profiler.summary(step=1)
+    assert any(
+        stat.category == "backward" and stat.tensor == "dense_weights"
+        for stat in backward
+    )
+    assert all(stat.calls >= 1 for stat in backward)
+    assert "Dense" in profiler.table(n=5)
+
+
+def test_profiler_exports_chrome_trace(tmp_path):
+    np.random.seed(0)
+    config = NoDropoutConfig()
+    model = GPT(config)
+    inputs = Tensor(
+        np.random.randint(0, config.vocab_size, (2, config.context_window)),
+        requires_grad=False,
+        is_batched=True,
+        dtype=int,
+    )
+
+    with Profiler() as profiler:
+        with Tape() as tape:
+            loss = model(inputs).from_batched().sum()
+        tape.backward(loss)
+
+    path = tmp_path / "trace.json"
+    profiler.export_chrome_trace(path)
+    trace = json.loads(path.read_text())
+
+    assert len(trace["traceEvents"]) == len(profiler.events)
+    event = trace["traceEvents"][0]
+    assert event["ph"] == "X"
+    assert event["dur"] >= 0
+    assert profiler.step_times()[0]["backward"] > 0
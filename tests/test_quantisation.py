@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+
+from tests.helpers import NoDropoutConfig
+from tricycle.context import NoGrad
+from tricycle.layers import Dense, Embedding
+from tricycle.models import GPT
+from tricycle.quantisation import (
+    QuantisedDense,
+    QuantisedEmbedding,
+    load_quantised,
+    pack_int4,
+    quantise_model,
+    save_quantised,
+    unpack_int4,
+)
+from tricycle.tensor import Tensor
+
+
+def test_int4_packing_round_trip():
+    values = np.random.randint(-8, 8, (7, 5)).astype(np.int8)
+
+    # sourcery skip: no-loop-in-tests
+    for axis in [0, 1]:
+        packed = pack_int4(values, axis=axis)
+        assert packed.dtype == np.uint8
+        assert packed.shape[axis] == (values.shape[axis] + 1) // 2
+        unpacked = unpack_int4(packed, values.shape[axis], axis=axis)
+        assert np.array_equal(unpacked, values)
+
+
+@pytest.mark.parametrize("bits, tolerance", [(8, 1e-2), (4, 2e-1)])
+def test_quantised_layers_match_float_layers(bits, tolerance):
+    np.random.seed(0)
+    dense = Dense(from_size=9, to_size=12)
+    inputs = Tensor(np.random.random((2, 3, 9)), is_batched=True)
+    # use a small block size so we test more than one block
+    quantised = QuantisedDense.from_dense(dense, bits=bits, block_size=5)
+
+    expected = dense(inputs).array
+    assert np.allclose(quantised(inputs).array, expected, atol=tolerance)
+
+    embedding = Embedding(from_size=11, to_size=7)
+    tokens = Tensor(
+        np.random.randint(0, 11, (2, 3)),
+        requires_grad=False,
+        is_batched=True,
+        dtype=int,
+    )
+    quantised = QuantisedEmbedding.from_embedding(embedding, bits=bits)
+    assert np.allclose(
+        quantised(tokens).array, embedding(tokens).array, atol=tolerance
+    )
+
+
+def test_quantised_gpt_save_and_load(tmp_path):
+    np.random.seed(0)
+    config = NoDropoutConfig()
+    model = GPT(config)
+    tokens = Tensor(
+        np.random.randint(0, config.vocab_size, (2, config.context_window)),
+        requires_grad=False,
+        is_batched=True,
+        dtype=int,
+    )
+    with NoGrad():
+        expected = model(tokens).array
+
+    model = quantise_model(model)
+    assert isinstance(model.head, QuantisedDense)
+    assert model.layers[-1] is model.head
+    assert isinstance(model.token_embedding, QuantisedEmbedding)
+    assert model.head.values.dtype == np.int8
+    # only the norm layers are left as trainable parameters
+    assert all(
+        not isinstance(layer, (Dense, Embedding)) for layer in model.layers
+    )
+
+    with NoGrad():
+        quantised = model(tokens).array
+    assert np.allclose(quantised, expected, atol=5e-2)
+
+    path = tmp_path / "model.pkl"
+    save_quantised(model, path)
+    loaded = load_quantised(path)
+    with NoGrad():
+        assert np.array_equal(loaded(tokens).array, quantised)
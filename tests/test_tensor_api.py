@@ -1,3 +1,4 @@
+import pickle
 from copy import deepcopy
 
 import numpy as np
@@ -8,6 +9,7 @@ from tricycle.binary import (
     BinaryMultiply,
     BinarySubtract,
 )
+from tricycle.layers import Dense
 from tricycle.ops import Tensor
 from tricycle.unary import UnaryAdd, UnaryDivide, UnaryMultiply, UnarySubtract
 
@@ -67,3 +69,60 @@ def test_can_pow_tensors():
     tensor_1 = Tensor(np.arange(12).reshape(3, 4))
 
     assert (tensor_1**2).close_to(pow(tensor_1, 2))
+
+
+def test_tensor_wraps_arrays_without_copying():
+    array = np.ones((3, 4), dtype=np.float32)
+
+    tensor = Tensor(array)
+    assert np.shares_memory(tensor.array, array)
+
+    tensor = Tensor(array, copy=True)
+    assert not np.shares_memory(tensor.array, array)
+
+    # the dtype is different so we need a copy
+    tensor = Tensor(array.astype(np.float64))
+    assert tensor.dtype == np.float32
+
+
+def test_accumulating_grads_does_not_modify_shared_grads():
+    x = Tensor(np.ones(4))
+    y = x + 1
+    z = y + x
+
+    z.backward()
+
+    assert x.grad.close_to(np.full(4, 2))
+    assert y.grad.close_to(np.ones(4))
+    assert z.grad.close_to(np.ones(4))
+
+
+def test_pickled_tensors_keep_unique_ids():
+    tensor = Tensor(np.arange(4), name="x")
+
+    loaded = pickle.loads(pickle.dumps(tensor))
+
+    assert loaded._id == tensor._id
+    assert loaded.name == "x"
+    assert loaded.close_to(tensor)
+    assert Tensor(np.arange(4))._id > loaded._id
+    assert not hasattr(loaded, "__dict__")
+
+
+def test_backward_releases_graph_unless_retained():
+    layer = Dense(4, 3)
+    inputs = Tensor(np.ones((2, 4)), is_batched=True)
+
+    output = layer(inputs).sum()
+    output.backward(retain_graph=True)
+    assert output.args is not None
+    assert layer._input is not None
+
+    # gradients from the second pass are added to the first
+    first_grad = layer.weights.grad.array.copy()
+    output.backward()
+    assert layer.weights.grad.close_to(first_grad * 2)
+
+    assert output.args is None
+    assert output.back_fns is None
+    assert layer._input is None
@@ -14,7 +14,7 @@ import uuid
 from pathlib import Path
 
 from tricycle import GPU_ENABLED
-from tricycle.context import TRICYCLE_CONTEXT
+from tricycle.context import TRICYCLE_CONTEXT, NoGrad
 from tricycle.ops import Op
 from tricycle.tensor import Tensor
 from tricycle.utils import UseMixedPrecision, optimal_n_tokens
@@ -30,7 +30,8 @@ from tqdm import tqdm
 from inference import get_sample
 from tricycle.configs import SmolGPTConfig
 from tricycle.dataset import CausalLMDataset
-from tricycle.loss import CrossEntropy
+from tricycle.graph import Tape
+from tricycle.loss import ChunkedCrossEntropy
 from tricycle.models import GPT
 from tricycle.optimisers import AdamW
 from tricycle.scheduler import CosineSchedule
@@ -69,6 +70,7 @@ def load_datasets(config: SmolGPTConfig):
         .batch()
         .shuffle()  # only shuffle train dataset.
         .to_tensor()
+        .prefetch()  # build the next batches while the model is training
     )
     valid_dataloader = (
         CausalLMDataset(
@@ -110,9 +112,11 @@ def estimate_loss(
             inputs = inputs.to_gpu(config.device_idx)
             outputs = outputs.to_gpu(config.device_idx)
 
-        # forward pass
-        logits = model(inputs)
-        loss = loss_fn(outputs, logits)
+        # forward pass. We never go backward so there is no need to keep
+        # the graph around
+        with NoGrad():
+            hidden = model.hidden_states(inputs)
+            loss = loss_fn(outputs, hidden, model.head.weights)
         batch_loss += loss.array / config.eval_steps
 
     return batch_loss
@@ -166,7 +170,8 @@ model.display()
 # tokens and steps we should train for
 n_tokens, n_steps = optimal_n_tokens(model, config)
 
-loss_fn = CrossEntropy()
+# fuse the head and the loss so we never store the full (huge) logits
+loss_fn = ChunkedCrossEntropy()
 scheduler = CosineSchedule(
     max_learning_rate=config.max_learning_rate,
     min_learning_rate=config.min_learning_rate,
@@ -213,11 +218,13 @@ with mlflow.start_run() as run, UseMixedPrecision():
                 inputs = inputs.to_gpu(config.device_idx)
                 outputs = outputs.to_gpu(config.device_idx)
 
-            # forward and backward pass
-            logits = model(inputs)
-            loss = loss_fn(outputs, logits)
+            # forward and backward pass. Recording the forward pass on a tape
+            # lets us skip rediscovering the graph when we go backward
+            with Tape() as tape:
+                hidden = model.hidden_states(inputs)
+                loss = loss_fn(outputs, hidden, model.head.weights)
             batch_loss += loss.array / config.gradient_accumulation_steps
-            loss.backward()
+            tape.backward(loss)
 
         # Use the optimiser to update weights
         model.update(optimiser)